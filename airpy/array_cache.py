@@ -0,0 +1,138 @@
+"""
+Module for caching fetched GEE pixel arrays on local disk
+"""
+
+import numpy as np
+import os
+import json
+import hashlib
+import threading
+import zipfile
+
+
+class ArrayCache:
+    def __init__(self, cache_dir, max_bytes=1024 * 1024 * 1024):
+        """
+        Content-addressed cache of band arrays over buffer extents of points,
+        stored compressed and evicted least recently used first once the
+        cache grows over max_bytes
+        :param cache_dir: directory arrays are cached in
+        :param max_bytes: maximum size of cache on disk in bytes
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self.size = sum(size for _, _, size in self.list_entries())
+
+    def get_key(self, point, scale):
+        """
+        Get cache key of point from the parameters determining its band array
+        :param point: point from getRequests
+        :param scale: scale in metres the GEE image is sampled at
+        :return: hex digest key
+        """
+        lon, lat = point['coordinates']
+        params = [point['gee_data'], point['band'], point['query_year'], point['query_month'],
+                  point['t_cadence'], point['analysis_type'], str(point['resolution']), float(scale),
+                  str(point['buffer']), float(lat), float(lon)]
+        if point.get('query_end') is not None:
+            params.append(point['query_end'])
+        return hashlib.sha256(json.dumps(params).encode('utf-8')).hexdigest()
+
+    def get_path(self, key):
+        # Spread entries over subdirectories so no single directory grows too large
+        return '{}/{}/{}.npz'.format(self.cache_dir, key[:2], key)
+
+    def list_entries(self):
+        """
+        List cached arrays
+        :return: list of (path, last access time, size in bytes)
+        """
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for file in files:
+                if not file.endswith('.npz') or '.tmp' in file:
+                    continue
+                path = os.path.join(root, file)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def get(self, key):
+        """
+        Get cached band array
+        :param key: key from get_key
+        :return: numpy array, None if not cached
+        """
+        path = self.get_path(key)
+        try:
+            with np.load(path) as data:
+                band_arr = data['band_arr']
+            # Modification time marks last access for LRU eviction
+            os.utime(path)
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return band_arr
+
+    def put(self, key, band_arr):
+        """
+        Cache band array, only complete 2D arrays, or 3D arrays of time steps of time
+        series runs, are cached so failed samples are fetched again
+        :param key: key from get_key
+        :param band_arr: numpy array of band
+        """
+        if not isinstance(band_arr, np.ndarray) or band_arr.ndim not in [2, 3]:
+            return
+        path = self.get_path(key)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so an interrupted write never leaves a partial array in the cache
+        tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, band_arr=band_arr)
+        with self.lock:
+            if os.path.exists(path):
+                self.size -= os.path.getsize(path)
+            os.replace(tmp_path, path)
+            self.size += os.path.getsize(path)
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used arrays until cache is under 90% of max_bytes
+        """
+        entries = sorted(self.list_entries(), key=lambda entry: entry[1])
+        self.size = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if self.size <= 0.9 * self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
+            self.evictions += 1
+
+    def get_stats(self):
+        """
+        Get cache statistics of the run
+        :return: dictionary of hits, misses, evictions and cache size in bytes
+        """
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'size': self.size}
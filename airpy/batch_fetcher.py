@@ -0,0 +1,217 @@
+"""
+Module for fetching GEE data for many points in batched requests
+"""
+
+import ee
+import numpy as np
+from run_report import count_event
+
+# Pixel limit per buffer when reducing server-side, GEE default maxPixels of reductions
+REDUCE_MAX_PIXELS = 10000000
+
+
+class BatchFetcher:
+    def __init__(self, processor_modules, batch_size=64, max_pixels=1048576):
+        """
+        :param processor_modules: ProcessorModules of the run, used to build the
+        GEE image and for the per-point fallback
+        :param batch_size: maximum number of points per GEE request
+        :param max_pixels: maximum number of pixels returned per GEE request
+        """
+        self.processor_modules = processor_modules
+        self.band = processor_modules.band
+        self.buffer_size = processor_modules.buffer_size
+        self.default_value = processor_modules.get_default_value()
+        self.batch_size = batch_size
+        self.max_pixels = max_pixels
+
+    def get_point_pixels(self):
+        """
+        Estimate number of pixels sampled over buffer extent of a point
+        :return: pixel count of buffer extent
+        """
+        side = 2 * float(self.buffer_size) / self.get_sample_scale() + 1
+        # Time series runs return the pixels of every time step
+        return int(side * side) * len(self.processor_modules.get_sample_bands())
+
+    def get_sample_scale(self, max_pixels=None):
+        """
+        Get scale in metres the GEE image is sampled at
+        :param max_pixels: GEE pixel limit per buffer, default sampleRectangle limit
+        :return: sampling scale
+        """
+        scale = self.processor_modules.get_sample_scale(max_pixels)
+        if scale is None:
+            scale = float(self.processor_modules.resolution)
+        return scale
+
+    def get_batches(self, indices, pixel_limit=True):
+        """
+        Split point indices into batches that respect both the
+        maximum points and maximum pixels per request
+        :param indices: list of point indices to fetch
+        :param pixel_limit: limit batches by returned pixels, not needed if reduced by GEE
+        :return: list of lists of point indices
+        """
+        points_per_request = self.batch_size
+        if pixel_limit:
+            points_per_request = max(1, min(self.batch_size, self.max_pixels // self.get_point_pixels()))
+        return [indices[i:i + points_per_request] for i in range(0, len(indices), points_per_request)]
+
+    def make_rois(self, points, bounds=False):
+        """
+        Make feature collection of buffered rois around points
+        :param points: list of points from getRequests
+        :param bounds: use bounding box of buffer, matching the extent sampleRectangle returns
+        :return: GEE FeatureCollection of rois
+        """
+        features = []
+        for i in range(len(points)):
+            roi = ee.Geometry.Point(points[i]['coordinates']).buffer(int(self.buffer_size))
+            if bounds:
+                roi = roi.bounds()
+            features.append(ee.Feature(roi, {'index': i}))
+        return ee.FeatureCollection(features)
+
+    def sample_rois(self, rois, img):
+        """
+        Sample img over every roi, to be requested with a single getInfo
+        :param rois: GEE FeatureCollection of rois
+        :param img: GEE image from prepare_image
+        :return: GEE list of band arrays, ordered as rois
+        """
+        def sample_roi(roi):
+            sq_extent = img.sampleRectangle(region=roi.geometry(), defaultValue=self.default_value)
+            return roi.set('band_arr', self.processor_modules.get_band_value(sq_extent))
+
+        return rois.map(sample_roi).aggregate_array('band_arr')
+
+    def reduce_points(self, points, reducer, output_names):
+        """
+        Reduce img over buffer extent of all points server-side by GEE,
+        in as few requests as possible. As only the reduced values are
+        returned, the image is not resampled unless the buffer exceeds
+        the much larger reducer pixel limit
+        :param points: list of points from getRequests
+        :param reducer: GEE reducer
+        :param output_names: names of reducer outputs
+        :return: list of dictionaries of reducer outputs, ordered as points,
+        None where point was skipped
+        """
+        reductions = [None] * len(points)
+        to_fetch = []
+        for i in range(len(points)):
+            lon, lat = points[i]['coordinates']
+            if not self.processor_modules.skip_point(lat, lon):
+                to_fetch.append(i)
+
+        if len(to_fetch) == 0:
+            return reductions
+
+        # Masked pixels are counted as the default value, as sampleRectangle does
+        img = self.processor_modules.prepare_image(REDUCE_MAX_PIXELS).unmask(self.default_value)
+        scale = self.get_sample_scale(REDUCE_MAX_PIXELS)
+        for batch in self.get_batches(to_fetch, pixel_limit=False):
+            rois = self.make_rois([points[i] for i in batch], bounds=True)
+            reduced = img.reduceRegions(collection=rois, reducer=reducer, scale=scale)
+            reduced = reduced.select(['index'] + output_names, None, False).getInfo()
+            for feature in reduced['features']:
+                properties = feature['properties']
+                reductions[batch[int(properties.pop('index'))]] = properties
+
+        return reductions
+
+    def fetch_histograms(self, points):
+        """
+        Fetch value: pixel count histograms over buffer extent for all points
+        :param points: list of points from getRequests
+        :return: list of histogram dictionaries, ordered as points
+        """
+        reducer = ee.Reducer.frequencyHistogram().unweighted()
+        reductions = self.reduce_points(points, reducer, ['histogram'])
+        histograms = []
+        for reduction in reductions:
+            if reduction is None:
+                histograms.append(self.parse_histogram(None))
+            else:
+                histograms.append(self.parse_histogram(reduction.get('histogram')))
+        return histograms
+
+    def fetch_stats(self, points):
+        """
+        Fetch mean, min, max, variance and mode over buffer extent for all points
+        :param points: list of points from getRequests
+        :return: list of statistics dictionaries, ordered as points
+        """
+        reducer = ee.Reducer.mean().combine(ee.Reducer.minMax(), sharedInputs=True). \
+            combine(ee.Reducer.variance(), sharedInputs=True). \
+            combine(ee.Reducer.mode(), sharedInputs=True).unweighted()
+        stat_names = ['mean', 'min', 'max', 'variance', 'mode']
+        reductions = self.reduce_points(points, reducer, stat_names)
+        stats = []
+        for reduction in reductions:
+            point_stats = {}
+            for name in stat_names:
+                # Skipped points and points without pixels are set to defaultValue, as in the array path
+                if reduction is None or reduction.get(name) is None:
+                    point_stats[name] = 0 if name == 'variance' else self.default_value
+                else:
+                    point_stats[name] = reduction[name]
+            stats.append(point_stats)
+        return stats
+
+    def parse_histogram(self, histogram):
+        """
+        Convert GEE histogram with string keys to numeric value: pixel count
+        :param histogram: dictionary returned by GEE frequencyHistogram
+        :return: dictionary of value: pixel count
+        """
+        if not histogram:
+            return {self.default_value: 1}
+        parsed = {}
+        for k, v in histogram.items():
+            value = float(k)
+            if value.is_integer():
+                value = int(value)
+            parsed[value] = int(v)
+        return parsed
+
+    def fetch_arrays(self, points):
+        """
+        Fetch band arrays over buffer extent for all points in as few
+        GEE requests as possible
+        :param points: list of points from getRequests
+        :return: list of numpy arrays, ordered as points
+        """
+        arrays = [None] * len(points)
+        to_fetch = []
+        for i in range(len(points)):
+            lon, lat = points[i]['coordinates']
+            if self.processor_modules.skip_point(lat, lon):
+                arrays[i] = self.processor_modules.get_default_array()
+            else:
+                to_fetch.append(i)
+
+        if len(to_fetch) == 0:
+            return arrays
+
+        img = self.processor_modules.prepare_image()
+        for batch in self.get_batches(to_fetch):
+            rois = self.make_rois([points[i] for i in batch])
+            try:
+                band_arrs = self.sample_rois(rois, img).getInfo()
+            except Exception as e:
+                if 'Image.sampleRectangle' not in str(e):
+                    raise
+                # A single roi over the pixel limit fails the whole request, fall back to sampling per point
+                print('Batch of {} points failed with: {} Sampling points individually.'.format(len(batch), str(e)))
+                count_event('unbatched_points', len(batch))
+                band_arrs = [None] * len(batch)
+            for i, band_arr in zip(batch, band_arrs):
+                if band_arr is None:
+                    lon, lat = points[i]['coordinates']
+                    arrays[i] = self.processor_modules.sample_band_array(lat, lon, img)
+                else:
+                    arrays[i] = np.array(band_arr)
+
+        return arrays
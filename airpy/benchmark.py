@@ -0,0 +1,279 @@
+'''
+Benchmarks the stages of the airPy pipeline offline, separately and end to end,
+on the GEE stand-in, and saves timings and peak memory to a json file
+'''
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import resource
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import xarray as xr
+from run_airpy import getRequests, getProcessorModules, getResult, fetchGovernedPoints
+from generate_config import GenerateConfig
+from feature_engine import get_feature_engine
+from feature_record import FeatureRecord
+from metric_utils import MetricUtils
+from mock_backend import MockEE, patch_ee
+from batch_fetcher import BatchFetcher
+from io_engine import IOEngine
+from rate_governor import RateGovernor
+from utils import Utils
+
+STAGES = ['requests', 'extraction', 'metrics', 'combine', 'add_time', 'save_netcdf', 'save_csv']
+
+parser = argparse.ArgumentParser(description='airPy benchmarks',
+                                 formatter_class=argparse.RawTextHelpFormatter)
+parser.add_argument("--sizes",
+                    help='''
+                    Regions to benchmark, any of the regions of run_airpy,
+                    i.e. toar2 (1129 stations), europe or globe (51200 points).
+                    Default toar2 europe.
+                    ''',
+                    nargs='+',
+                    default=['toar2', 'europe'])
+parser.add_argument("--stages",
+                    help='''
+                    Stages to benchmark. Default all:
+                    {}
+                    '''.format(' '.join(STAGES)),
+                    nargs='+',
+                    choices=STAGES,
+                    default=STAGES)
+parser.add_argument("--gee_data",
+                    help='''
+                    Dataset of interest. Default fire.
+                    ''',
+                    default='fire')
+parser.add_argument("--band",
+                    help='''
+                    Band of interest. Default dataset default band.
+                    ''',
+                    default=None)
+parser.add_argument("--date",
+                    help='''
+                    Date of query. Must be format YYYY-MM-DD. Default 2019-01-01.
+                    ''',
+                    default='2019-01-01')
+parser.add_argument("--buffer_size",
+                    help='''
+                    Buffer extent in metres. Default 55500.
+                    ''',
+                    default=55500)
+parser.add_argument("--metric_points",
+                    help='''
+                    Number of points metrics are calculated for in
+                    the metrics stage. Default 1000.
+                    ''',
+                    type=int,
+                    default=1000)
+parser.add_argument("--io_workers",
+                    help='''
+                    Number of concurrent requests to the GEE stand-in. Default 64.
+                    ''',
+                    type=int,
+                    default=64)
+parser.add_argument("--cpu_workers",
+                    help='''
+                    Number of processes calculating features, 0 to calculate
+                    in the main process so its memory is measured. Default 0.
+                    ''',
+                    type=int,
+                    default=0)
+parser.add_argument("--batch_size",
+                    help='''
+                    Points per request to the GEE stand-in. Default 1.
+                    ''',
+                    type=int,
+                    default=1)
+parser.add_argument("--mock_latency",
+                    help='''
+                    Mean seconds per request of the GEE stand-in. Default 0.
+                    ''',
+                    type=float,
+                    default=0.0)
+parser.add_argument("--save_dir",
+                    help='''
+                    Directory configs and saved features are written to.
+                    Default temporary directory.
+                    ''',
+                    default=None)
+parser.add_argument("--output",
+                    help='''
+                    Json file benchmark results are saved to.
+                    Default benchmark_results.json.
+                    ''',
+                    default='benchmark_results.json')
+
+
+def runStage(results, size, stage, n_points, fn, *args):
+    """
+    Time stage and measure its peak memory allocated by python and numpy. The stage is
+    run twice, timed without tracemalloc, whose tracing of every allocation slows
+    the stage down, then traced for peak memory
+    :param: results: list stage results are appended to
+    :param: size: region benchmarked
+    :param: stage: stage name
+    :param: n_points: number of points processed by stage
+    :param: fn: function running the stage
+    :return: output of fn
+    """
+    gc.collect()
+    st = time.perf_counter()
+    output = fn(*args)
+    elapsed = time.perf_counter() - st
+
+    gc.collect()
+    tracemalloc.start()
+    fn(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    results.append({'size': size,
+                    'stage': stage,
+                    'points': n_points,
+                    'seconds': elapsed,
+                    'points_per_second': n_points / elapsed if elapsed > 0 else None,
+                    'peak_memory_mb': peak / (1024 * 1024)})
+    print('{:<10} {:<12} {:>7} points {:>10.3f} s {:>10.1f} MB'.format(size, stage, n_points, elapsed,
+                                                                       peak / (1024 * 1024)))
+    return output
+
+
+def getConfig(args, size, save_dir):
+    """
+    Generate config of benchmarked region
+    :param: args: parsed CLI arguments
+    :param: size: region benchmarked
+    :param: save_dir: directory configs and features are saved to
+    :return: config dictionary
+    """
+    generate_config = GenerateConfig(args.gee_data, size, args.date, 'collection', 'True', args.buffer_size,
+                                     '{}/configs'.format(save_dir), save_dir, args.band, 'netcdf')
+    return generate_config.generate_config_dict()
+
+
+def makeRecords(points):
+    """
+    Make synthetic FeatureRecords of points, so stages after extraction are
+    benchmarked independently of it
+    :param: points: list of lat, lon points with config information
+    :return: list of FeatureRecords
+    """
+    feature_engine = get_feature_engine(points[0]['dataset_name'], points[0]['band'])
+    rng = np.random.default_rng(0)
+    values = rng.random((len(points), len(feature_engine.names)))
+    return [FeatureRecord(point['coordinates'][1], point['coordinates'][0], feature_engine.names, values[i])
+            for i, point in enumerate(points)]
+
+
+def extractPoints(points, io_engine, mock_ee, batch_size):
+    """
+    Extract features of points with the GEE requests of the pipeline made to the GEE stand-in
+    :param: points: list of lat, lon points with config information
+    :param: io_engine: IOEngine requests and feature calculation are run with
+    :param: mock_ee: MockEE requests are made to
+    :param: batch_size: points per request
+    :return: list of results
+    """
+    def fetch_points(chunk):
+        return fetchGovernedPoints(chunk, 'array', io_engine)
+
+    with patch_ee(mock_ee):
+        return io_engine.run(points, fetch_points, getResult, batch_size=batch_size, governed=False)
+
+
+def calcMetrics(points, arrays):
+    """
+    Calculate features of band arrays
+    :param: points: list of lat, lon points with config information
+    :param: arrays: band arrays of points
+    :return: list of feature values
+    """
+    feature_engine = get_feature_engine(points[0]['dataset_name'], points[0]['band'])
+    return [feature_engine.compute(MetricUtils(np_arr)) for np_arr in arrays]
+
+
+def runBenchmark(args, size, save_dir, results):
+    """
+    Benchmark stages of pipeline over region
+    :param: args: parsed CLI arguments
+    :param: size: region benchmarked
+    :param: save_dir: directory configs and features are saved to
+    :param: results: list stage results are appended to
+    """
+    config_data = getConfig(args, size, save_dir)
+    points = getRequests(config_data)
+    if 'requests' in args.stages:
+        runStage(results, size, 'requests', len(points), getRequests, config_data)
+
+    if 'extraction' in args.stages:
+        governor = RateGovernor(rate=1000000.0, max_rate=1000000.0, max_concurrency=args.io_workers)
+        io_engine = IOEngine(args.io_workers, args.cpu_workers, governor)
+        runStage(results, size, 'extraction', len(points), extractPoints, points, io_engine,
+                 MockEE(latency=args.mock_latency), args.batch_size)
+
+    if 'metrics' in args.stages:
+        metric_points = points[:args.metric_points]
+        with patch_ee(MockEE(latency=0)):
+            batch_fetcher = BatchFetcher(getProcessorModules(points[0]), batch_size=len(metric_points))
+            arrays = batch_fetcher.fetch_arrays(metric_points)
+        runStage(results, size, 'metrics', len(metric_points), calcMetrics, metric_points, arrays)
+        del arrays
+
+    records = makeRecords(points)
+    utils = Utils(config_data)
+    if len(set(args.stages) & {'combine', 'add_time', 'save_netcdf'}) > 0:
+        if 'combine' in args.stages:
+            results_xr = runStage(results, size, 'combine', len(points), utils.combine_data, records)
+        else:
+            results_xr = utils.combine_data(records)
+        if 'add_time' in args.stages:
+            results_xr = runStage(results, size, 'add_time', len(points), utils.add_time_data, results_xr)
+        elif 'save_netcdf' in args.stages:
+            # Features are saved with their time axis, as by run_airpy with add_time on
+            results_xr = utils.add_time_data(results_xr)
+        if 'save_netcdf' in args.stages:
+            runStage(results, size, 'save_netcdf', len(points), utils.save_collection, results_xr)
+
+    if 'save_csv' in args.stages:
+        runStage(results, size, 'save_csv', len(points), utils.save_custom_df, records)
+
+
+def getEnvironment():
+    """
+    Get environment benchmarks were run in
+    :return: dictionary of environment details
+    """
+    return {'date': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'xarray': xr.__version__,
+            'cpu_count': os.cpu_count()}
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    save_dir = args.save_dir
+    if save_dir is None:
+        save_dir = tempfile.mkdtemp(prefix='airpy_benchmark_')
+
+    results = []
+    for size in args.sizes:
+        runBenchmark(args, size, save_dir, results)
+
+    benchmark = {'environment': getEnvironment(),
+                 'arguments': vars(args),
+                 'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                 'results': results}
+    with open(args.output, 'w') as json_file:
+        json.dump(benchmark, json_file, indent=4)
+    print('Benchmark results saved to {}'.format(args.output))
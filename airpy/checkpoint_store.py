@@ -0,0 +1,168 @@
+"""
+Module for checkpointing point results to disk as they complete,
+so interrupted runs can be resumed
+"""
+
+import os
+import json
+import time
+import pickle
+import struct
+import hashlib
+
+# Length prefix of each checkpoint record
+RECORD_HEADER = struct.Struct('<Q')
+
+
+def get_run_key(items):
+    """
+    Get hash of the points of a run, so saved results are only reused by an identical run
+    :param items: list of points from getRequests
+    :return: hex digest
+    """
+    return hashlib.sha256(json.dumps(items, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class CheckpointStore:
+    def __init__(self, checkpoint_dir, items, sync_every=100, sync_interval=5.0):
+        """
+        Append-only file of (index, result) records. Each record is flushed to the
+        OS as it is written, so it survives the process crashing, and synced to disk
+        every sync_every records or sync_interval seconds. The checkpoint file is
+        named after a hash of the run's points, so a resumed run only reuses results
+        of an identical run
+        :param checkpoint_dir: directory checkpoints are saved in
+        :param items: list of points from getRequests
+        :param sync_every: number of records between syncs to disk
+        :param sync_interval: maximum seconds between syncs to disk
+        """
+        self.n_items = len(items)
+        run_key = get_run_key(items)
+        if not os.path.exists(checkpoint_dir):
+            os.makedirs(checkpoint_dir)
+        self.path = '{}/{}.ckpt'.format(checkpoint_dir, run_key[:16])
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.file = None
+        self.valid_size = 0
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def iter_records(self):
+        """
+        Read records saved in checkpoint one at a time, stopping at a partially
+        written last record, so checkpoints of any size are read in bounded memory
+        :return: generator of (point index, result)
+        """
+        self.valid_size = 0
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                length, = RECORD_HEADER.unpack(header)
+                record = f.read(length)
+                if len(record) < length:
+                    break
+                try:
+                    index, result = pickle.loads(record)
+                except Exception:
+                    break
+                self.valid_size = f.tell()
+                yield index, result
+
+    def iter_chunks(self, chunk_size=4096):
+        """
+        Read records saved in checkpoint in chunks
+        :param chunk_size: number of records per chunk
+        :return: generator of lists of (point index, result)
+        """
+        chunk = []
+        for record in self.iter_records():
+            chunk.append(record)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if len(chunk) > 0:
+            yield chunk
+
+    def truncate_partial(self):
+        """
+        Drop partially written last record found by iter_records
+        """
+        if os.path.isfile(self.path) and self.valid_size < os.path.getsize(self.path):
+            print('Dropping partially written record at end of checkpoint {}'.format(self.path))
+            with open(self.path, 'r+b') as f:
+                f.truncate(self.valid_size)
+
+    def load(self):
+        """
+        Load results saved in checkpoint, dropping a partially written last record
+        :return: dictionary of point index: result
+        """
+        results = {index: result for index, result in self.iter_records()}
+        self.truncate_partial()
+        return results
+
+    def open(self, resume=False):
+        """
+        Open checkpoint for appending results
+        :param resume: keep results of a previous run, otherwise start a new checkpoint
+        :return: set of indices of points already saved
+        """
+        done = set()
+        if resume:
+            done = set(index for index, _ in self.iter_records())
+            self.truncate_partial()
+        self.file = open(self.path, 'ab' if resume else 'wb')
+        return done
+
+    def append(self, index, result):
+        """
+        Save result of point to checkpoint
+        :param index: index of point in items
+        :param result: extracted GEE dataset features of point
+        """
+        record = pickle.dumps((index, result), protocol=pickle.HIGHEST_PROTOCOL)
+        self.file.write(RECORD_HEADER.pack(len(record)))
+        self.file.write(record)
+        self.file.flush()
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        """
+        Sync checkpoint to disk
+        """
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+    def get_results(self):
+        """
+        Get results of all points from the checkpoint, for saving the final output
+        :return: list of results, ordered as items
+        """
+        results = self.load()
+        missing = self.n_items - len(results)
+        if missing > 0:
+            raise ValueError('Checkpoint {} is missing results of {} points'.format(self.path, missing))
+        return [results[i] for i in range(self.n_items)]
+
+    def check_complete(self):
+        """
+        Check the checkpoint holds results of all points, without loading them
+        """
+        done = set(index for index, _ in self.iter_records())
+        missing = self.n_items - len(done)
+        if missing > 0:
+            raise ValueError('Checkpoint {} is missing results of {} points'.format(self.path, missing))
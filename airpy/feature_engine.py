@@ -0,0 +1,90 @@
+"""
+Module for calculating the features of a GEE dataset from its feature spec
+"""
+
+from feature_spec import get_feature_spec, get_class_table
+
+# Feature engines built once per process
+FEATURE_ENGINES = {}
+
+
+def get_feature_engine(dataset_name, band):
+    """
+    Get feature engine of dataset band
+    :param dataset_name: dataset name
+    :param band: band of interest
+    :return: FeatureEngine
+    """
+    if (dataset_name, band) not in FEATURE_ENGINES:
+        FEATURE_ENGINES[(dataset_name, band)] = FeatureEngine(dataset_name, band)
+    return FEATURE_ENGINES[(dataset_name, band)]
+
+
+class FeatureEngine:
+    def __init__(self, dataset_name, band):
+        """
+        Calculates the statistics listed in the dataset feature spec, in order,
+        from MetricUtils of any source (band array, histogram or statistics
+        reduced by GEE), so every dataset shares the same extraction paths
+        :param dataset_name: dataset name
+        :param band: band of interest
+        """
+        self.dataset_name = dataset_name
+        self.band = band
+        self.spec = get_feature_spec(dataset_name)
+        self.ignore_zero = self.spec.get('ignore_zero', False)
+        self.class_table = get_class_table(self.spec)
+        self.names = self.get_feature_names()
+
+    def get_feature_names(self):
+        """
+        Get output variable names of features
+        :return: list of dataset.band.feature names
+        """
+        features = []
+        for stat in self.spec['stats']:
+            if stat == 'class_pct':
+                features.extend([self.class_table[value]['class'] for value in self.class_table])
+            else:
+                features.append(stat)
+        return ['{}.{}.{}'.format(self.dataset_name, self.band, feature) for feature in features]
+
+    def get_reduction(self):
+        """
+        Get GEE reduction features can be calculated from in reduce extraction mode
+        :return: histogram for categorical datasets, stats otherwise
+        """
+        if self.class_table is not None:
+            return 'histogram'
+        return 'stats'
+
+    def compute(self, metric_utils):
+        """
+        Calculate features
+        :param metric_utils: MetricUtils over buffer extent of point
+        :return: list of feature values, ordered as names
+        """
+        values = []
+        for stat in self.spec['stats']:
+            if stat == 'mode':
+                if self.ignore_zero:
+                    values.append(metric_utils.get_nonzero_mode(self.dataset_name))
+                else:
+                    values.append(metric_utils.get_mode(self.dataset_name))
+            elif stat == 'var':
+                if self.ignore_zero:
+                    values.append(metric_utils.get_nonzero_var())
+                else:
+                    values.append(metric_utils.get_var())
+            elif stat == 'mean':
+                values.append(metric_utils.get_mean())
+            elif stat == 'max':
+                values.append(metric_utils.get_max())
+            elif stat == 'min':
+                values.append(metric_utils.get_min())
+            elif stat == 'class_pct':
+                pct_cov_all = metric_utils.get_perc_cov(self.dataset_name)
+                values.extend([pct_cov_all[value]['pct_cov'] for value in self.class_table])
+            else:
+                values.append(metric_utils.get_class_fraction(self.dataset_name, stat))
+        return values
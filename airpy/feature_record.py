@@ -0,0 +1,47 @@
+"""
+Module for holding the features of a single point
+"""
+
+import numpy as np
+import xarray as xr
+
+
+class FeatureRecord:
+    # No per-instance __dict__, records are small to hold, pickle and send between processes
+    __slots__ = ('lat', 'lon', 'names', 'values')
+
+    def __init__(self, lat, lon, names, values):
+        """
+        Features of a single point, converted to xarray or pandas
+        once for all points when results are saved
+        :param lat: latitude point
+        :param lon: longitude point
+        :param names: feature names, in output order
+        :param values: feature values, ordered as names
+        """
+        self.lat = lat
+        self.lon = lon
+        self.names = tuple(names)
+        self.values = np.array(values, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __repr__(self):
+        return 'FeatureRecord(lat={}, lon={}, {} features)'.format(self.lat, self.lon, len(self.names))
+
+    def get(self, name):
+        """
+        Get value of feature
+        :param name: feature name
+        :return: feature value
+        """
+        return self.values[self.names.index(name)]
+
+    def to_dataset(self):
+        """
+        Convert record to xarray dataset with lat, lon coordinates
+        :return: xarray of point features
+        """
+        data_vars = {name: ((), value) for name, value in zip(self.names, self.values)}
+        return xr.Dataset(data_vars=data_vars, coords={'lat': self.lat, 'lon': self.lon})
@@ -0,0 +1,72 @@
+"""
+Module for loading the feature specs of supported GEE datasets
+from configs/gee_collections.json
+"""
+
+import json
+import os
+import gee_class_constants
+
+COLLECTION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'configs', 'gee_collections.json')
+
+# Statistics a feature spec can list, in addition to class_pct and its class_fractions
+SPEC_STATS = ['mode', 'var', 'mean', 'max', 'min', 'class_pct']
+# Places GEE sampling fails, where points are set to the default value instead of queried
+SPEC_SKIP = ['polar', 'water']
+# How the GEE image is built from the collection
+SPEC_IMAGES = ['collection', 'image', 'first']
+
+# Feature specs loaded once per process
+FEATURE_SPECS = {}
+
+
+def load_feature_specs(collection_file=COLLECTION_FILE):
+    """
+    Load and check feature specs of all datasets
+    :param collection_file: path of gee_collections.json
+    :return: dictionary of dataset name: feature spec
+    """
+    with open(collection_file, 'r') as file:
+        data_collection = json.load(file)
+
+    specs = {}
+    for dataset in data_collection['gee_dataset'].values():
+        spec = dataset['features']
+        for stat in spec['stats']:
+            if stat not in SPEC_STATS and stat not in spec.get('class_fractions', {}):
+                raise ValueError('Unknown statistic {} in feature spec of {}'.format(stat, dataset['name']))
+        for skip in spec.get('skip', []):
+            if skip not in SPEC_SKIP:
+                raise ValueError('Unknown skip rule {} in feature spec of {}'.format(skip, dataset['name']))
+        if spec.get('image', 'collection') not in SPEC_IMAGES:
+            raise ValueError('Unknown image type {} in feature spec of {}'.format(spec['image'], dataset['name']))
+        if 'class_pct' in spec['stats'] and 'class_table' not in spec:
+            raise ValueError('Feature spec of {} lists class_pct without a class_table'.format(dataset['name']))
+        specs[dataset['name']] = spec
+    return specs
+
+
+def get_feature_spec(dataset_name):
+    """
+    Get feature spec of dataset
+    :param dataset_name: dataset name, i.e. modis or pop
+    :return: dictionary of feature spec
+    """
+    if len(FEATURE_SPECS) == 0:
+        FEATURE_SPECS.update(load_feature_specs())
+    if dataset_name not in FEATURE_SPECS:
+        raise ValueError('No feature spec for dataset {}'.format(dataset_name))
+    return FEATURE_SPECS[dataset_name]
+
+
+def get_class_table(spec):
+    """
+    Get class table of categorical dataset, in the order features are output
+    :param spec: feature spec of dataset
+    :return: dictionary of class value: class constants, None if dataset is not categorical
+    """
+    if 'class_table' not in spec:
+        return None
+    class_table = getattr(gee_class_constants, spec['class_table'])
+    class_order = spec.get('class_order', list(class_table.keys()))
+    return {value: class_table[value] for value in class_order}
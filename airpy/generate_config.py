@@ -12,7 +12,7 @@ from utils import Utils
 
 class GenerateConfig():
     def __init__(self, gee_data, region, date, analysis_type, add_time,
-                 buffer_size, configs_dir, save_dir, band=None, save_type=None):
+                 buffer_size, configs_dir, save_dir, band=None, save_type=None, end_date=None, buffer_sizes=None):
         self.gee_data = gee_data
         self.band = band
         self.region = region
@@ -23,6 +23,10 @@ class GenerateConfig():
         self.configs_dir = configs_dir
         self.save_dir = save_dir
         self.save_type = save_type
+        # Last date of time series runs, every time step from date to end_date is extracted in one run
+        self.end_date = end_date
+        # Buffer sizes of multi-buffer runs, fetched once at buffer_size, the largest
+        self.buffer_sizes = buffer_sizes
 
     def get_gee_collection_data(self):
         """
@@ -69,6 +73,45 @@ class GenerateConfig():
 
         return self.get_query_date()
 
+    def check_end_date(self, collection):
+        """
+        Check if end date of time series run is valid for gee collection
+        :param collection: gee dataset
+        :return: end date
+        """
+        dt_fmt = '%Y-%m-%d'
+        if datetime.strptime(self.end_date, dt_fmt) < datetime.strptime(self.date, dt_fmt):
+            raise ValueError('End date must be later than {}'.format(self.date))
+
+        if datetime.strptime(self.end_date, dt_fmt) > datetime.strptime(collection['max_date'], dt_fmt):
+            raise ValueError('End date must be earlier than {}'.format(collection['max_date']))
+
+        # Static datasets have a single image, time series of band arrays are only sampled from collections
+        if collection['features'].get('image', 'collection') != 'collection':
+            raise ValueError('Dataset {} has no time series, end date is not supported'.format(collection['name']))
+
+        if self.analysis_type != 'collection':
+            raise ValueError('End date is only supported for collection analysis')
+
+        return self.end_date
+
+    def check_buffer_sizes(self):
+        """
+        Check if buffer sizes of multi-buffer run are valid
+        :return: list of buffer sizes, ascending
+        """
+        buffer_sizes = sorted(set(self.buffer_sizes), key=float)
+        if float(buffer_sizes[-1]) != float(self.buffer_size):
+            raise ValueError('Buffer size must be the largest of buffer sizes {}'.format(buffer_sizes))
+
+        if self.analysis_type != 'collection':
+            raise ValueError('Multiple buffer sizes are only supported for collection analysis')
+
+        if self.end_date is not None:
+            raise ValueError('Multiple buffer sizes are not supported for time series runs')
+
+        return buffer_sizes
+
     def get_boundary(self):
         """
         Downselect to global boundary of interest
@@ -177,15 +220,25 @@ class GenerateConfig():
         config_dict['buffer_size'] = self.buffer_size
         config_dict['save_dir'] = self.save_dir
         config_dict['file_type'] = self.save_type
+        if self.end_date is not None:
+            config_dict['query_end'] = self.check_end_date(data)
+        buffer = self.buffer_size
+        if self.buffer_sizes is not None:
+            config_dict['buffer_sizes'] = self.check_buffer_sizes()
+            buffer = '-'.join(str(size) for size in config_dict['buffer_sizes'])
 
         if self.add_time == 'True':
             config_dict['add_time'] = True
         else:
             config_dict['add_time'] = False
 
+        date = self.date
+        if self.end_date is not None:
+            date = '{}_to_{}'.format(self.date, self.end_date)
+
         # Write to json file
         with open('{}/config_{}_{}_{}_buffersize_{}_{}.json'.format(self.configs_dir, config_dict['region']['extent'],
-                                                                    self.gee_data, self.date, self.buffer_size,
+                                                                    self.gee_data, date, buffer,
                                                                     self.analysis_type), 'w') as json_file:
             json.dump(config_dict, json_file, indent=4)
 
@@ -0,0 +1,161 @@
+"""
+Module for saving band arrays of points of an images run to a single
+chunked, compressed HDF5 image store as they complete
+"""
+
+import os
+import time
+import h5py
+import numpy as np
+from checkpoint_store import get_run_key
+
+
+class ImageStore:
+    def __init__(self, path, items=None, attrs=None, chunk_pixels=65536, sync_every=100, sync_interval=5.0):
+        """
+        HDF5 file of the band arrays of all points of a run. Arrays of any shape are
+        stored ragged, flattened one after the other in the compressed pixels dataset,
+        with the offset and shape of each point's array in point order, so the array
+        of any point is read with one lookup. Pixels are stored as float64, so integer
+        class arrays and continuous arrays of a run are saved exactly whichever point
+        completes first. lat, lon of points are saved in point
+        order and run details as file attributes. Arrays are buffered and written
+        every sync_every points or sync_interval seconds. The store has the same
+        open, append, close interface as CheckpointStore, so images runs are resumed
+        from the points already saved in it
+        :param path: path of .h5 file
+        :param items: list of points from getRequests, needed for writing
+        :param attrs: dictionary of run details saved as file attributes
+        :param chunk_pixels: pixels per compressed chunk
+        :param sync_every: number of points between writes to the file
+        :param sync_interval: maximum seconds between writes to the file
+        """
+        self.path = path
+        self.items = items
+        self.attrs = attrs if attrs is not None else {}
+        self.chunk_pixels = chunk_pixels
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.file = None
+        self.pending = []
+        self.last_sync = time.monotonic()
+        self.point_index = None
+
+    def open(self, resume=False):
+        """
+        Open image store for appending arrays of points
+        :param resume: keep arrays of a previous run, otherwise start a new store
+        :return: set of indices of points already saved
+        """
+        run_key = get_run_key(self.items)
+        if resume and os.path.isfile(self.path):
+            self.file = h5py.File(self.path, 'a')
+            if self.file.attrs.get('run_key') != run_key:
+                self.file.close()
+                raise ValueError('Image store {} was saved by a run of other points'.format(self.path))
+            self.offsets = self.file['offset'][:]
+            self.shapes = self.file['shape'][:]
+            return set(int(i) for i in np.nonzero(self.offsets >= 0)[0])
+
+        save_dir = os.path.dirname(self.path)
+        if save_dir != '' and not os.path.exists(save_dir):
+            os.makedirs(save_dir)
+        n_items = len(self.items)
+        self.file = h5py.File(self.path, 'w')
+        self.file.attrs['run_key'] = run_key
+        for name, value in self.attrs.items():
+            self.file.attrs[name] = value
+        self.file.create_dataset('lat', data=np.array([item['coordinates'][1] for item in self.items], dtype=float))
+        self.file.create_dataset('lon', data=np.array([item['coordinates'][0] for item in self.items], dtype=float))
+        self.offsets = np.full(n_items, -1, dtype=np.int64)
+        self.shapes = np.zeros((n_items, 2), dtype=np.int32)
+        self.file.create_dataset('offset', data=self.offsets)
+        self.file.create_dataset('shape', data=self.shapes)
+        return set()
+
+    def append(self, index, result):
+        """
+        Save band array of point to image store
+        :param index: index of point in items
+        :param result: result of process_collection_for_img, holding the band array of the point
+        """
+        self.pending.append((index, np.atleast_2d(np.asarray(result['data_array']))))
+        if len(self.pending) >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        """
+        Write buffered arrays and their offsets, shapes to the file and flush it
+        """
+        if len(self.pending) > 0:
+            if 'pixels' not in self.file:
+                self.file.create_dataset('pixels', shape=(0,), maxshape=(None,), chunks=(self.chunk_pixels,),
+                                         dtype=np.float64, compression='gzip', compression_opts=4,
+                                         shuffle=True)
+            pixels = self.file['pixels']
+            # All buffered arrays are appended with a single resize and write
+            start = pixels.shape[0]
+            offset = start
+            for index, np_arr in self.pending:
+                self.offsets[index] = offset
+                self.shapes[index] = np_arr.shape[:2]
+                offset += np_arr.size
+            pixels.resize((offset,))
+            pixels[start:offset] = np.concatenate([np_arr.ravel() for _, np_arr in self.pending])
+
+            indices = np.unique([index for index, _ in self.pending])
+            self.file['offset'][indices] = self.offsets[indices]
+            self.file['shape'][indices] = self.shapes[indices]
+            self.pending = []
+        self.file.flush()
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        if self.file is not None:
+            if self.file.mode != 'r':
+                self.sync()
+            self.file.close()
+            self.file = None
+
+    def check_complete(self):
+        """
+        Check the image store holds arrays of all points
+        """
+        missing = int(np.sum(self.offsets < 0))
+        if missing > 0:
+            raise ValueError('Image store {} is missing arrays of {} points'.format(self.path, missing))
+
+    def read(self):
+        """
+        Open image store for reading arrays of points
+        """
+        if self.file is None:
+            self.file = h5py.File(self.path, 'r')
+            self.offsets = self.file['offset'][:]
+            self.shapes = self.file['shape'][:]
+
+    def get_image(self, index):
+        """
+        Get band array of point
+        :param index: index of point in items
+        :return: numpy array, None if point not saved
+        """
+        self.read()
+        offset = self.offsets[index]
+        if offset < 0:
+            return None
+        height, width = self.shapes[index]
+        return self.file['pixels'][offset:offset + height * width].reshape(height, width)
+
+    def get_index(self, lat, lon):
+        """
+        Get index of point in image store
+        :param lat: latitude point
+        :param lon: longitude point
+        :return: index of point, None if point not in store
+        """
+        self.read()
+        if self.point_index is None:
+            self.point_index = {point: i for i, point in
+                                enumerate(zip(self.file['lat'][:], self.file['lon'][:]))}
+        return self.point_index.get((float(lat), float(lon)))
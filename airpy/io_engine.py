@@ -0,0 +1,139 @@
+"""
+Module for running GEE requests concurrently in threads and
+feature calculation in a small process pool
+"""
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import multiprocessing
+import time
+
+
+def timed_call(fn, *args, **kwargs):
+    """
+    Call fn and time it, module-level so it can be run in the CPU process pool
+    :return: result of fn, seconds
+    """
+    st = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - st
+
+
+def get_mp_context():
+    """
+    Get context CPU processes are started with. Forking while the I/O threads hold
+    locks can deadlock the forked worker, so workers are started by a fork server,
+    or spawned where fork servers are not available
+    :return: multiprocessing context
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+class IOEngine:
+    def __init__(self, io_workers=64, cpu_workers=4, governor=None, run_report=None):
+        """
+        GEE requests spend almost all of their time waiting on the network, so they
+        are run in a large pool of threads sharing one process. Feature calculation
+        is CPU-bound and is run in a separate small pool of processes
+        :param io_workers: number of concurrent GEE requests
+        :param cpu_workers: number of processes calculating features, 0 to calculate in the main process
+        :param governor: RateGovernor shared by all I/O threads, GEE requests are called directly if None
+        :param run_report: RunReport GEE request latency and feature calculation time are recorded in
+        """
+        self.io_workers = io_workers
+        self.cpu_workers = cpu_workers
+        self.governor = governor
+        self.run_report = run_report
+
+    def call_io(self, fn, *args):
+        """
+        Call fn making GEE requests, through the rate governor if set
+        """
+        if self.run_report is not None:
+            # Timed per attempt, so retried requests are recorded individually
+            fn = self.run_report.timed_fetch(fn)
+        if self.governor is None:
+            return fn(*args)
+        return self.governor.call(fn, *args)
+
+    def map_io(self, fn, items):
+        """
+        Run fn over items concurrently in the I/O thread pool
+        :param fn: function making GEE requests
+        :param items: list of arguments tuples for fn
+        :return: list of results, ordered as items
+        """
+        with ThreadPoolExecutor(self.io_workers) as io_pool:
+            return list(io_pool.map(lambda args: self.call_io(fn, *args), items))
+
+    def run(self, items, fetch_fn, compute_fn, batch_size=1, governed=True, on_result=None):
+        """
+        Fetch GEE data for items in the I/O thread pool and calculate features from
+        each fetch as it completes in the CPU process pool
+        :param items: list of points from getRequests
+        :param fetch_fn: function taking a list of points and returning a list of
+        keyword argument dictionaries for compute_fn, ordered as points
+        :param compute_fn: picklable function taking index, point and the keyword
+        arguments returned by fetch_fn, returning the point features
+        :param batch_size: number of points passed to each fetch_fn call
+        :param governed: call fetch_fn through the rate governor, False if it makes no GEE requests
+        :param on_result: function called in the main process with index and features of each
+        point as it completes, in completion order. Features are streamed to on_result and
+        not held by the engine
+        :return: list of features, ordered as items, None if streamed to on_result
+        """
+        batches = [list(range(i, min(i + batch_size, len(items)))) for i in range(0, len(items), batch_size)]
+        results = [None] * len(items) if on_result is None else None
+        # Bound fetched data waiting to be calculated, so memory does not grow with the number of points
+        max_pending = 2 * self.io_workers
+
+        call_fetch = self.call_io if governed else lambda fn, *args: fn(*args)
+        cpu_pool = None
+        if self.cpu_workers > 0:
+            cpu_pool = ProcessPoolExecutor(self.cpu_workers, mp_context=get_mp_context())
+        io_pool = ThreadPoolExecutor(self.io_workers)
+        try:
+            fetching = {}
+            computing = {}
+            next_batch = 0
+            while next_batch < len(batches) or fetching or computing:
+                while next_batch < len(batches) and len(fetching) + len(computing) < max_pending:
+                    batch = batches[next_batch]
+                    fetching[io_pool.submit(call_fetch, fetch_fn, [items[i] for i in batch])] = batch
+                    next_batch += 1
+
+                done, _ = wait(list(fetching) + list(computing), return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in fetching:
+                        batch = fetching.pop(future)
+                        for i, fetched in zip(batch, future.result()):
+                            if cpu_pool is None:
+                                self.complete(results, i, timed_call(compute_fn, i, items[i], **fetched),
+                                              on_result)
+                            else:
+                                computing[cpu_pool.submit(timed_call, compute_fn, i, items[i], **fetched)] = i
+                    else:
+                        self.complete(results, computing.pop(future), future.result(), on_result)
+        finally:
+            io_pool.shutdown()
+            if cpu_pool is not None:
+                cpu_pool.shutdown()
+
+        return results
+
+    def complete(self, results, i, timed_result, on_result=None):
+        """
+        Store or stream features of completed item and record their calculation time
+        :param results: list of features, ordered as items, None if streamed to on_result
+        :param i: index of item
+        :param timed_result: features, seconds from timed_call
+        :param on_result: function called with index and features of item
+        """
+        result, seconds = timed_result
+        if self.run_report is not None:
+            self.run_report.record_compute(seconds)
+        if on_result is not None:
+            on_result(i, result)
+        else:
+            results[i] = result
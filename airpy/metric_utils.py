@@ -3,30 +3,258 @@ Module for calculating metrics from GEE data
 """
 
 import numpy as np
-import copy
-from gee_class_constants import MODIS_LC_Type1, FIRE_LC, GHSL_Built_Class
+from feature_spec import get_feature_spec, get_class_table
+
+
+class ClassCoverage():
+    def __init__(self, class_dict, extra_values=()):
+        """
+        Class table of a categorical dataset compiled once into an index array,
+        so pixel counts of every class are taken in a single np.bincount pass
+        :param class_dict: dictionary of class constants for gee dataset
+        :param extra_values: values outside the class table to count, i.e. 0 placeholder
+        """
+        self.classes = np.array(list(class_dict.keys()), dtype=np.int64)
+        self.names = [class_dict[k]['class'] for k in class_dict]
+        self.n_values = int(max(list(self.classes) + list(extra_values))) + 1
+        # Last bin counts pixels that are not an integer value in the table range, i.e. from bilinear resampling
+        self.other = self.n_values
+
+    def get_codes(self, arr):
+        """
+        Get bin of each pixel
+        :param arr: numpy array of band
+        :return: int64 array of bins, shaped as arr
+        """
+        arr = np.asarray(arr)
+        if arr.size == 0:
+            return arr.astype(np.int64)
+        if arr.dtype.kind in 'iu':
+            # Class tables are small, so integer arrays are usually all in range and used as bins directly
+            if arr.min() >= 0 and arr.max() < self.n_values:
+                return arr.astype(np.int64, copy=False)
+            return np.where((arr >= 0) & (arr < self.n_values), arr, self.other).astype(np.int64)
+        with np.errstate(invalid='ignore'):
+            codes = arr.astype(np.int64)
+            valid = codes == arr
+        if valid.all() and codes.min() >= 0 and codes.max() < self.n_values:
+            return codes
+        valid &= (codes >= 0) & (codes < self.n_values)
+        codes[~valid] = self.other
+        return codes
+
+    def count(self, arr):
+        """
+        Count pixels of every value in the class table range
+        :param arr: numpy array of band of one point, or a stacked batch of band arrays of points
+        :return: array of pixel counts per value, last bin counting other values,
+        one row per point if arr is a stacked batch
+        """
+        arr = np.asarray(arr)
+        n_bins = self.n_values + 1
+        if arr.ndim <= 2:
+            return np.bincount(self.get_codes(arr).ravel(), minlength=n_bins)
+        batch = arr.shape[0]
+        # Offset bins of each point so the whole batch is counted in one pass
+        codes = self.get_codes(arr).reshape(batch, -1) + (np.arange(batch) * n_bins)[:, None]
+        return np.bincount(codes.ravel(), minlength=batch * n_bins).reshape(batch, n_bins)
+
+    def count_values(self, values, counts):
+        """
+        Count pixels of every value in the class table range from a histogram
+        :param values: array of values
+        :param counts: array of pixel counts per value
+        :return: array of pixel counts per value, last bin counting other values
+        """
+        counts = np.bincount(self.get_codes(values), weights=counts, minlength=self.n_values + 1)
+        return np.rint(counts).astype(np.int64)
+
+    def get_total(self, counts, nonzero=False):
+        """
+        Get total pixels
+        :param counts: pixel counts from count
+        :param nonzero: exclude 0 placeholder pixels
+        :return: total pixels, per point if batched
+        """
+        total = counts.sum(axis=-1)
+        if nonzero:
+            total = total - counts[..., 0]
+        return total
+
+    def get_pct_cov(self, counts, nonzero=False):
+        """
+        Get percent coverage of every class
+        :param counts: pixel counts from count
+        :param nonzero: exclude 0 placeholder pixels from total
+        :return: array of pct coverage ordered as class table, per point if batched
+        """
+        total = np.expand_dims(self.get_total(counts, nonzero), -1)
+        class_counts = counts[..., self.classes]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(total > 0, class_counts / np.maximum(total, 1), 0)
+
+    def get_mode(self, counts, nonzero=False):
+        """
+        Get most common value, the smallest value on ties as np.unique
+        :param counts: pixel counts from count
+        :param nonzero: exclude 0 placeholder, 0 if there are no other pixels
+        :return: mode, per point if batched, and whether other values may be more common
+        """
+        start = 1 if nonzero else 0
+        value_counts = counts[..., start:self.n_values]
+        mode = value_counts.argmax(axis=-1) + start
+        max_count = value_counts.max(axis=-1)
+        if nonzero:
+            mode = np.where(max_count > 0, mode, 0)
+        ambiguous = counts[..., self.other] >= np.maximum(max_count, 1)
+        return mode, ambiguous
+
+
+# Class tables compiled once per process
+CLASS_COVERAGE = {}
+
+
+def get_class_coverage(dataset_name):
+    """
+    Get compiled class table of dataset
+    :param dataset_name: dataset name
+    :return: ClassCoverage of dataset, None if dataset is not categorical
+    """
+    if dataset_name not in CLASS_COVERAGE:
+        spec = get_feature_spec(dataset_name)
+        class_table = get_class_table(spec)
+        if class_table is None:
+            CLASS_COVERAGE[dataset_name] = None
+        else:
+            # Default value is counted even if not a class, i.e. GHSL 0 placeholder
+            CLASS_COVERAGE[dataset_name] = ClassCoverage(class_table, extra_values=[spec['default_value']])
+    return CLASS_COVERAGE[dataset_name]
+
 
 class MetricUtils():
-    def __init__(self, img_arr):
+    def __init__(self, img_arr=None, histogram=None, stats=None):
+        """
+        :param img_arr: numpy array of band over buffer extent
+        :param histogram: dictionary of value: pixel count over buffer extent,
+        used in place of img_arr when reduced server-side by GEE
+        :param stats: dictionary of mean, min, max, variance and mode over
+        buffer extent, used in place of img_arr when reduced server-side by GEE
+        """
         self.img_arr = img_arr
+        self.histogram = histogram
+        self.stats = stats
+        # Pixel counts per class table, taken once and shared by all class metrics
+        self.class_counts = {}
+
+    def get_value_counts(self):
+        """
+        Get unique values and pixel count of each value
+        :return: array of values, array of counts
+        """
+        if self.histogram is None:
+            return np.unique(self.img_arr, return_counts=True)
+        values = np.array(list(self.histogram.keys()))
+        counts = np.array(list(self.histogram.values()))
+        order = np.argsort(values)
+        return values[order], counts[order]
 
-    def get_mode(self):
+    def get_class_counts(self, dataset_name):
+        """
+        Get pixel counts of every value in class table of dataset
+        :param dataset_name: name of categorical dataset
+        :return: array of pixel counts from ClassCoverage.count
+        """
+        if dataset_name not in self.class_counts:
+            class_coverage = get_class_coverage(dataset_name)
+            if self.histogram is None:
+                self.class_counts[dataset_name] = class_coverage.count(self.img_arr)
+            else:
+                values, counts = self.get_value_counts()
+                self.class_counts[dataset_name] = class_coverage.count_values(values, counts)
+        return self.class_counts[dataset_name]
+
+    def get_mode(self, dataset_name=None):
         """
         Get mode of array --> useful for land cover datasets
+        :param dataset_name: name of categorical dataset, counts pixels with its class table if set
         :return: array mode
         """
-        values, counts = np.unique(self.img_arr, return_counts=True)
+        if self.stats is not None:
+            return self.stats['mode']
+        if dataset_name is not None and get_class_coverage(dataset_name) is not None:
+            mode, ambiguous = get_class_coverage(dataset_name).get_mode(self.get_class_counts(dataset_name))
+            if not ambiguous:
+                return mode
+        values, counts = self.get_value_counts()
         m = counts.argmax()
         return values[m]
 
-    def get_nonzero_mode(self):
+    def get_mean(self):
+        """
+        Get mean of array ignoring nans
+        :return: array mean
+        """
+        if self.stats is not None:
+            return self.stats['mean']
+        return np.nanmean(self.img_arr)
+
+    def get_max(self):
+        """
+        Get max of array
+        :return: array max
+        """
+        if self.stats is not None:
+            return self.stats['max']
+        return np.max(self.img_arr)
+
+    def get_min(self):
+        """
+        Get min of array
+        :return: array min
+        """
+        if self.stats is not None:
+            return self.stats['min']
+        return np.min(self.img_arr)
+
+    def get_var(self):
+        """
+        Get variance of array ignoring nans
+        :return: array variance
+        """
+        if self.stats is not None:
+            return self.stats['variance']
+        if self.histogram is None:
+            return np.nanvar(self.img_arr)
+        values, counts = self.get_value_counts()
+        keep = ~np.isnan(values)
+        return self.weighted_var(values[keep], counts[keep])
+
+    def weighted_var(self, values, counts):
+        """
+        Get variance of values weighted by their pixel counts
+        :param values: array of values
+        :param counts: array of pixel counts per value
+        :return: variance
+        """
+        if counts.sum() == 0:
+            return np.nan
+        mean = np.sum(values * counts) / counts.sum()
+        return np.sum(counts * (values - mean) ** 2) / counts.sum()
+
+    def get_nonzero_mode(self, dataset_name=None):
         """
         Get mode of array removing 0 placeholder
+        :param dataset_name: name of categorical dataset, counts pixels with its class table if set
         :return: array mode
         """
-        flat_img = self.img_arr.flatten()
-        non_zero = flat_img[flat_img != 0]
-        values, counts = np.unique(non_zero, return_counts=True)
+        if dataset_name is not None and get_class_coverage(dataset_name) is not None:
+            counts = self.get_class_counts(dataset_name)
+            mode, ambiguous = get_class_coverage(dataset_name).get_mode(counts, nonzero=True)
+            if not ambiguous:
+                return mode
+        values, counts = self.get_value_counts()
+        non_zero = values != 0
+        values, counts = values[non_zero], counts[non_zero]
         if counts.size > 0:
             m = counts.argmax()
             return values[m]
@@ -38,85 +266,64 @@ class MetricUtils():
         Get variance of array removing 0 placeholder
         :return: array variance
         """
-        flat_img = self.img_arr.flatten()
-        non_zero = flat_img[flat_img != 0]
-        if non_zero.size > 0:
-            return np.nanvar(non_zero)
+        if self.histogram is None:
+            flat_img = self.img_arr.flatten()
+            non_zero = flat_img[flat_img != 0]
+            if non_zero.size > 0:
+                return np.nanvar(non_zero)
+            else:
+                return 0
+        values, counts = self.get_value_counts()
+        keep = (values != 0) & ~np.isnan(values)
+        if np.any(values != 0):
+            return self.weighted_var(values[keep], counts[keep])
         else:
             return 0
 
     def get_perc_cov(self, class_dict):
         """
         Calculate percent coverage per class
-        :param: class_dict: dictionary of class constants for gee dataset
+        :param: class_dict: name of categorical gee dataset
         :return: dictionary of pct coverage per class
         """
+        class_coverage = get_class_coverage(class_dict)
+        # calc the total non-zero pixels if 0 is a dummy default value for processing, i.e. GHSL
+        nonzero = get_feature_spec(class_dict).get('ignore_zero', False)
+        # Values that are not categorized/nans (think is due to bilinear interpolation) count only to the total
+        pct_cov = class_coverage.get_pct_cov(self.get_class_counts(class_dict), nonzero=nonzero)
 
-        if class_dict == 'modis':
-            feature_dict = copy.deepcopy(MODIS_LC_Type1)
-        if class_dict == 'fire':
-            feature_dict = copy.deepcopy(FIRE_LC)
-        if class_dict == 'human_settlement_layer_built_up':
-            feature_dict = copy.deepcopy(GHSL_Built_Class)
-
-        if class_dict == 'human_settlement_layer_built_up':
-            # calc the total non-zero pixels (this is dummy default value for processing)
-            flat = self.img_arr.flatten()
-            total_pixels = len(flat[flat != 0])
-        else:
-            rows = len(self.img_arr[:, 0])
-            cols = len(self.img_arr[0, :])
-            total_pixels = rows * cols
-        values_val, counts_val = np.unique(self.img_arr, return_counts=True)
-
-        values = values_val.tolist()
-        counts = counts_val.tolist()
-
-        # Removing data that is not categorized/nans - think is due to bilinear interpolation
-        new_vals = []
-        new_counts = []
-        for i in range(len(values)):
-            if feature_dict.get(values[i]):
-                new_vals.append(values[i])
-                new_counts.append(counts[i])
-
-        count_dict = {}
-        for j in range(len(new_vals)):
-            count_dict[new_vals[j]] = new_counts[j]
-
-        for k, v in count_dict.items():
-            pct_cov = (count_dict[k] / total_pixels)
-            feature_dict[k]['pct_cov'] = pct_cov
-
+        feature_dict = {}
+        for i in range(len(class_coverage.classes)):
+            feature_dict[int(class_coverage.classes[i])] = {'class': class_coverage.names[i],
+                                                            'pct_cov': pct_cov[i]}
         return feature_dict
 
+    def get_class_fraction(self, dataset_name, fraction):
+        """
+        Calculate fraction of pixels not in the classes of a class fraction
+        of the dataset feature spec, i.e. burnt pixels are those not unburnt
+        :param dataset_name: name of categorical gee dataset
+        :param fraction: name of class fraction in feature spec
+        :return: fraction of pixels, 0 if there are no pixels
+        """
+        spec = get_feature_spec(dataset_name)
+        counts = self.get_class_counts(dataset_name)
+        total_pixels = get_class_coverage(dataset_name).get_total(counts, nonzero=spec.get('ignore_zero', False))
+        if total_pixels == 0:
+            return 0
+        excluded = counts[spec['class_fractions'][fraction]].sum()
+        return (total_pixels - excluded) / total_pixels
+
     def calc_burnt_pct(self):
         '''
         Calculate burnt percentage for fire datasets
         :return: percent value of burnt area in array
         '''
-        total_pixels = len(self.img_arr[:, 0]) * len(self.img_arr[0, :])
-        unburnt = np.count_nonzero(self.img_arr == 160)
-        burnt_pct = (total_pixels - unburnt) / total_pixels
-
-        return burnt_pct
+        return self.get_class_fraction('fire', 'burnt')
 
     def calc_built_pct(self):
         '''
         Calculate percentage of built up area
         :return: percent value of built up area in an array
         '''
-        flat = self.img_arr.flatten()
-        total_pixels = len(flat[flat != 0])
-        if total_pixels == 0:
-            built_pct = 0
-            return built_pct
-
-        built_classes = [11, 12, 13, 14, 15, 21, 22, 23, 24, 25]
-        built_count = 0
-        for i in built_classes:
-            built_count += flat.tolist().count(i)
-
-        built_pct = (total_pixels - built_count) / total_pixels
-
-        return built_pct
+        return self.get_class_fraction('human_settlement_layer_built_up', 'built')
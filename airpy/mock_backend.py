@@ -0,0 +1,497 @@
+"""
+Module for a local stand-in of the subset of the GEE API used by airPy
+(sampleRectangle, reduceRegions, computePixels and getInfo), returning
+synthetic pixels with configurable latency and failures, so the real fetch
+code of the pipeline is benchmarked and tested without network access
+"""
+
+import numpy as np
+import importlib
+import json
+import threading
+import random
+import math
+import time
+from contextlib import contextmanager
+from tile_mosaic import METRES_PER_DEGREE
+from feature_spec import COLLECTION_FILE, get_class_table
+
+# Pixel limit of sampleRectangle
+SAMPLE_MAX_PIXELS = 262144
+
+# Modules calling the GEE API, their ee is replaced by patch_ee
+EE_MODULES = ['processor_modules', 'batch_fetcher', 'utils', 'tile_mosaic']
+
+# Datasets of gee_collections.json by collection id, loaded once per process
+COLLECTIONS = {}
+
+
+def get_collection(collection):
+    """
+    Get dataset of GEE collection
+    :param collection: GEE collection id
+    :return: dataset dictionary from gee_collections.json
+    """
+    if len(COLLECTIONS) == 0:
+        with open(COLLECTION_FILE, 'r') as file:
+            for dataset in json.load(file)['gee_dataset'].values():
+                COLLECTIONS[dataset['collection']] = dataset
+    return COLLECTIONS[collection]
+
+
+def get_hash(*keys):
+    """
+    Hash integer arrays into uniform floats in [0, 1), the same in every process
+    :param keys: integer arrays or ints, broadcast together
+    :return: float array
+    """
+    with np.errstate(over='ignore'):
+        x = np.uint64(0x9E3779B97F4A7C15)
+        for key in keys:
+            x = (x ^ np.asarray(key).astype(np.uint64)) * np.uint64(0xBF58476D1CE4E5B9)
+            x ^= x >> np.uint64(31)
+        x = (x ^ (x >> np.uint64(29))) * np.uint64(0x94D049BB133111EB)
+        x ^= x >> np.uint64(32)
+    return (x >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+
+
+class MockValue:
+    def __init__(self, mock_ee, compute, pixels=()):
+        """
+        Computed GEE value, only evaluated by getInfo as one request
+        :param mock_ee: MockEE the value is requested from
+        :param compute: function returning the value
+        :param pixels: pixel counts of the sampleRectangle calls of the value
+        """
+        self.mock_ee = mock_ee
+        self.compute = compute
+        self.pixels = list(pixels)
+
+    def getInfo(self):
+        self.mock_ee.request(self.pixels)
+        return self.compute()
+
+    def values(self, keys):
+        return MockValue(self.mock_ee, lambda: [self.compute()[key] for key in keys], self.pixels)
+
+
+class MockGeometry:
+    def __init__(self, coordinates, radius=0.0):
+        self.lon, self.lat = coordinates
+        self.radius = radius
+
+    @staticmethod
+    def Point(coordinates):
+        return MockGeometry(coordinates)
+
+    def buffer(self, radius):
+        return MockGeometry([self.lon, self.lat], float(radius))
+
+    def bounds(self):
+        # Rectangles are sampled over the bounding box of the buffer anyway
+        return self
+
+
+class MockFeature:
+    def __init__(self, geometry, properties=None):
+        self.geom = geometry
+        self.properties = dict(properties or {})
+
+    def geometry(self):
+        return self.geom
+
+    def set(self, name, value):
+        return MockFeature(self.geom, dict(self.properties, **{name: value}))
+
+    def get(self, name):
+        return self.properties[name]
+
+    def toDictionary(self, names):
+        return MockValue(self.properties[names[0]].mock_ee,
+                         lambda: {name: self.properties[name].compute() for name in names},
+                         [pixels for name in names for pixels in self.properties[name].pixels])
+
+
+class MockFeatureCollection:
+    def __init__(self, features):
+        self.features = list(features)
+
+    def map(self, fn):
+        return MockFeatureCollection([fn(feature) for feature in self.features])
+
+    def aggregate_array(self, name):
+        values = [feature.get(name) for feature in self.features]
+        return MockValue(values[0].mock_ee, lambda: [value.compute() for value in values],
+                         [pixels for value in values for pixels in value.pixels])
+
+
+class MockReducer:
+    def __init__(self, outputs):
+        """
+        Reducer of pixels over a region, calculated as MetricUtils does from band arrays
+        :param outputs: names of reducer outputs
+        """
+        self.outputs = outputs
+
+    def combine(self, reducer2, sharedInputs=False):
+        return MockReducer(self.outputs + reducer2.outputs)
+
+    def unweighted(self):
+        return self
+
+    def reduce(self, arr):
+        """
+        Reduce pixels
+        :param arr: numpy array of band
+        :return: dictionary of reducer outputs
+        """
+        values, counts = np.unique(arr, return_counts=True)
+        reduced = {}
+        for output in self.outputs:
+            if output == 'histogram':
+                reduced[output] = {'{:g}'.format(value): int(count) for value, count in zip(values, counts)}
+            elif output == 'mean':
+                reduced[output] = float(np.mean(arr))
+            elif output == 'min':
+                reduced[output] = float(np.min(arr))
+            elif output == 'max':
+                reduced[output] = float(np.max(arr))
+            elif output == 'variance':
+                reduced[output] = float(np.var(arr))
+            elif output == 'mode':
+                reduced[output] = float(values[counts.argmax()])
+        return reduced
+
+
+class MockReducers:
+    """
+    Stand-in of ee.Reducer
+    """
+    @staticmethod
+    def frequencyHistogram():
+        return MockReducer(['histogram'])
+
+    @staticmethod
+    def mean():
+        return MockReducer(['mean'])
+
+    @staticmethod
+    def minMax():
+        return MockReducer(['min', 'max'])
+
+    @staticmethod
+    def variance():
+        return MockReducer(['variance'])
+
+    @staticmethod
+    def mode():
+        return MockReducer(['mode'])
+
+
+class MockImage:
+    def __init__(self, mock_ee, collection, bands=None, steps=None, scale=None, start=None):
+        """
+        Image of synthetic pixels on a global EPSG:4326 grid at the scale of the image,
+        random but the same for every request of a pixel: classes of the dataset class
+        table for categorical datasets, positive continuous values otherwise
+        :param mock_ee: MockEE the image is requested from
+        :param collection: GEE collection id
+        :param bands: band names
+        :param steps: time step key of each band, from the filtered dates
+        :param scale: pixel size in metres
+        :param start: start date of the last date filter
+        """
+        self.mock_ee = mock_ee
+        self.collection = collection
+        self.bands = bands or []
+        self.steps = steps or [0] * len(self.bands)
+        self.scale = scale if scale is not None else float(get_collection(collection)['resolution'])
+        self.start = start
+
+    def copy(self, **kwargs):
+        image = MockImage(self.mock_ee, self.collection, self.bands, self.steps, self.scale, self.start)
+        image.__dict__.update(kwargs)
+        return image
+
+    def select(self, band):
+        return self.copy(bands=[band], steps=self.steps[:1] or [0])
+
+    def filterDate(self, start, end):
+        return self.copy(start=start)
+
+    def first(self):
+        # Time step of image from the last date filter, i.e. 2019-03-01 is 201903
+        step = 0 if self.start is None else int(self.start[:4]) * 100 + int(self.start[5:7])
+        return self.copy(steps=[step] * len(self.bands))
+
+    def resample(self, mode):
+        return self
+
+    def reproject(self, crs=None, scale=None):
+        return self.copy(scale=float(scale))
+
+    def unmask(self, value):
+        # Synthetic pixels are never masked
+        return self
+
+    def rename(self, bands):
+        return self.copy(bands=list(bands))
+
+    def get_pixel_deg(self, scale=None):
+        return (scale or self.scale) / METRES_PER_DEGREE
+
+    def get_window(self, geometry, scale=None):
+        """
+        Get global grid rows, cols covering the bounding box of geometry, as TileMosaic
+        :param geometry: MockGeometry
+        :param scale: pixel size in metres, default scale of image
+        :return: array of rows, array of cols
+        """
+        pixel_deg = self.get_pixel_deg(scale)
+        dlat = geometry.radius / METRES_PER_DEGREE
+        dlon = min(180.0, geometry.radius / (METRES_PER_DEGREE * max(math.cos(math.radians(geometry.lat)), 1e-6)))
+        n_rows = int(math.ceil(180 / pixel_deg))
+        row_start = max(0, int(math.floor((90 - (geometry.lat + dlat)) / pixel_deg)))
+        row_end = min(n_rows, int(math.floor((90 - (geometry.lat - dlat)) / pixel_deg)) + 1)
+        col_start = int(math.floor((geometry.lon - dlon + 180) / pixel_deg))
+        col_end = int(math.floor((geometry.lon + dlon + 180) / pixel_deg)) + 1
+        return np.arange(row_start, row_end), np.arange(col_start, col_end) % int(math.ceil(360 / pixel_deg))
+
+    def get_pixels(self, rows, cols, band=0, scale=None):
+        """
+        Get synthetic pixels of band at global grid rows, cols
+        :param rows: array of rows
+        :param cols: array of cols
+        :param band: index of band
+        :param scale: pixel size in metres, default scale of image
+        :return: numpy array of band, rows x cols
+        """
+        scale = int(round((scale or self.scale) * 100))
+        rows, cols = np.meshgrid(rows, cols, indexing='ij')
+        keys = (self.mock_ee.seed, scale, self.steps[band])
+        classes = self.mock_ee.get_classes(self.collection)
+        if classes is not None:
+            # A dominant class per block of pixels, as land cover is spatially clustered
+            dominant = get_hash(*keys, rows // 16, cols // 16)
+            other = get_hash(*keys, rows, cols)
+            index = np.where(other < 0.7, dominant * len(classes), (other - 0.7) / 0.3 * len(classes))
+            return classes[np.minimum(index.astype(np.int64), len(classes) - 1)]
+        # Sum of two exponentials, gamma distributed with shape 2, scale 10
+        return -10.0 * np.log((1 - get_hash(*keys, rows, cols, 1)) * (1 - get_hash(*keys, rows, cols, 2)))
+
+    def sampleRectangle(self, region, defaultValue=None):
+        """
+        Sample every band over the bounding box of region
+        :param region: MockGeometry
+        :param defaultValue: value of masked pixels, synthetic pixels are never masked
+        :return: MockFeature with a computed band array property per band
+        """
+        # Pixels GEE counts towards the limit, the area of the buffer as assumed by
+        # Utils.get_allowable_buffer_size
+        n_pixels = int(math.pi * (region.radius / self.scale) ** 2)
+        rows, cols = self.get_window(region)
+        properties = {}
+        for i, band in enumerate(self.bands):
+            def compute(i=i):
+                self.mock_ee.check_pixels(n_pixels)
+                return self.get_pixels(rows, cols, i).tolist()
+            properties[band] = MockValue(self.mock_ee, compute, [n_pixels])
+        return MockFeature(region, properties)
+
+    def reduceRegions(self, collection, reducer, scale=None):
+        """
+        Reduce first band over the bounding box of every feature of collection
+        :param collection: MockFeatureCollection
+        :param reducer: MockReducer
+        :param scale: pixel size in metres the pixels are reduced at
+        :return: MockReduction
+        """
+        def compute():
+            features = []
+            for feature in collection.features:
+                rows, cols = self.get_window(feature.geometry(), scale)
+                reduced = reducer.reduce(self.get_pixels(rows, cols, 0, scale))
+                features.append({'type': 'Feature', 'properties': dict(feature.properties, **reduced)})
+            return {'type': 'FeatureCollection', 'features': features}
+        return MockReduction(self.mock_ee, compute)
+
+
+class MockReduction:
+    def __init__(self, mock_ee, compute):
+        self.mock_ee = mock_ee
+        self.compute = compute
+
+    def select(self, propertySelectors, newProperties=None, retainGeometry=True):
+        def compute():
+            reduced = self.compute()
+            for feature in reduced['features']:
+                feature['properties'] = {name: value for name, value in feature['properties'].items()
+                                         if name in propertySelectors}
+            return reduced
+        return MockReduction(self.mock_ee, compute)
+
+    def getInfo(self):
+        self.mock_ee.request()
+        return self.compute()
+
+
+class MockEE:
+    def __init__(self, latency=0.2, jitter=0.5, error_rate=0.0, throttle_rate=0.0, pixel_error_rate=0.0,
+                 max_concurrent=None, seed=0):
+        """
+        Stand-in of the ee module. Each getInfo or computePixels call is a simulated
+        request that sleeps for the request latency and fails at the given rates with
+        the errors GEE raises, so the retry, rate governor, batching, shrink and
+        fallback paths of the real fetch code are exercised. Use with patch_ee
+        :param latency: mean seconds per request
+        :param jitter: fraction of latency requests randomly vary by
+        :param error_rate: fraction of requests failing with a transient GEE error
+        :param throttle_rate: fraction of requests failing with a 429 error
+        :param pixel_error_rate: fraction of sampleRectangle requests failing with the too many pixels error
+        :param max_concurrent: concurrent requests above which requests fail as throttled, None for no limit
+        :param seed: seed of pixels and failures
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.pixel_error_rate = pixel_error_rate
+        self.max_concurrent = max_concurrent
+        self.seed = seed
+
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.stats = {'requests': 0, 'errors': 0, 'throttled': 0, 'pixel_errors': 0}
+        self.classes = {}
+
+        self.Reducer = MockReducers
+        self.Geometry = MockGeometry
+        self.Feature = MockFeature
+        self.FeatureCollection = MockFeatureCollection
+        self.data = self
+        mock_ee = self
+
+        class Image(MockImage):
+            def __init__(self, collection):
+                super().__init__(mock_ee, collection)
+
+            @staticmethod
+            def cat(images):
+                return images[0].copy(bands=[band for image in images for band in image.bands],
+                                      steps=[step for image in images for step in image.steps])
+
+        self.Image = Image
+        self.ImageCollection = Image
+
+    def Initialize(self, *args, **kwargs):
+        pass
+
+    def get_classes(self, collection):
+        """
+        Get class values of categorical dataset of collection
+        :return: numpy array of classes, None for continuous datasets
+        """
+        if collection not in self.classes:
+            class_table = get_class_table(get_collection(collection)['features'])
+            self.classes[collection] = None if class_table is None else np.array(list(class_table.keys()))
+        return self.classes[collection]
+
+    def request(self, pixels=()):
+        """
+        Simulate a single GEE request
+        :param pixels: pixel counts of the sampleRectangle calls of the request
+        """
+        with self.lock:
+            self.stats['requests'] += 1
+            self.in_flight += 1
+            in_flight = self.in_flight
+            draw = self.random.random()
+            latency = self.latency * (1 + self.jitter * (2 * self.random.random() - 1))
+        try:
+            time.sleep(max(0.0, latency))
+            if self.max_concurrent is not None and in_flight > self.max_concurrent:
+                self.count('throttled')
+                raise Exception('Too many concurrent aggregations.')
+            if draw < self.throttle_rate:
+                self.count('throttled')
+                raise Exception('429 Too Many Requests: Quota exceeded')
+            draw -= self.throttle_rate
+            if draw < self.error_rate:
+                self.count('errors')
+                raise Exception('Computation timed out.')
+            draw -= self.error_rate
+            if len(pixels) > 0:
+                if draw < self.pixel_error_rate:
+                    self.check_pixels(SAMPLE_MAX_PIXELS + 1)
+                # A single rectangle over the limit fails the whole request
+                self.check_pixels(max(pixels))
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def check_pixels(self, n_pixels):
+        """
+        Raise the error GEE raises if a rectangle is over the sampleRectangle pixel limit
+        :param n_pixels: pixels of rectangle
+        """
+        if n_pixels > SAMPLE_MAX_PIXELS:
+            self.count('pixel_errors')
+            raise Exception('Image.sampleRectangle: Too many pixels in sample; must be <= {}. Got {}.'.format(
+                SAMPLE_MAX_PIXELS, n_pixels))
+
+    def count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def computePixels(self, request):
+        """
+        Get pixels of expression over grid of request
+        :param request: computePixels request with an EPSG:4326 affine transform
+        :return: dictionary of numpy array of each band
+        """
+        self.request()
+        img = request['expression']
+        grid = request['grid']
+        transform = grid['affineTransform']
+        pixel_deg = transform['scaleX']
+        row_start = int(round((90 - transform['translateY']) / pixel_deg))
+        col_start = int(round((transform['translateX'] + 180) / pixel_deg))
+        rows = np.arange(row_start, row_start + grid['dimensions']['height'])
+        cols = np.arange(col_start, col_start + grid['dimensions']['width'])
+        scale = pixel_deg * METRES_PER_DEGREE
+        return {band: img.get_pixels(rows, cols, i, scale) for i, band in enumerate(img.bands)}
+
+    def get_stats(self):
+        """
+        Get counts of simulated requests and failures
+        :return: dictionary of requests, errors, throttled, pixel_errors
+        """
+        with self.lock:
+            return dict(self.stats)
+
+
+@contextmanager
+def patch_ee(mock_ee):
+    """
+    Replace the ee module of the modules calling the GEE API with a MockEE,
+    i.e. with patch_ee(MockEE()):, GEE images already built are discarded
+    :param mock_ee: MockEE, None to leave ee in place
+    """
+    if mock_ee is None:
+        yield
+        return
+    processor_modules = importlib.import_module('processor_modules')
+    modules = [importlib.import_module(name) for name in EE_MODULES]
+    originals = [module.ee for module in modules]
+    with processor_modules.PREPARED_IMAGES_LOCK:
+        processor_modules.PREPARED_IMAGES.clear()
+    for module in modules:
+        module.ee = mock_ee
+    try:
+        yield mock_ee
+    finally:
+        for module, original in zip(modules, originals):
+            module.ee = original
+        with processor_modules.PREPARED_IMAGES_LOCK:
+            processor_modules.PREPARED_IMAGES.clear()
@@ -3,14 +3,24 @@ Module for processing GEE datasets
 """
 
 from metric_utils import MetricUtils
+from feature_record import FeatureRecord
+from feature_spec import get_feature_spec
+from feature_engine import get_feature_engine
+from run_report import count_event
+from utils import MONTHS, get_time_steps, get_label_name, get_series_label, get_buffer_label
 import numpy as np
+import threading
 import ee
-from gee_class_constants import MODIS_LC_Type1, FIRE_LC, GHSL_Built_Class
+
+# GEE images built once per process for each run configuration, shared by all points and I/O threads
+PREPARED_IMAGES = {}
+PREPARED_IMAGES_LOCK = threading.Lock()
 
 
 class ProcessorModules:
     def __init__(self, point, collection, band, cadence, month, year,
-                 dataset_name, resolution, buffer_size, utils):
+                 dataset_name, resolution, buffer_size, utils, np_arr=None, histogram=None,
+                 stats=None, buffer_arrs=None):
         self.point = point
         self.collection = collection
         self.band = band
@@ -21,491 +31,389 @@ class ProcessorModules:
         self.resolution = resolution
         self.buffer_size = buffer_size
         self.utils = utils
-
-    def process_collection_for_img(self):
+        # Band array already fetched for this point (i.e. by BatchFetcher), skips GEE request if set
+        self.np_arr = np_arr
+        # Value: pixel count histogram already reduced by GEE for this point, used in place of the band array
+        self.histogram = histogram
+        # Summary statistics already reduced by GEE for this point, used in place of the band array
+        self.stats = stats
+        # Default value, masking rules and statistics of the dataset from configs/gee_collections.json
+        self.feature_spec = get_feature_spec(dataset_name)
+        # Last date of time series runs, every time step is sampled from one multi-band image
+        self.query_end = point.get('query_end')
+        # Buffer sizes of multi-buffer runs, the band array is fetched once at buffer_size, the largest,
+        # and features of each buffer size are calculated from its centred window. Buffer sizes sampled
+        # at a finer scale alone are calculated from a band array fetched again at that scale
+        self.buffer_sizes = point.get('buffer_sizes')
+        # Band arrays already fetched for groups of buffer sizes sampled at a finer scale than
+        # the largest buffer, by buffer size of the group fetched
+        self.buffer_arrs = buffer_arrs
+
+    def get_default_value(self):
         """
-        Processes GEE dataset
-        :return: numpy array of raw data from GEE
+        Get default value used to fill masked pixels of GEE dataset
+        :return: default class/value
         """
-        lat, lon = self.point['coordinates'][1], self.point['coordinates'][0]
-        collection = ee.ImageCollection(self.collection). \
-            filterDate('{}-01-01'.format(self.year), '{}-01-01'.format(self.year + 1))
-        # Select band type
-        data = collection.select(self.band)
-        # Get img from collection based on temporal cadence
-        img = self.utils.get_img_from_collect(data, self.cadence, self.month, self.year)
+        return self.feature_spec['default_value']
 
-        # Check if resampling needed
-        if float(self.buffer_size) > self.utils.get_allowable_buffer_size(self.resolution):
-            # Resample
-            crs = 'EPSG:4326'
-            new_resolution = self.utils.get_resampled_resolution_size(self.buffer_size)
-            print('Max buffer size exceeded, resampling to {}m to match GEE requirements'.format(new_resolution))
-            img = img.resample('bilinear').reproject(crs=crs, scale=new_resolution)
-
-        if self.dataset_name == 'modis':
-            default_value = 17
+    def get_default_array(self):
+        """
+        Get band array of points that are not sampled, set to the default value
+        :return: numpy array, with a leading time step axis for time series runs
+        """
+        shape = (2, 2)
+        time_steps = self.get_time_steps()
+        if time_steps is not None:
+            shape = (len(time_steps), 2, 2)
+        return np.zeros(shape) + self.get_default_value()
 
-        elif self.dataset_name == 'fire':
-            default_value = 160
+    def get_time_steps(self):
+        """
+        Get time steps of run
+        :return: list of (year, month) of each time step, None if not a time series run
+        """
+        if self.query_end is None:
+            return None
+        return get_time_steps(self.year, self.month, self.query_end, self.cadence)
 
-        elif self.dataset_name in ['population', 'human_settlement_layer_built_up', 'global_human_modification']:
-            default_value = 0
+    def get_step_modules(self, year, month):
+        """
+        Get ProcessorModules of a single time step of a time series run
+        :param year: year of time step
+        :param month: month of time step
+        :return: ProcessorModules
+        """
+        point = dict(self.point, query_end=None)
+        return ProcessorModules(point, self.collection, self.band, self.cadence, month, year, self.dataset_name,
+                                self.resolution, self.buffer_size, self.utils)
 
-        # Get square extent based on buffer
-        sq_extent = self.utils.get_buffer_extent(lat, lon, self.buffer_size, default_value, img)
+    def get_buffer_modules(self, buffer_size):
+        """
+        Get ProcessorModules of a single buffer size of a multi-buffer run
+        :param buffer_size: buffer extent in metres
+        :return: ProcessorModules
+        """
+        point = dict(self.point, buffer=buffer_size, buffer_sizes=None)
+        return ProcessorModules(point, self.collection, self.band, self.cadence, self.month, self.year,
+                                self.dataset_name, self.resolution, buffer_size, self.utils)
 
-        # Get band of interest
-        band_arr = sq_extent.get(self.band)
-        np_arr = np.array(band_arr.getInfo())
+    def get_buffer_groups(self):
+        """
+        Group buffer sizes of a multi-buffer run by the scale a run of the buffer size alone
+        samples at. Each group is fetched once over its largest buffer size, so the features
+        of every buffer size are calculated at the scale of a run of its own
+        :return: list of (buffer size fetched, buffer sizes of group), the group of the
+        largest buffer first
+        """
+        groups = {}
+        for buffer_size in self.buffer_sizes:
+            scale = self.get_buffer_modules(buffer_size).get_sample_scale() or float(self.resolution)
+            groups.setdefault(scale, []).append(buffer_size)
+        return [(max(group, key=float), group) for _, group in sorted(groups.items(), reverse=True)]
 
-        save_file = {'lat': lat,
-                     'lon': lon,
-                     'data_array': np_arr}
+    def get_buffer_window(self, band_arr, buffer_size, fetch_buffer_size=None):
+        """
+        Get window of band array fetched at a larger buffer covering a smaller buffer,
+        centred on the point with the same fraction of rows and columns as the buffer is of
+        the fetched buffer, as sampleRectangle of the smaller buffer would return at the same scale
+        :param band_arr: numpy array of band over the larger buffer
+        :param buffer_size: buffer extent in metres, at most the fetched buffer size
+        :param fetch_buffer_size: buffer extent in metres band_arr was fetched at, default buffer_size of the run
+        :return: numpy array of band over buffer
+        """
+        if fetch_buffer_size is None:
+            fetch_buffer_size = self.buffer_size
+        fraction = float(buffer_size) / float(fetch_buffer_size)
+        band_arr = np.atleast_2d(band_arr)
+        window = []
+        for side in band_arr.shape[-2:]:
+            centre = (side - 1) / 2.0
+            half = centre * fraction
+            window.append(slice(int(np.floor(centre - half + 0.5)), int(np.floor(centre + half + 0.5)) + 1))
+        return band_arr[..., window[0], window[1]]
+
+    def get_sample_bands(self):
+        """
+        Get bands of the GEE image sampled, one per time step for time series runs
+        :return: list of band names
+        """
+        time_steps = self.get_time_steps()
+        if time_steps is None:
+            return [self.band]
+        return ['{}_{}_{}'.format(self.band, year, MONTHS[month]) for year, month in time_steps]
 
-        return save_file
+    def get_band_value(self, sq_extent):
+        """
+        Get band arrays from sampleRectangle of the GEE image
+        :param sq_extent: GEE feature returned by sampleRectangle
+        :return: GEE array of band, or list of arrays of each time step for time series runs
+        """
+        if self.query_end is None:
+            return sq_extent.get(self.band)
+        bands = self.get_sample_bands()
+        return sq_extent.toDictionary(bands).values(bands)
 
-    def process_modis(self):
+    def get_sample_scale(self, max_pixels=None):
         """
-        Processes modis GEE data
-        :return: xarray of MODIS GEE features
+        Get the scale in metres the GEE image is sampled at
+        :param max_pixels: GEE pixel limit per buffer, default sampleRectangle limit
+        :return: sampling scale, None if sampled at native resolution
         """
-        default_value = 17
-        lat, lon = self.point['coordinates'][1], self.point['coordinates'][0]
-        print('Processing lat, lon: {}, {}'.format(lat, lon))
+        # Fixed sampling scale of dataset, i.e. nightlight at 500m, edge case for 55500m buffer extent
+        # with original resolution. Also applied when reducing, so features match the array path
+        sample_scale = self.feature_spec.get('sample_scale')
+        if max_pixels is None:
+            max_pixels = 262144
+        new_resolution = None
+        if float(self.buffer_size) > self.utils.get_allowable_buffer_size(self.resolution, max_pixels):
+            new_resolution = self.utils.get_resampled_resolution_size(self.buffer_size, max_pixels)
+        if sample_scale is not None:
+            return max(sample_scale, new_resolution or 0)
+        return new_resolution
+
+    def get_image_key(self, max_pixels=None):
+        """
+        Get key of prepared GEE image, which depends only on the run
+        configuration and not on the point
+        :param max_pixels: GEE pixel limit per buffer, default sampleRectangle limit
+        :return: tuple of image configuration
+        """
+        return (self.collection, self.band, self.cadence, self.month, self.year, str(self.resolution),
+                str(self.buffer_size), max_pixels, self.query_end)
 
-        collection = ee.ImageCollection(self.collection). \
-            filterDate('{}-01-01'.format(self.year), '{}-01-01'.format(self.year + 1))
-        # Select band type
-        data = collection.select(self.band)
-        # Get img from collection based on temporal cadence
-        img = self.utils.get_img_from_collect(data, self.cadence, self.month, self.year)
+    def build_image(self, max_pixels=None):
+        """
+        Build GEE image expression of band of interest, resampled
+        if buffer size exceeds allowable pixel limit
+        :param max_pixels: GEE pixel limit per buffer, default sampleRectangle limit
+        :return: GEE image
+        """
+        if self.query_end is not None:
+            # Images of every time step stacked as bands, so points are sampled over all steps in one request
+            images = [self.get_step_modules(year, month).build_image(max_pixels)
+                      for year, month in self.get_time_steps()]
+            return ee.Image.cat(images).rename(self.get_sample_bands())
+
+        image_type = self.feature_spec.get('image', 'collection')
+        if image_type == 'image':
+            img = ee.Image(self.collection).select(self.band)
+        elif image_type == 'first':
+            img = ee.ImageCollection(self.collection).select(self.band).first()
+        else:
+            collection = ee.ImageCollection(self.collection). \
+                filterDate('{}-01-01'.format(self.year), '{}-01-01'.format(self.year + 1))
+            # Select band type
+            data = collection.select(self.band)
+            # Get img from collection based on temporal cadence
+            img = self.utils.get_img_from_collect(data, self.cadence, self.month, self.year)
 
         # Check if resampling needed
-        if float(self.buffer_size) > self.utils.get_allowable_buffer_size(self.resolution):
-            # Resample
+        new_resolution = self.get_sample_scale(max_pixels)
+        if new_resolution is not None:
             crs = 'EPSG:4326'
-            new_resolution = self.utils.get_resampled_resolution_size(self.buffer_size)
-            print('Max buffer size exceeded, resampling to {}m to match GEE requirements'.format(new_resolution))
+            if new_resolution != self.feature_spec.get('sample_scale'):
+                print('Max buffer size exceeded, resampling to {}m to match GEE requirements'.format(new_resolution))
+                count_event('resampled_images')
             img = img.resample('bilinear').reproject(crs=crs, scale=new_resolution)
 
-        # Get square extent based on buffer
-        sq_extent = self.utils.get_buffer_extent(lat, lon, self.buffer_size, default_value, img)
-
-        # Get band of interest
-        band_arr = sq_extent.get(self.band)
-        np_arr = np.array(band_arr.getInfo())
-
-        metric_utils = MetricUtils(np_arr)
+        return img
 
-        lc_pct_cov = [[], [], [], [], [], [], [], [], [], [], [], [], [], [], [], [], []]
-        mode = metric_utils.get_mode()
-        var = np.nanvar(np_arr)
-        pct_cov_all = metric_utils.get_perc_cov(self.dataset_name)
-        for i in range(len(lc_pct_cov)):
-            lc_pct_cov[i].append(pct_cov_all[i+1]['pct_cov'])
+    def prepare_image(self, max_pixels=None):
+        """
+        Get GEE image of band of interest, built once per run configuration
+        and shared by all points, so per point requests only add the geometry
+        :param max_pixels: GEE pixel limit per buffer, default sampleRectangle limit
+        :return: GEE image
+        """
+        key = self.get_image_key(max_pixels)
+        with PREPARED_IMAGES_LOCK:
+            if key not in PREPARED_IMAGES:
+                PREPARED_IMAGES[key] = self.build_image(max_pixels)
+            return PREPARED_IMAGES[key]
 
-        lc = 'modis'
-        mode_xr = self.utils.make_dataset(mode, '{}.{}.mode'.format(lc, self.band), lat, lon)
-        var_xr = self.utils.make_dataset(var, '{}.{}.var'.format(lc, self.band), lat, lon)
-        combo_xr = mode_xr.merge(var_xr)
+    def skip_point(self, lat, lon):
+        """
+        Check if point is somewhere GEE sampling fails for the dataset
+        (Arctic/Antarctica, open ocean), in which case the band array is
+        set to the default value instead of queried
+        :param lat: latitude point
+        :param lon: longitude point
+        :return: True if point should not be sampled
+        """
+        skip = self.feature_spec.get('skip', [])
+        if 'polar' in skip:
+            if self.utils.check_in_arctic_or_antarctic(lat):
+                return True
+        if 'water' in skip:
+            if self.utils.check_water_bodies(lat, lon):
+                return True
+        return False
+
+    def sample_band_array(self, lat, lon, img):
+        """
+        Sample band of interest over buffer extent of point
+        :param lat: latitude point
+        :param lon: longitude point
+        :param img: GEE image from prepare_image
+        :return: numpy array of band
+        """
+        default_value = self.get_default_value()
+        try:
+            # Get square extent based on buffer
+            sq_extent = self.utils.get_buffer_extent(lat, lon, self.buffer_size, default_value, img)
+            # Convert to array
+            band_arr = self.get_band_value(sq_extent)
+            return np.array(band_arr.getInfo())
+        except Exception as e:
+            # Other GEE errors are raised, so the fetch is retried by the rate governor
+            if not self.feature_spec.get('shrink_on_pixel_error', False) or 'Image.sampleRectangle' not in str(e):
+                raise
+            # If exception occurred, this is due to GEE error of too many pixels due to curvature of Earth,
+            # Set to 40% of buffer and calculate
+            print("type error: " + str(e) + " Manually setting buffer size to 40% of specified.")
+            count_event('shrunk_buffers')
+            new_buffer = int(self.buffer_size) * 0.4
+            sq_extent = self.utils.get_buffer_extent(lat, lon, new_buffer, default_value, img)
+            # Convert to array
+            band_arr = self.get_band_value(sq_extent)
+            return np.array(band_arr.getInfo())
 
-        pct_all_xr = []
-        for i in range(len(lc_pct_cov)):
-            pct_all_xr.append(self.utils.make_dataset(lc_pct_cov[i][0], lc + '.' + self.band + '.' +
-                                                      MODIS_LC_Type1[i+1]['class'], lat, lon))
+    def get_band_array(self, lat, lon):
+        """
+        Get band array over buffer extent of point, using the
+        pre-fetched array if one was provided
+        :param lat: latitude point
+        :param lon: longitude point
+        :return: numpy array of band
+        """
+        if self.np_arr is not None:
+            return self.np_arr
+        if self.skip_point(lat, lon):
+            return self.get_default_array()
+        return self.sample_band_array(lat, lon, self.prepare_image())
 
-        combined_xr = combo_xr.merge(pct_all_xr[0]).merge(pct_all_xr[1]).merge(pct_all_xr[2]). \
-            merge(pct_all_xr[3]).merge(pct_all_xr[4]).merge(pct_all_xr[5]).merge(pct_all_xr[6]). \
-            merge(pct_all_xr[7]).merge(pct_all_xr[8]).merge(pct_all_xr[9]).merge(pct_all_xr[10]). \
-            merge(pct_all_xr[11]).merge(pct_all_xr[12]).merge(pct_all_xr[13]).merge(pct_all_xr[14]). \
-            merge(pct_all_xr[15]).merge(pct_all_xr[16])
+    def get_buffer_array(self, lat, lon, fetch_buffer_size):
+        """
+        Get band array of a group of buffer sizes of a multi-buffer run, using the
+        pre-fetched array if one was provided
+        :param lat: latitude point
+        :param lon: longitude point
+        :param fetch_buffer_size: buffer extent in metres the group is fetched at
+        :return: numpy array of band
+        """
+        if float(fetch_buffer_size) == float(self.buffer_size):
+            return self.get_band_array(lat, lon)
+        if self.buffer_arrs is not None and fetch_buffer_size in self.buffer_arrs:
+            return self.buffer_arrs[fetch_buffer_size]
+        return self.get_buffer_modules(fetch_buffer_size).get_band_array(lat, lon)
 
-        return combined_xr
+    def get_metric_utils(self, lat, lon):
+        """
+        Get metric utils over buffer extent of point, from the
+        pre-reduced histogram or statistics if provided
+        :param lat: latitude point
+        :param lon: longitude point
+        :return: MetricUtils of point
+        """
+        if self.histogram is not None:
+            return MetricUtils(histogram=self.histogram)
+        if self.stats is not None:
+            return MetricUtils(stats=self.stats)
+        return MetricUtils(self.get_band_array(lat, lon))
 
-    def process_fire(self):
+    def process_collection_for_img(self):
         """
-        Processes fire GEE data
-        :return: xarray of fire GEE features
+        Processes GEE dataset
+        :return: numpy array of raw data from GEE
         """
-        default_value = 160
         lat, lon = self.point['coordinates'][1], self.point['coordinates'][0]
-        print('Processing lat, lon: {}, {}'.format(lat, lon))
-
-        collection = ee.ImageCollection(self.collection). \
-            filterDate('{}-01-01'.format(self.year), '{}-01-01'.format(self.year + 1))
-        # Select band type
-        data = collection.select(self.band)
-        # Get img from collection based on temporal cadence
-        img = self.utils.get_img_from_collect(data, self.cadence, self.month, self.year)
-
-        # Check if in Arctic/Antarctica
-        if self.utils.check_in_arctic_or_antarctic(lat):
-            np_arr = np.zeros((2, 2))+160
-        elif self.utils.check_water_bodies(lat, lon):
-            np_arr = np.zeros((2, 2))+160
+        if self.np_arr is not None:
+            np_arr = self.np_arr
         else:
-            if float(self.buffer_size) > self.utils.get_allowable_buffer_size(self.resolution):
-                # Resample
-                crs = 'EPSG:4326'
-                new_resolution = self.utils.get_resampled_resolution_size(self.buffer_size)
-                print('Max buffer size exceeded, resampling to {}m to match GEE requirements'.format(new_resolution))
-                img = img.resample('bilinear').reproject(crs=crs, scale=new_resolution)
+            np_arr = self.sample_band_array(lat, lon, self.prepare_image())
 
-            # Select band type
-            data = img.select(self.band)
-            # Get square extent based on buffer
-            try:
-                sq_extent = self.utils.get_buffer_extent(lat, lon, self.buffer_size, default_value, data)
-                # Convert to array
-                band_arr = sq_extent.get(self.band)
-                np_arr = np.array(band_arr.getInfo())
-            except Exception as e:
-                if 'Image.sampleRectangle' in str(e):
-                    # If exception occurred, this is due to GEE error of too many pixels due to curvature of Earth,
-                    # Set to 40% of buffer and calculate
-                    print("type error: " + str(e) + " Manually setting buffer size to 40% of specified.")
-                    new_buffer = int(self.buffer_size) * 0.4
-                    sq_extent = self.utils.get_buffer_extent(lat, lon, new_buffer, default_value, data)
-                    # Convert to array
-                    band_arr = sq_extent.get(self.band)
-                    np_arr = np.array(band_arr.getInfo())
-                else:
-                    np_arr = np.nan
-        metric_utils = MetricUtils(np_arr)
-
-        pct_cov_1, pct_cov_2, pct_cov_3, pct_cov_4 = [], [], [], []
-        pct_cov_5, pct_cov_6, pct_cov_7, pct_cov_8 = [], [], [], []
-        pct_cov_9, pct_cov_10, pct_cov_11, pct_cov_12 = [], [], [], []
-        pct_cov_13, pct_cov_14, pct_cov_15, pct_cov_16 = [], [], [], []
-        pct_cov_17, pct_unburnt, pct_burnt = [], [], []
-
-        # Get basic stats
-        mode = metric_utils.get_mode()
-        var = np.nanvar(np_arr)
-
-        pct_cov_all = metric_utils.get_perc_cov(self.dataset_name)
-        pct_cov_1.append(pct_cov_all[10]['pct_cov'])
-        pct_cov_2.append(pct_cov_all[20]['pct_cov'])
-        pct_cov_3.append(pct_cov_all[30]['pct_cov'])
-        pct_cov_4.append(pct_cov_all[40]['pct_cov'])
-        pct_cov_5.append(pct_cov_all[50]['pct_cov'])
-        pct_cov_6.append(pct_cov_all[60]['pct_cov'])
-        pct_cov_7.append(pct_cov_all[70]['pct_cov'])
-        pct_cov_8.append(pct_cov_all[80]['pct_cov'])
-        pct_cov_9.append(pct_cov_all[90]['pct_cov'])
-        pct_cov_10.append(pct_cov_all[100]['pct_cov'])
-        pct_cov_11.append(pct_cov_all[110]['pct_cov'])
-        pct_cov_12.append(pct_cov_all[120]['pct_cov'])
-        pct_cov_13.append(pct_cov_all[130]['pct_cov'])
-        pct_cov_14.append(pct_cov_all[140]['pct_cov'])
-        pct_cov_15.append(pct_cov_all[150]['pct_cov'])
-        pct_cov_16.append(pct_cov_all[170]['pct_cov'])
-        pct_cov_17.append(pct_cov_all[180]['pct_cov'])
-        pct_unburnt.append(pct_cov_all[160]['pct_cov'])
-        pct_burnt.append(metric_utils.calc_burnt_pct())
-
-        # Make xarray dataset
-        lc = 'fire'
-        mode_xr = self.utils.make_dataset(mode, '{}.{}.mode'.format(lc, self.band), lat, lon)
-        var_xr = self.utils.make_dataset(var, '{}.{}.var'.format(lc, self.band), lat, lon)
-        combo_xr = mode_xr.merge(var_xr)
-
-        pct_1_xr = self.utils.make_dataset(pct_cov_1, lc + '.' + self.band + '.' + FIRE_LC[10]['class'], lat, lon)
-        pct_2_xr = self.utils.make_dataset(pct_cov_2, lc + '.' + self.band + '.' + FIRE_LC[20]['class'], lat, lon)
-        pct_3_xr = self.utils.make_dataset(pct_cov_3, lc + '.' + self.band + '.' + FIRE_LC[30]['class'], lat, lon)
-        pct_4_xr = self.utils.make_dataset(pct_cov_4, lc + '.' + self.band + '.' + FIRE_LC[40]['class'], lat, lon)
-        pct_5_xr = self.utils.make_dataset(pct_cov_5, lc + '.' + self.band + '.' + FIRE_LC[50]['class'], lat, lon)
-        pct_6_xr = self.utils.make_dataset(pct_cov_6, lc + '.' + self.band + '.' + FIRE_LC[60]['class'], lat, lon)
-        pct_7_xr = self.utils.make_dataset(pct_cov_7, lc + '.' + self.band + '.' + FIRE_LC[70]['class'], lat, lon)
-        pct_8_xr = self.utils.make_dataset(pct_cov_8, lc + '.' + self.band + '.' + FIRE_LC[80]['class'], lat, lon)
-        pct_9_xr = self.utils.make_dataset(pct_cov_9, lc + '.' + self.band + '.' + FIRE_LC[90]['class'], lat, lon)
-        pct_10_xr = self.utils.make_dataset(pct_cov_10, lc + '.' + self.band + '.' + FIRE_LC[100]['class'], lat, lon)
-        pct_11_xr = self.utils.make_dataset(pct_cov_11, lc + '.' + self.band + '.' + FIRE_LC[110]['class'], lat, lon)
-        pct_12_xr = self.utils.make_dataset(pct_cov_12, lc + '.' + self.band + '.' + FIRE_LC[120]['class'], lat, lon)
-        pct_13_xr = self.utils.make_dataset(pct_cov_13, lc + '.' + self.band + '.' + FIRE_LC[130]['class'], lat, lon)
-        pct_14_xr = self.utils.make_dataset(pct_cov_14, lc + '.' + self.band + '.' + FIRE_LC[140]['class'], lat, lon)
-        pct_15_xr = self.utils.make_dataset(pct_cov_15, lc + '.' + self.band + '.' + FIRE_LC[150]['class'], lat, lon)
-        pct_16_xr = self.utils.make_dataset(pct_cov_16, lc + '.' + self.band + '.' + FIRE_LC[170]['class'], lat, lon)
-        pct_17_xr = self.utils.make_dataset(pct_cov_17, lc + '.' + self.band + '.' + FIRE_LC[180]['class'], lat, lon)
-        punburnt_xr = self.utils.make_dataset(pct_unburnt, lc + '.' + self.band + '.' + FIRE_LC[160]['class'], lat, lon)
-        pburnt_xr = self.utils.make_dataset(pct_burnt, lc + '.' + self.band + '.' + 'burnt', lat, lon)
-
-        # Combine datasets
-        combined_xr = combo_xr.merge(pct_1_xr).merge(pct_2_xr).merge(pct_3_xr).merge(pct_4_xr).merge(
-            pct_5_xr).merge(pct_6_xr).merge(pct_7_xr).merge(pct_8_xr).merge(pct_9_xr).merge(pct_10_xr).merge(
-            pct_11_xr).merge(pct_12_xr).merge(pct_13_xr).merge(pct_14_xr).merge(pct_15_xr).merge(pct_16_xr).merge(
-            pct_17_xr).merge(punburnt_xr).merge(pburnt_xr)
-
-        return combined_xr
+        save_file = {'lat': lat,
+                     'lon': lon,
+                     'data_array': np_arr}
 
-    def process_pop(self):
+        return save_file
+
+    def process_features(self):
         """
-        Processes population GEE data
-        :return: xarray of population GEE features
+        Processes GEE data into the features listed in the dataset feature spec
+        :return: FeatureRecord of GEE features
         """
-        default_value = 0
         lat, lon = self.point['coordinates'][1], self.point['coordinates'][0]
-        print('Processing lat, lon: {}, {}'.format(lat, lon))
-        collection = ee.ImageCollection(self.collection). \
-            filterDate('{}-01-01'.format(self.year), '{}-01-01'.format(self.year + 1))
-        # Select band type
-        data = collection.select(self.band)
-        # Get img from collection based on temporal cadence
-        img = self.utils.get_img_from_collect(data, self.cadence, self.month, self.year)
-
-        # Check if resampling needed
-        if float(self.buffer_size) > self.utils.get_allowable_buffer_size(self.resolution):
-            # Resample
-            crs = 'EPSG:4326'
-            new_resolution = self.utils.get_resampled_resolution_size(self.buffer_size)
-            print('Max buffer size exceeded, resampling to {}m to match GEE requirements'.format(new_resolution))
-            img = img.resample('bilinear').reproject(crs=crs, scale=new_resolution)
-
-        # Get square extent based on buffer
-        sq_extent = self.utils.get_buffer_extent(lat, lon, self.buffer_size, default_value, img)
-
-        # Get band of interest
-        band_arr = sq_extent.get(self.band)
-        np_arr = np.array(band_arr.getInfo())
+        feature_engine = get_feature_engine(self.dataset_name, self.band)
+        time_steps = self.get_time_steps()
+        if time_steps is not None:
+            # Features of each time step, from the band array of the step
+            band_arr = self.get_band_array(lat, lon)
+            names = []
+            values = []
+            for (year, month), step_arr in zip(time_steps, band_arr):
+                label = get_series_label(year, month, self.cadence)
+                names += [get_label_name(name, label) for name in feature_engine.names]
+                values += list(feature_engine.compute(MetricUtils(step_arr)))
+            return FeatureRecord(lat, lon, names, values)
+
+        if self.buffer_sizes is not None:
+            # Features of each buffer size, from its window of the band array of the largest buffer of its group
+            fetch_buffers = {buffer_size: fetch_buffer for fetch_buffer, group in self.get_buffer_groups()
+                             for buffer_size in group}
+            band_arrs = {fetch_buffer: self.get_buffer_array(lat, lon, fetch_buffer)
+                         for fetch_buffer in set(fetch_buffers.values())}
+            names = []
+            values = []
+            for buffer_size in self.buffer_sizes:
+                fetch_buffer = fetch_buffers[buffer_size]
+                window = self.get_buffer_window(band_arrs[fetch_buffer], buffer_size, fetch_buffer)
+                label = get_buffer_label(buffer_size)
+                names += [get_label_name(name, label) for name in feature_engine.names]
+                values += list(feature_engine.compute(MetricUtils(window)))
+            return FeatureRecord(lat, lon, names, values)
+
+        metric_utils = self.get_metric_utils(lat, lon)
+        return FeatureRecord(lat, lon, feature_engine.names, feature_engine.compute(metric_utils))
 
-        # Get basic stats
-        mean_val = np.nanmean(np_arr)
-        max_val = np.max(np_arr)
-        min_val = np.min(np_arr)
-        var_val = np.nanvar(np_arr)
-
-        var_xr = self.utils.make_dataset(var_val, '{}.{}.var'.format(self.dataset_name, self.band), lat, lon)
-        mean_xr = self.utils.make_dataset(mean_val, '{}.{}.mean'.format(self.dataset_name, self.band), lat, lon)
-        max_xr = self.utils.make_dataset(max_val, '{}.{}.max'.format(self.dataset_name, self.band), lat, lon)
-        min_xr = self.utils.make_dataset(min_val, '{}.{}.min'.format(self.dataset_name, self.band), lat, lon)
+    def process_modis(self):
+        """
+        Processes modis GEE data
+        :return: FeatureRecord of MODIS GEE features
+        """
+        return self.process_features()
 
-        combined_xr = var_xr.merge(mean_xr).merge(max_xr).merge(min_xr)
+    def process_fire(self):
+        """
+        Processes fire GEE data
+        :return: FeatureRecord of fire GEE features
+        """
+        return self.process_features()
 
-        return combined_xr
+    def process_pop(self):
+        """
+        Processes population GEE data
+        :return: FeatureRecord of population GEE features
+        """
+        return self.process_features()
 
     def process_nightlight(self):
         """
         Processes nightlight GEE data
-        :return: xarray of nightlight GEE features
+        :return: FeatureRecord of nightlight GEE features
         """
-        default_value = 0
-        lat, lon = self.point['coordinates'][1], self.point['coordinates'][0]
-        print('Processing lat, lon: {}, {}'.format(lat, lon))
-
-        # Skipping if over the arctic/antarctica, causes issues for nightlights sampling and can assume data is 0
-        if self.utils.check_in_arctic_or_antarctic(lat):
-            np_arr = np.zeros((2, 2))
-        else:
-            collection = ee.ImageCollection(self.collection). \
-                filterDate('{}-01-01'.format(self.year), '{}-01-01'.format(self.year + 1))
-            # Select band type
-            data = collection.select(self.band)
-
-            # Get img from collection based on temporal cadence
-            img = self.utils.get_img_from_collect(data, self.cadence, self.month, self.year)
-
-            # First resample to 500m, edge case for 55500m buffer extent with original resolution
-            crs = 'EPSG:4326'
-            img = img.resample('bilinear').reproject(crs=crs, scale=500)
-
-            # Check if resampling needed
-            if float(self.buffer_size) > self.utils.get_allowable_buffer_size(self.resolution):
-                # Resample
-                new_resolution = self.utils.get_resampled_resolution_size(self.buffer_size)
-                print('Max buffer size exceeded, resampling to {}m to match GEE requirements'.format(new_resolution))
-                img.resample('bilinear').reproject(crs=crs, scale=new_resolution)
-
-            # Get square extent based on buffer
-            sq_extent = self.utils.get_buffer_extent(lat, lon, self.buffer_size, default_value, img)
-
-            # Get band of interest
-            band_arr = sq_extent.get(self.band)
-            np_arr = np.array(band_arr.getInfo())
-
-        # Get basic stats
-        mean_val = np.nanmean(np_arr)
-        var_val = np.nanvar(np_arr)
-        max_val = np.max(np_arr)
-        min_val = np.min(np_arr)
-
-        var_xr = self.utils.make_dataset(var_val, '{}.{}.var'.format(self.dataset_name, self.band), lat, lon)
-        mean_xr = self.utils.make_dataset(mean_val, '{}.{}.mean'.format(self.dataset_name, self.band), lat, lon)
-        max_xr = self.utils.make_dataset(max_val, '{}.{}.max'.format(self.dataset_name, self.band), lat, lon)
-        min_xr = self.utils.make_dataset(min_val, '{}.{}.min'.format(self.dataset_name, self.band), lat, lon)
-
-        combined_xr = var_xr.merge(mean_xr).merge(max_xr).merge(min_xr)
-
-        return combined_xr
+        return self.process_features()
 
     def process_human_settlement_built(self):
         """
         Processes Human Settlement Built Up Layer GEE data
-        :return: xarray of GHSL GEE features
+        :return: FeatureRecord of GHSL GEE features
         """
-        default_value = 0
-        lat, lon = self.point['coordinates'][1], self.point['coordinates'][0]
-        print('Processing lat, lon: {}, {}'.format(lat, lon))
-        # Get img
-        img = ee.Image(self.collection)
-
-        # Check if in Arctic/Antarctica
-        if self.utils.check_in_arctic_or_antarctic(lat):
-            np_arr = np.zeros((2, 2))
-        elif self.utils.check_water_bodies(lat, lon):
-            np_arr = np.zeros((2, 2))
-        else:
-            # Check if resampling needed
-            if float(self.buffer_size) > self.utils.get_allowable_buffer_size(self.resolution):
-                # Resample
-                crs = 'EPSG:4326'
-                new_resolution = self.utils.get_resampled_resolution_size(self.buffer_size)
-                print('Max buffer size exceeded, resampling to {}m to match GEE requirements'.format(new_resolution))
-                img = img.resample('bilinear').reproject(crs=crs, scale=new_resolution)
-
-            # Select band type
-            data = img.select(self.band)
-            # Get square extent based on buffer
-            try:
-                sq_extent = self.utils.get_buffer_extent(lat, lon, self.buffer_size, default_value, data)
-                # Convert to array
-                band_arr = sq_extent.get(self.band)
-                np_arr = np.array(band_arr.getInfo())
-            except Exception as e:
-                if 'Image.sampleRectangle' in str(e):
-                    # If exception occurred, this is due to GEE error of too many pixels due to curvature of Earth,
-                    # Set to 40% of buffer and calculate
-                    print("type error: " + str(e) + " Manually setting buffer size to 40% of specified.")
-                    new_buffer = int(self.buffer_size)*0.4
-                    sq_extent = self.utils.get_buffer_extent(lat, lon, new_buffer, default_value, data)
-                    # Convert to array
-                    band_arr = sq_extent.get(self.band)
-                    np_arr = np.array(band_arr.getInfo())
-                else:
-                    np_arr = np.nan
-
-        metric_utils = MetricUtils(np_arr)
-
-        pct_cov_1, pct_cov_2, pct_cov_3, pct_cov_4, pct_cov_5 = [], [], [], [], []
-        pct_cov_11, pct_cov_12, pct_cov_13, pct_cov_14, pct_cov_15 = [], [], [], [], []
-        pct_cov_21, pct_cov_22, pct_cov_23, pct_cov_24, pct_cov_25 = [], [], [], [], []
-        pct_built = []
-
-        # Get basic stats
-        mode = metric_utils.get_nonzero_mode()
-        var = metric_utils.get_nonzero_var()
-
-        pct_cov_all = metric_utils.get_perc_cov(self.dataset_name)
-        pct_cov_1.append(pct_cov_all[1]['pct_cov'])
-        pct_cov_2.append(pct_cov_all[2]['pct_cov'])
-        pct_cov_3.append(pct_cov_all[3]['pct_cov'])
-        pct_cov_4.append(pct_cov_all[4]['pct_cov'])
-        pct_cov_5.append(pct_cov_all[5]['pct_cov'])
-        pct_cov_11.append(pct_cov_all[11]['pct_cov'])
-        pct_cov_12.append(pct_cov_all[12]['pct_cov'])
-        pct_cov_13.append(pct_cov_all[13]['pct_cov'])
-        pct_cov_14.append(pct_cov_all[14]['pct_cov'])
-        pct_cov_15.append(pct_cov_all[15]['pct_cov'])
-        pct_cov_21.append(pct_cov_all[21]['pct_cov'])
-        pct_cov_22.append(pct_cov_all[22]['pct_cov'])
-        pct_cov_23.append(pct_cov_all[23]['pct_cov'])
-        pct_cov_24.append(pct_cov_all[24]['pct_cov'])
-        pct_cov_25.append(pct_cov_all[25]['pct_cov'])
-        pct_built.append(metric_utils.calc_built_pct())
-
-        # Make xarray dataset
-        mode_xr = self.utils.make_dataset(mode, '{}.{}.mode'.format(self.dataset_name, self.band), lat, lon)
-        var_xr = self.utils.make_dataset(var, '{}.{}.var'.format(self.dataset_name, self.band), lat, lon)
-        combo_xr = mode_xr.merge(var_xr)
-
-        pct_1_xr = self.utils.make_dataset(pct_cov_1, self.dataset_name + '.' + self.band + '.' +
-                                           GHSL_Built_Class[1]['class'], lat, lon)
-        pct_2_xr = self.utils.make_dataset(pct_cov_2, self.dataset_name + '.' + self.band + '.' +
-                                           GHSL_Built_Class[2]['class'], lat, lon)
-        pct_3_xr = self.utils.make_dataset(pct_cov_3, self.dataset_name + '.' + self.band + '.' +
-                                           GHSL_Built_Class[3]['class'], lat, lon)
-        pct_4_xr = self.utils.make_dataset(pct_cov_4, self.dataset_name + '.' + self.band + '.' +
-                                           GHSL_Built_Class[4]['class'], lat, lon)
-        pct_5_xr = self.utils.make_dataset(pct_cov_5, self.dataset_name + '.' + self.band + '.' +
-                                           GHSL_Built_Class[5]['class'], lat, lon)
-        pct_11_xr = self.utils.make_dataset(pct_cov_11, self.dataset_name + '.' + self.band + '.' +
-                                            GHSL_Built_Class[11]['class'], lat, lon)
-        pct_12_xr = self.utils.make_dataset(pct_cov_12, self.dataset_name + '.' + self.band + '.' +
-                                            GHSL_Built_Class[12]['class'], lat, lon)
-        pct_13_xr = self.utils.make_dataset(pct_cov_13, self.dataset_name + '.' + self.band + '.' +
-                                            GHSL_Built_Class[13]['class'], lat, lon)
-        pct_14_xr = self.utils.make_dataset(pct_cov_14, self.dataset_name + '.' + self.band + '.' +
-                                            GHSL_Built_Class[14]['class'], lat, lon)
-        pct_15_xr = self.utils.make_dataset(pct_cov_15, self.dataset_name + '.' + self.band + '.' +
-                                            GHSL_Built_Class[15]['class'], lat, lon)
-        pct_21_xr = self.utils.make_dataset(pct_cov_11, self.dataset_name + '.' + self.band + '.' +
-                                            GHSL_Built_Class[21]['class'], lat, lon)
-        pct_22_xr = self.utils.make_dataset(pct_cov_12, self.dataset_name + '.' + self.band + '.' +
-                                            GHSL_Built_Class[22]['class'], lat, lon)
-        pct_23_xr = self.utils.make_dataset(pct_cov_13, self.dataset_name + '.' + self.band + '.' +
-                                            GHSL_Built_Class[23]['class'], lat, lon)
-        pct_24_xr = self.utils.make_dataset(pct_cov_14, self.dataset_name + '.' + self.band + '.' +
-                                            GHSL_Built_Class[24]['class'], lat, lon)
-        pct_25_xr = self.utils.make_dataset(pct_cov_15, self.dataset_name + '.' + self.band + '.' +
-                                            GHSL_Built_Class[25]['class'], lat, lon)
-        pct_built_xr = self.utils.make_dataset(pct_built, self.dataset_name + '.' + self.band + '.' + 'built', lat, lon)
-
-        # Combine datasets
-        combined_xr = combo_xr.merge(pct_1_xr).merge(pct_2_xr).merge(pct_3_xr).merge(pct_4_xr).merge(
-            pct_5_xr).merge(pct_11_xr).merge(pct_12_xr).merge(pct_13_xr).merge(pct_14_xr).merge(pct_15_xr).\
-            merge(pct_21_xr).merge(pct_22_xr).merge(pct_23_xr).merge(pct_24_xr).merge(pct_25_xr).merge(pct_built_xr)
-
-        return combined_xr
+        return self.process_features()
 
     def process_global_human_modification(self):
         """
         Processes Global Human Modification GEE data
-        :return: xarray of GHSL GEE features
+        :return: FeatureRecord of gHM GEE features
         """
-        default_value = 0
-        lat, lon = self.point['coordinates'][1], self.point['coordinates'][0]
-        print('Processing lat, lon: {}, {}'.format(lat, lon))
-        collection = ee.ImageCollection(self.collection)
-        # Select band type
-        data = collection.select(self.band)
-        # Get img from collection
-        img = data.first()
-
-        # Check if in Arctic/Antarctica
-        if self.utils.check_in_arctic_or_antarctic(lat):
-            np_arr = np.zeros((2, 2))
-        elif self.utils.check_water_bodies(lat, lon):
-            np_arr = np.zeros((2, 2))
-        else:
-            # Check if resampling needed
-            if float(self.buffer_size) > self.utils.get_allowable_buffer_size(self.resolution):
-                # Resample
-                crs = 'EPSG:4326'
-                new_resolution = self.utils.get_resampled_resolution_size(self.buffer_size)
-                print('Max buffer size exceeded, resampling to {}m to match GEE requirements'.format(new_resolution))
-                img = img.resample('bilinear').reproject(crs=crs, scale=new_resolution)
-
-            # Get square extent based on buffer
-            sq_extent = self.utils.get_buffer_extent(lat, lon, self.buffer_size, default_value, img)
-
-            # Convert to array
-            band_arr = sq_extent.get(self.band)
-            np_arr = np.array(band_arr.getInfo())
-        metric_utils = MetricUtils(np_arr)
-
-        # Get basic stats
-        mode_val = metric_utils.get_mode()
-        mean_val = np.nanmean(np_arr)
-        max_val = np.max(np_arr)
-        min_val = np.min(np_arr)
-        var_val = np.nanvar(np_arr)
-
-        mode_xr = self.utils.make_dataset(mode_val, '{}.{}.mode'.format(self.dataset_name, self.band), lat, lon)
-        var_xr = self.utils.make_dataset(var_val, '{}.{}.var'.format(self.dataset_name, self.band), lat, lon)
-        mean_xr = self.utils.make_dataset(mean_val, '{}.{}.mean'.format(self.dataset_name, self.band), lat, lon)
-        max_xr = self.utils.make_dataset(max_val, '{}.{}.max'.format(self.dataset_name, self.band), lat, lon)
-        min_xr = self.utils.make_dataset(min_val, '{}.{}.min'.format(self.dataset_name, self.band), lat, lon)
-
-        combined_xr = mode_xr.merge(var_xr).merge(mean_xr).merge(max_xr).merge(min_xr)
-
-        return combined_xr
\ No newline at end of file
+        return self.process_features()
@@ -0,0 +1,99 @@
+"""
+Module for reporting progress of a run as points complete
+"""
+
+import sys
+import time
+import datetime
+from collections import deque
+
+
+class Progress:
+    def __init__(self, total, done=0, interval=5.0, window=60.0, stream=None):
+        """
+        Progress line of points extracted, rate and estimated time remaining,
+        updated as points complete in any order. The rate is measured over the
+        last window seconds, so the ETA follows the current rate of the run
+        :param total: number of points of run
+        :param done: number of points already extracted, i.e. when resuming
+        :param interval: minimum seconds between progress lines
+        :param window: seconds the current rate is measured over
+        :param stream: stream progress is written to, default stdout
+        """
+        self.total = total
+        self.done = done
+        self.interval = interval
+        self.window = window
+        self.stream = stream if stream is not None else sys.stdout
+        self.start_time = time.monotonic()
+        self.last_print = None
+        self.line_length = 0
+        # (time, points done) samples within window
+        self.samples = deque([(self.start_time, done)])
+
+    def update(self, n=1):
+        """
+        Count completed points and print progress if interval has passed
+        :param n: number of points completed
+        """
+        self.done += n
+        now = time.monotonic()
+        self.samples.append((now, self.done))
+        while len(self.samples) > 2 and now - self.samples[1][0] > self.window:
+            self.samples.popleft()
+        if self.last_print is None or now - self.last_print >= self.interval or self.done == self.total:
+            self.last_print = now
+            self.print_progress()
+
+    def get_rate(self):
+        """
+        Get current rate
+        :return: points per second over the last window seconds
+        """
+        (start, start_done), (end, end_done) = self.samples[0], self.samples[-1]
+        if end <= start:
+            return 0.0
+        return (end_done - start_done) / (end - start)
+
+    def get_eta(self):
+        """
+        Get estimated seconds until all points are extracted
+        :return: seconds, None if no points completed yet
+        """
+        rate = self.get_rate()
+        if rate <= 0:
+            return None
+        return (self.total - self.done) / rate
+
+    def get_line(self):
+        """
+        Get progress line
+        :return: string of points done, percent, rate and ETA
+        """
+        eta = self.get_eta()
+        eta = '--:--:--' if eta is None else str(datetime.timedelta(seconds=int(eta)))
+        percent = 100.0 * self.done / self.total if self.total > 0 else 100.0
+        return 'Extracted {}/{} points ({:.1f}%), {:.2f} points/s, ETA {}'.format(
+            self.done, self.total, percent, self.get_rate(), eta)
+
+    def print_progress(self):
+        # Overwrite the progress line on a terminal, one line per update in log files
+        if self.stream.isatty():
+            line = self.get_line()
+            self.stream.write('\r' + line.ljust(self.line_length))
+            self.line_length = len(line)
+        else:
+            self.stream.write(self.get_line() + '\n')
+        self.stream.flush()
+
+    def finish(self):
+        """
+        Print final progress line
+        """
+        elapsed = time.monotonic() - self.start_time
+        line = 'Extracted {}/{} points in {}'.format(self.done, self.total,
+                                                     str(datetime.timedelta(seconds=int(elapsed))))
+        if self.stream.isatty():
+            line = '\r' + line.ljust(self.line_length)
+        self.stream.write(line + '\n')
+        self.stream.flush()
@@ -0,0 +1,207 @@
+"""
+Module for raster backends that provide the band array over the buffer extent
+of a point, from Google Earth Engine or from rasters mirrored locally
+"""
+
+import numpy as np
+import xarray as xr
+import threading
+import abc
+import math
+import os
+from tile_mosaic import METRES_PER_DEGREE
+from utils import MONTHS
+from run_report import count_event
+
+# Names of latitude, longitude coordinates of local NetCDF rasters
+LAT_NAMES = ['lat', 'latitude', 'y']
+LON_NAMES = ['lon', 'longitude', 'x']
+
+
+class RasterBackend(abc.ABC):
+    def __init__(self, processor_modules):
+        """
+        Backend providing band arrays over buffer extents of points at the
+        sampling scale of the run. Subclasses implement get_band_array
+        :param processor_modules: ProcessorModules of the run
+        """
+        self.processor_modules = processor_modules
+        self.band = processor_modules.band
+        self.default_value = processor_modules.get_default_value()
+
+    @abc.abstractmethod
+    def get_band_array(self, lat, lon, buffer_size):
+        """
+        Get band array over buffer extent of point
+        :param lat: latitude point
+        :param lon: longitude point
+        :param buffer_size: buffer extent in metres
+        :return: numpy array of band
+        """
+
+    def fetch_arrays(self, points):
+        """
+        Get band arrays over buffer extent of points, points the dataset skips
+        are set to the default value
+        :param points: list of points from getRequests
+        :return: list of numpy arrays, ordered as points
+        """
+        arrays = []
+        for point in points:
+            lon, lat = point['coordinates']
+            if self.processor_modules.skip_point(lat, lon):
+                arrays.append(self.processor_modules.get_default_array())
+            else:
+                arrays.append(self.get_band_array(lat, lon, point['buffer']))
+        return arrays
+
+
+class EEBackend(RasterBackend):
+    """
+    Samples band arrays from the GEE image of the run with sampleRectangle
+    """
+    def get_band_array(self, lat, lon, buffer_size):
+        """
+        Get band array over buffer extent of point. The image of the run is prepared for, and
+        sampled at, the buffer size of processor_modules, so buffer_size is not used
+        :param lat: latitude point
+        :param lon: longitude point
+        :param buffer_size: buffer extent in metres, the buffer size of processor_modules is sampled
+        :return: numpy array of band
+        """
+        return self.processor_modules.sample_band_array(lat, lon, self.processor_modules.prepare_image())
+
+
+class LocalRasterBackend(RasterBackend):
+    def __init__(self, processor_modules, raster_path):
+        """
+        Reads band arrays with windowed reads from a local GeoTIFF or NetCDF
+        raster on a regular EPSG:4326 grid, i.e. a mirror of the GEE dataset,
+        so runs are limited by disk speed instead of GEE requests
+        :param processor_modules: ProcessorModules of the run
+        :param raster_path: path of .tif/.tiff or .nc raster
+        """
+        super().__init__(processor_modules)
+        self.raster_path = raster_path
+        # File handles are shared by the I/O threads, reads are serialized
+        self.lock = threading.Lock()
+        self.nodata = None
+
+        extension = os.path.splitext(raster_path)[1].lower()
+        if extension in ['.tif', '.tiff']:
+            self.open_geotiff()
+        elif extension in ['.nc', '.nc4']:
+            self.open_netcdf()
+        else:
+            raise ValueError('Unsupported raster file {}, must be GeoTIFF or NetCDF'.format(raster_path))
+
+        # Native pixel size in metres, coarser sampling scales are read by taking every n-th pixel
+        pixel_deg = abs(float(self.lats[1] - self.lats[0])) if len(self.lats) > 1 else 0
+        self.stride = 1
+        scale = processor_modules.get_sample_scale()
+        if scale is not None and pixel_deg > 0:
+            self.stride = max(1, int(round(scale / (pixel_deg * METRES_PER_DEGREE))))
+
+    def open_geotiff(self):
+        """
+        Open GeoTIFF raster, band of interest is matched by band description,
+        otherwise the first band is read
+        """
+        # rasterio is only needed for GeoTIFF rasters
+        import rasterio
+        from rasterio.windows import Window
+
+        self.dataset = rasterio.open(self.raster_path)
+        band_index = 1
+        if self.band in self.dataset.descriptions:
+            band_index = self.dataset.descriptions.index(self.band) + 1
+        self.nodata = self.dataset.nodata
+
+        transform = self.dataset.transform
+        self.lats = transform.f + (np.arange(self.dataset.height) + 0.5) * transform.e
+        self.lons = transform.c + (np.arange(self.dataset.width) + 0.5) * transform.a
+
+        def read_window(row_start, row_end, col_start, col_end):
+            window = Window.from_slices((row_start, row_end), (col_start, col_end))
+            return self.dataset.read(band_index, window=window)
+
+        self.read_window = read_window
+
+    def open_netcdf(self):
+        """
+        Open NetCDF raster, band of interest is the variable of the same name.
+        If the variable has a time dimension, the first time step of the query
+        year, or month for monthly datasets, is read as GEE does
+        """
+        self.dataset = xr.open_dataset(self.raster_path)
+        data = self.dataset[self.band]
+
+        if 'time' in data.dims:
+            query_time = str(self.processor_modules.year)
+            if self.processor_modules.cadence == 'monthly':
+                query_time = '{}-{}'.format(query_time, MONTHS.get(self.processor_modules.month,
+                                                                   self.processor_modules.month))
+            data = data.sel(time=query_time).isel(time=0)
+
+        lat_name = [name for name in LAT_NAMES if name in data.dims][0]
+        lon_name = [name for name in LON_NAMES if name in data.dims][0]
+        data = data.transpose(lat_name, lon_name)
+        self.nodata = data.attrs.get('_FillValue')
+
+        self.lats = data[lat_name].values
+        self.lons = data[lon_name].values
+
+        def read_window(row_start, row_end, col_start, col_end):
+            return data[row_start:row_end, col_start:col_end].values
+
+        self.read_window = read_window
+
+    def get_index_range(self, coords, low, high):
+        """
+        Get index range of pixel centres within low, high
+        :param coords: ascending or descending pixel centre coordinates
+        :return: first index, last index (exclusive)
+        """
+        if coords[0] > coords[-1]:
+            n = len(coords)
+            return n - np.searchsorted(coords[::-1], high, side='right'), \
+                n - np.searchsorted(coords[::-1], low, side='left')
+        return np.searchsorted(coords, low, side='left'), np.searchsorted(coords, high, side='right')
+
+    def get_window(self, lat, lon, buffer_size):
+        """
+        Get raster pixel window covering buffer extent of point
+        :param lat: latitude point
+        :param lon: longitude point
+        :param buffer_size: buffer extent in metres
+        :return: first row, last row, first col, last col (exclusive)
+        """
+        dlat = float(buffer_size) / METRES_PER_DEGREE
+        dlon = min(180.0, float(buffer_size) / (METRES_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6)))
+        row_start, row_end = self.get_index_range(self.lats, lat - dlat, lat + dlat)
+        col_start, col_end = self.get_index_range(self.lons, lon - dlon, lon + dlon)
+        return int(row_start), int(row_end), int(col_start), int(col_end)
+
+    def get_band_array(self, lat, lon, buffer_size):
+        row_start, row_end, col_start, col_end = self.get_window(lat, lon, buffer_size)
+        if row_end <= row_start or col_end <= col_start:
+            print('lat, lon: {}, {} outside of local raster, setting array to defaultValue'.format(lat, lon))
+            count_event('outside_raster_points')
+            return self.processor_modules.get_default_array()
+
+        with self.lock:
+            band_arr = np.array(self.read_window(row_start, row_end, col_start, col_end))
+        band_arr = band_arr[::self.stride, ::self.stride]
+
+        # Masked pixels are set to the default value, as sampleRectangle does
+        masked = np.zeros(band_arr.shape, dtype=bool)
+        if np.issubdtype(band_arr.dtype, np.floating):
+            masked = np.isnan(band_arr)
+        if self.nodata is not None:
+            masked |= band_arr == self.nodata
+        if masked.any():
+            band_arr = np.where(masked, self.default_value, band_arr)
+        return band_arr
+
+    def close(self):
+        self.dataset.close()
@@ -0,0 +1,198 @@
+"""
+Module for sharing a GEE request rate and concurrency limit
+between all workers of a run
+"""
+
+import threading
+import time
+from collections import deque
+
+# Messages of GEE errors raised when requests are throttled
+THROTTLE_MESSAGES = ['429', 'Too Many Requests', 'Too many concurrent', 'Quota exceeded', 'RESOURCE_EXHAUSTED',
+                     'rate limit']
+
+# Seconds the rate of completed requests is measured over
+RATE_WINDOW = 10.0
+
+
+class RateGovernor:
+    def __init__(self, rate=10.0, max_rate=1000.0, min_rate=0.5, max_concurrency=64,
+                 rate_increase=5.0, latency_tolerance=3.0, latency_window=60.0):
+        """
+        Token bucket limiting the request rate, with the rate and number of concurrent
+        requests adapted AIMD-style: increased additively on success, halved when GEE
+        throttles requests. Concurrency is also reduced while request latency is well
+        above the fastest recent latency, as requests are being queued by GEE
+        :param rate: initial requests per second
+        :param max_rate: maximum requests per second
+        :param min_rate: minimum requests per second
+        :param max_concurrency: maximum concurrent requests
+        :param rate_increase: requests per second added per second of successful requests
+        :param latency_tolerance: ratio of smoothed to fastest latency above which concurrency is reduced
+        :param latency_window: seconds the fastest latency is taken over, so a single fast request
+        does not reduce concurrency for the rest of the run
+        """
+        self.condition = threading.Condition()
+        self.rate = float(rate)
+        self.max_rate = float(max_rate)
+        self.min_rate = float(min_rate)
+        self.max_concurrency = max_concurrency
+        self.concurrency = float(max(1, max_concurrency // 4))
+        self.rate_increase = rate_increase
+        self.latency_tolerance = latency_tolerance
+        self.latency_window = latency_window
+
+        self.tokens = 1.0
+        self.last_refill = time.monotonic()
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.backoff = 1.0
+
+        self.min_latency = None
+        self.avg_latency = None
+        # Finish times and latencies of recent requests, increasing in latency, the first is the fastest
+        self.min_latencies = deque()
+        self.completed = deque()
+        self.retries = 0
+        self.throttled = 0
+
+    def refill(self, now):
+        """
+        Add tokens accumulated since last refill, capped at one second of burst
+        """
+        self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def acquire(self):
+        """
+        Block until a request may be sent
+        """
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self.refill(now)
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.in_flight >= int(self.concurrency):
+                    wait = None
+                elif self.tokens < 1:
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    self.tokens -= 1
+                    self.in_flight += 1
+                    return
+                self.condition.wait(wait)
+
+    def release(self, latency, throttled=False):
+        """
+        Report a finished request and adapt rate and concurrency
+        :param latency: request latency in seconds
+        :param throttled: True if GEE throttled the request
+        """
+        with self.condition:
+            now = time.monotonic()
+            self.in_flight -= 1
+            if throttled:
+                # Multiplicative decrease, and pause all workers so they do not stampede together
+                self.throttled += 1
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.concurrency = max(1.0, self.concurrency / 2)
+                self.paused_until = max(self.paused_until, now + self.backoff)
+                self.backoff = min(60.0, self.backoff * 2)
+            else:
+                self.completed.append(now)
+                self.prune_completed(now)
+                self.backoff = 1.0
+                # Additive increase
+                self.rate = min(self.max_rate, self.rate + self.rate_increase / self.rate)
+                self.concurrency = min(float(self.max_concurrency), self.concurrency + 1 / self.concurrency)
+                self.update_min_latency(now, latency)
+                if self.avg_latency is None:
+                    self.avg_latency = latency
+                else:
+                    self.avg_latency = 0.9 * self.avg_latency + 0.1 * latency
+                if self.avg_latency > self.latency_tolerance * self.min_latency:
+                    self.concurrency = max(1.0, self.concurrency * 0.95)
+            self.condition.notify_all()
+
+    def update_min_latency(self, now, latency):
+        """
+        Update fastest latency of requests finished within the latency window,
+        as a sliding window minimum
+        :param now: finish time of request
+        :param latency: request latency in seconds
+        """
+        while self.min_latencies and self.min_latencies[-1][1] >= latency:
+            self.min_latencies.pop()
+        self.min_latencies.append((now, latency))
+        while self.min_latencies[0][0] < now - self.latency_window:
+            self.min_latencies.popleft()
+        self.min_latency = self.min_latencies[0][1]
+
+    def prune_completed(self, now):
+        """
+        Drop finish times of completed requests older than the rate window
+        :param now: current time
+        """
+        while self.completed and self.completed[0] < now - RATE_WINDOW:
+            self.completed.popleft()
+
+    def is_throttled(self, e):
+        """
+        Check if exception was raised because GEE throttled the request
+        :param e: exception raised by request
+        :return: True if throttled
+        """
+        return any(message in str(e) for message in THROTTLE_MESSAGES)
+
+    def call(self, fn, *args, tries=10, delay=1, backoff=2, **kwargs):
+        """
+        Call fn making GEE requests once permitted, retrying on failure
+        :param fn: function making GEE requests
+        :param tries: maximum number of attempts
+        :param delay: initial delay between attempts on errors other than throttling
+        :param backoff: multiplier of delay after each attempt
+        :return: result of fn
+        """
+        for attempt in range(tries):
+            self.acquire()
+            start = time.monotonic()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                throttled = self.is_throttled(e)
+                self.release(time.monotonic() - start, throttled=throttled)
+                if attempt == tries - 1:
+                    raise
+                with self.condition:
+                    self.retries += 1
+                print('{}, retrying request'.format(str(e)))
+                # Throttled requests wait on the shared pause set in release
+                if not throttled:
+                    time.sleep(delay * backoff ** attempt)
+                continue
+            self.release(time.monotonic() - start)
+            return result
+
+    def get_rate(self):
+        """
+        Get current rate of completed requests, measured over the rate window
+        :return: completed requests per second
+        """
+        with self.condition:
+            self.prune_completed(time.monotonic())
+            return len(self.completed) / RATE_WINDOW
+
+    def get_status(self):
+        """
+        Get current state of the governor
+        :return: dictionary of request rate, limits and counts
+        """
+        rate = self.get_rate()
+        with self.condition:
+            return {'request_rate': rate,
+                    'rate_limit': self.rate,
+                    'concurrency_limit': int(self.concurrency),
+                    'in_flight': self.in_flight,
+                    'retries': self.retries,
+                    'throttled': self.throttled}
@@ -5,19 +5,26 @@ Creates airypy config, queries GEE dataset of interest, process and return .nc f
 
 import ee
 import argparse
-import multiprocessing
-from retry import retry
+import os
 import logging
 import time
 from utils import Utils
 from processor_modules import ProcessorModules
+from feature_engine import get_feature_engine
+from batch_fetcher import BatchFetcher
+from tile_mosaic import TileMosaic
+from raster_backend import EEBackend, LocalRasterBackend
+from mock_backend import MockEE, patch_ee
+from io_engine import IOEngine
+from rate_governor import RateGovernor
+from array_cache import ArrayCache
+from checkpoint_store import CheckpointStore
+from run_report import RunReport
+from progress import Progress
+from feature_record import FeatureRecord
 from generate_config import GenerateConfig
 import datetime
 
-
-# Initialize ee
-ee.Initialize(opt_url='https://earthengine-highvolume.googleapis.com')
-
 # Argparse arguments for CLI
 parser = argparse.ArgumentParser(description='airPy pipeline',
                                  formatter_class=argparse.RawTextHelpFormatter)
@@ -46,6 +53,15 @@ parser.add_argument("--date",
                     Date of query. Must be format YYYY-MM-DD
                     ''',
                     required=True)
+parser.add_argument("--end_date",
+                    help='''
+                    Optional. Last date of a time series run.
+                    Must be format YYYY-MM-DD. Every month, or
+                    year for yearly datasets, from date to
+                    end_date is extracted in one run, sampling
+                    all time steps of a point in one request.
+                    ''',
+                    default=None)
 parser.add_argument("--analysis_type",
                     help='''
                     Type of analysis. Must be one of: 
@@ -59,11 +75,27 @@ parser.add_argument("--add_time",
                     ML datasets. Specify True or False
                     ''',
                     required=True)
+parser.add_argument("--time_mode",
+                    help='''
+                    Specify how time is added when add_time is True.
+                    daily: daily time axis over the query period,
+                    features are repeated for each day when saved.
+                    bounds: features are saved once with a single
+                    time step and CF time bounds of the query period.
+                    Default daily.
+                    ''',
+                    choices=['daily', 'bounds'],
+                    default='daily')
 parser.add_argument("--buffer_size",
                             help='''
                             Specify roi buffer extent. 
-                            Units in metres.
-                            ''')
+                            Units in metres. Several buffer
+                            sizes are fetched once at the
+                            largest and features calculated
+                            for each.
+                            ''',
+                            nargs='+',
+                            required=True)
 parser.add_argument("--configs_dir",
                     help='''
                     Specify config file directory
@@ -77,10 +109,169 @@ parser.add_argument("--save_dir",
 parser.add_argument("--save_type",
                     help='''
                     Type of file to save features as. Must
-                    be one of csv, netcdf. Default netcdf.
+                    be one of csv, netcdf, zarr, parquet, arrow.
+                    Default netcdf.
                     ''',
                     required=True,
                     default='netcdf')
+parser.add_argument("--zarr_store",
+                    help='''
+                    Specify path of a shared zarr store when saving
+                    as zarr. Each region is saved as a group of the
+                    store and runs of other years or months are
+                    appended along time. Default one store per run
+                    in save_dir.
+                    ''',
+                    default=None)
+parser.add_argument("--parquet_dataset",
+                    help='''
+                    Specify path of a shared parquet dataset when
+                    saving as parquet. Features are partitioned by
+                    region and year, one file per run. Default one
+                    file per run in save_dir.
+                    ''',
+                    default=None)
+parser.add_argument("--batch_size",
+                    help='''
+                    Specify maximum number of points sampled per
+                    GEE request. If not set, each point is
+                    requested individually.
+                    ''',
+                    type=int,
+                    default=None)
+parser.add_argument("--extraction_mode",
+                    help='''
+                    How GEE data is extracted over each buffer. Must be one of:
+                    array: download raw pixel arrays and calculate features locally
+                    reduce: reduce pixels server-side by GEE for many points at once
+                    and download only the reduced values.
+                    tile: download the region as large cached tiles and cut each
+                    buffer out of them locally, for overlapping buffers.
+                    Default array.
+                    ''',
+                    choices=['array', 'reduce', 'tile'],
+                    default='array')
+parser.add_argument("--io_workers",
+                    help='''
+                    Specify number of concurrent GEE requests.
+                    Default 64.
+                    ''',
+                    type=int,
+                    default=64)
+parser.add_argument("--cpu_workers",
+                    help='''
+                    Specify number of processes calculating features.
+                    Default number of CPUs, up to 4.
+                    ''',
+                    type=int,
+                    default=min(4, os.cpu_count() or 1))
+parser.add_argument("--tile_cache_dir",
+                    help='''
+                    Specify directory tiles are cached in for
+                    tile extraction mode. Default <save_dir>/tile_cache
+                    ''',
+                    default=None)
+parser.add_argument("--max_request_rate",
+                    help='''
+                    Specify maximum GEE requests per second. The request
+                    rate and concurrency are adapted to GEE throttling
+                    up to this limit. Default 1000.
+                    ''',
+                    type=float,
+                    default=1000.0)
+parser.add_argument("--cache_dir",
+                    help='''
+                    Specify directory fetched pixel arrays are cached in,
+                    so repeated runs are served locally. Only used in
+                    array extraction mode. Default no cache.
+                    ''',
+                    default=None)
+parser.add_argument("--cache_size_mb",
+                    help='''
+                    Specify maximum size of the array cache in MB,
+                    least recently used arrays are evicted first.
+                    Default 1024.
+                    ''',
+                    type=int,
+                    default=1024)
+parser.add_argument("--resume",
+                    help='''
+                    Resume an interrupted run from its checkpoint,
+                    skipping points already extracted.
+                    ''',
+                    action='store_true')
+parser.add_argument("--checkpoint_dir",
+                    help='''
+                    Specify directory results are checkpointed in
+                    as points complete. Default <save_dir>/checkpoints
+                    ''',
+                    default=None)
+parser.add_argument("--raster_path",
+                    help='''
+                    Specify path of a local GeoTIFF or NetCDF mirror of
+                    the GEE dataset to read band arrays from instead of
+                    GEE, windowed over the buffer of each point.
+                    Default none, data is extracted from GEE.
+                    ''',
+                    default=None)
+parser.add_argument("--mock_gee",
+                    help='''
+                    Extract synthetic pixels from a local stand-in of the
+                    GEE API instead of GEE, to benchmark and test the
+                    pipeline without network access.
+                    ''',
+                    action='store_true')
+parser.add_argument("--mock_latency",
+                    help='''
+                    Specify mean seconds per request of the GEE stand-in.
+                    Default 0.2.
+                    ''',
+                    type=float,
+                    default=0.2)
+parser.add_argument("--mock_error_rate",
+                    help='''
+                    Specify fraction of requests of the GEE stand-in
+                    failing with a transient error. Default 0.
+                    ''',
+                    type=float,
+                    default=0.0)
+parser.add_argument("--mock_throttle_rate",
+                    help='''
+                    Specify fraction of requests of the GEE stand-in
+                    failing with a 429 error. Default 0.
+                    ''',
+                    type=float,
+                    default=0.0)
+parser.add_argument("--mock_pixel_error_rate",
+                    help='''
+                    Specify fraction of requests of the GEE stand-in
+                    failing with the sampleRectangle too many pixels
+                    error. Default 0.
+                    ''',
+                    type=float,
+                    default=0.0)
+parser.add_argument("--mock_max_concurrent",
+                    help='''
+                    Specify concurrent requests above which the GEE
+                    stand-in throttles requests. Default no limit.
+                    ''',
+                    type=int,
+                    default=None)
+parser.add_argument("--chunk_size",
+                    help='''
+                    Specify number of point results read back from the
+                    checkpoint at a time when assembling the output.
+                    Default 4096.
+                    ''',
+                    type=int,
+                    default=4096)
+parser.add_argument("--report_path",
+                    help='''
+                    Specify path of the json run report of stage timings,
+                    GEE request latency, throughput, retries and fallbacks.
+                    Default <save_dir>/run_report.json
+                    ''',
+                    default=None)
 
 
 def getRequests(config_data):
@@ -99,6 +290,12 @@ def getRequests(config_data):
     buffer = config_data['buffer_size']
     analysis_type = config_data['analysis_type']
     save_dir = config_data['save_dir']
+    # Points of time series runs hold the last date of the series, of multi-buffer runs all buffer sizes
+    point_options = {}
+    if config_data.get('query_end') is not None:
+        point_options['query_end'] = config_data['query_end']
+    if config_data.get('buffer_sizes') is not None:
+        point_options['buffer_sizes'] = config_data['buffer_sizes']
 
     regions_list = ['globe', 'europe', 'asia', 'australia', 'north_america', 'west_europe',
                     'east_europe', 'west_north_america', 'east_north_america']
@@ -120,7 +317,8 @@ def getRequests(config_data):
                     'buffer': buffer,
                     'analysis_type': analysis_type,
                     'save_dir': save_dir,
-                    'coordinates': [lons[k], lats[k]]})
+                    'coordinates': [lons[k], lats[k]],
+                    **point_options})
         return points
 
     lats = config_data['region']['lats']
@@ -138,16 +336,20 @@ def getRequests(config_data):
                 'buffer': buffer,
                 'analysis_type': analysis_type,
                 'save_dir': save_dir,
-                'coordinates': [lons[i], lats[j]]})
+                'coordinates': [lons[i], lats[j]],
+                **point_options})
     return points
 
 
-@retry(tries=10, delay=1, backoff=2)
-def getResult(index, point):
+def getProcessorModules(point, np_arr=None, histogram=None, stats=None, buffer_arrs=None):
     """
-    Handle HTTP requests to download GEE image
+    Set up processor modules for a point
     :param: point: lat, lon point with config information
-    :return: extracted GEE dataset features
+    :param: np_arr: band array already fetched for the point
+    :param: histogram: value: pixel count histogram already reduced for the point
+    :param: stats: summary statistics already reduced for the point
+    :param: buffer_arrs: band arrays already fetched for finer scale buffer sizes of a multi-buffer run
+    :return: ProcessorModules of point
     """
     # Generate img from given point
     collection = point['gee_data']
@@ -158,73 +360,375 @@ def getResult(index, point):
     dataset_name = point['dataset_name']
     resolution = point['resolution']
     buffer_size = point['buffer']
-    analysis_type = point['analysis_type']
 
     utils = Utils(point)
 
-    processor_modules = ProcessorModules(point, collection, c_band, c_cadence, c_month, c_year,
-                                         dataset_name, resolution, buffer_size, utils)
+    return ProcessorModules(point, collection, c_band, c_cadence, c_month, c_year,
+                            dataset_name, resolution, buffer_size, utils, np_arr, histogram, stats, buffer_arrs)
+
+
+def getResult(index, point, np_arr=None, histogram=None, stats=None, buffer_arrs=None):
+    """
+    Calculate features of point, from the data fetched by fetchPoints when given.
+    Not retried, as errors calculating features from fetched data are deterministic
+    :param: point: lat, lon point with config information
+    :param: np_arr: band array already fetched for the point, skips the HTTP request if set
+    :param: histogram: value: pixel count histogram already reduced for the point, skips the HTTP request if set
+    :param: stats: summary statistics already reduced for the point, skips the HTTP request if set
+    :param: buffer_arrs: band arrays already fetched for finer scale buffer sizes of a multi-buffer run
+    :return: extracted GEE dataset features
+    """
+    analysis_type = point['analysis_type']
+
+    processor_modules = getProcessorModules(point, np_arr, histogram, stats, buffer_arrs)
 
     if analysis_type == 'images':
         return processor_modules.process_collection_for_img()
 
-    # If not analyzing images, let's check which GEE type and process for xarray dataset
-    if dataset_name == 'modis':
-        return processor_modules.process_modis()
+    # If not analyzing images, calculate the features listed in the dataset feature spec
+    return processor_modules.process_features()
+
+
+def fetchPoints(points, extraction_mode='array'):
+    """
+    Handle HTTP requests to download GEE data for a list of points, batched
+    into as few requests as possible if more than one point is given.
+    Retried by the RateGovernor of the IOEngine on failure
+    :param: points: list of lat, lon points with config information
+    :param: extraction_mode: array to download pixel arrays, reduce to reduce server-side where supported
+    :return: list of keyword arguments of getResult holding the downloaded data, ordered as points
+    """
+    processor_modules = getProcessorModules(points[0])
+
+    if len(points) == 1 and extraction_mode == 'array':
+        lon, lat = points[0]['coordinates']
+        if points[0]['analysis_type'] == 'images':
+            return [{'np_arr': processor_modules.sample_band_array(lat, lon, processor_modules.prepare_image())}]
+        return [{'np_arr': EEBackend(processor_modules).fetch_arrays(points)[0]}]
+
+    batch_fetcher = BatchFetcher(processor_modules, batch_size=len(points))
+
+    if extraction_mode == 'reduce' and points[0]['analysis_type'] == 'collection':
+        # Categorical dataset features are derived from a frequency histogram, continuous
+        # dataset features from mean, min, max, variance and mode
+        reduction = get_feature_engine(points[0]['dataset_name'], points[0]['band']).get_reduction()
+        if reduction == 'histogram':
+            return [{'histogram': histogram} for histogram in batch_fetcher.fetch_histograms(points)]
+        return [{'stats': stats} for stats in batch_fetcher.fetch_stats(points)]
+
+    return [{'np_arr': np_arr} for np_arr in batch_fetcher.fetch_arrays(points)]
+
+
+def fetchGovernedPoints(points, extraction_mode, io_engine):
+    """
+    Handle HTTP requests to download GEE data for a list of points through the
+    rate governor of the IOEngine. Points the dataset skips make no GEE request
+    and are set to the default value without it, so batches of only skipped points,
+    finishing in no time, do not skew the request latency the governor adapts to
+    :param: points: list of lat, lon points with config information
+    :param: extraction_mode: array to download pixel arrays, reduce to reduce server-side where supported
+    :param: io_engine: IOEngine GEE requests are governed by
+    :return: list of keyword arguments of getResult holding the downloaded data, ordered as points
+    """
+    if len(points) == 1 and extraction_mode == 'array' and points[0]['analysis_type'] == 'images':
+        # Single images are sampled wherever the point is, as process_collection_for_img does
+        return io_engine.call_io(fetchPoints, points, extraction_mode)
+
+    processor_modules = getProcessorModules(points[0])
+    fetched = [None] * len(points)
+    requested = []
+    for i in range(len(points)):
+        lon, lat = points[i]['coordinates']
+        if processor_modules.skip_point(lat, lon):
+            fetched[i] = {'np_arr': processor_modules.get_default_array()}
+        else:
+            requested.append(i)
+
+    if len(requested) > 0:
+        downloaded = io_engine.call_io(fetchPoints, [points[i] for i in requested], extraction_mode)
+        for i, point_data in zip(requested, downloaded):
+            fetched[i] = point_data
+
+    return fetched
+
+
+def fetchCachedPoints(points, array_cache, io_engine):
+    """
+    Get band arrays for a list of points from the array cache, downloading
+    and caching only the points not already cached
+    :param: points: list of lat, lon points with config information
+    :param: array_cache: ArrayCache arrays are cached in
+    :param: io_engine: IOEngine missing points are requested through
+    :return: list of keyword arguments of getResult holding the band arrays, ordered as points
+    """
+    processor_modules = getProcessorModules(points[0])
+    scale = processor_modules.get_sample_scale()
+    if scale is None:
+        scale = float(processor_modules.resolution)
+
+    keys = [array_cache.get_key(point, scale) for point in points]
+    fetched = [None] * len(points)
+    missing = []
+    for i in range(len(points)):
+        np_arr = array_cache.get(keys[i])
+        if np_arr is None:
+            missing.append(i)
+        else:
+            fetched[i] = {'np_arr': np_arr}
+
+    if len(missing) > 0:
+        downloaded = fetchGovernedPoints([points[i] for i in missing], 'array', io_engine)
+        for i, point_data in zip(missing, downloaded):
+            array_cache.put(keys[i], point_data['np_arr'])
+            fetched[i] = point_data
+
+    return fetched
+
+
+def getTileResults(points, io_engine, cache_dir, chunk_size=256, on_result=None):
+    """
+    Download tiles covering the buffers of all points once, then
+    cut each buffer out of the cached tiles locally
+    :param: points: list of lat, lon points with config information
+    :param: io_engine: IOEngine tiles are downloaded and features calculated with
+    :param: cache_dir: directory tiles are cached in
+    :param: chunk_size: number of points windowed at a time
+    :param: on_result: function called with index and features of each point as it completes
+    :return: list of extracted GEE dataset features, ordered as points, None if streamed to on_result
+    """
+    # A mosaic per scale points are sampled at, more than one for multi-buffer runs
+    tile_mosaics = {}
+    for fetch_points in getFetchPoints(points):
+        tile_mosaics[fetch_points[0]['buffer']] = TileMosaic(getProcessorModules(fetch_points[0]), cache_dir)
+        tile_mosaics[fetch_points[0]['buffer']].fetch_tiles(fetch_points, io_engine)
+
+    def fetch_windows(chunk):
+        return [{'np_arr': np_arr} for np_arr in tile_mosaics[chunk[0]['buffer']].fetch_arrays(chunk)]
+
+    # Windows are cut from tiles on local disk, so are not limited by the rate governor
+    return io_engine.run(points, getBufferGroupsFetch(points, fetch_windows), getResult, batch_size=chunk_size, governed=False,
+                         on_result=on_result)
+
+
+def getLocalResults(points, io_engine, raster_path, chunk_size=256, on_result=None):
+    """
+    Read buffers of points from a local raster instead of GEE
+    :param: points: list of lat, lon points with config information
+    :param: io_engine: IOEngine rasters are read and features calculated with
+    :param: raster_path: path of local GeoTIFF or NetCDF raster
+    :param: chunk_size: number of points read at a time
+    :param: on_result: function called with index and features of each point as it completes
+    :return: list of extracted dataset features, ordered as points, None if streamed to on_result
+    """
+    # A backend per scale points are read at, more than one for multi-buffer runs
+    raster_backends = {}
+    for fetch_points in getFetchPoints(points):
+        raster_backends[fetch_points[0]['buffer']] = LocalRasterBackend(getProcessorModules(fetch_points[0]),
+                                                                        raster_path)
 
-    if dataset_name == 'fire':
-        return processor_modules.process_fire()
+    def fetch_windows(chunk):
+        return [{'np_arr': np_arr} for np_arr in raster_backends[chunk[0]['buffer']].fetch_arrays(chunk)]
 
-    if dataset_name == 'pop':
-        return processor_modules.process_pop()
+    try:
+        # Local reads make no GEE requests, so are not limited by the rate governor
+        return io_engine.run(points, getBufferGroupsFetch(points, fetch_windows), getResult, batch_size=chunk_size,
+                             governed=False, on_result=on_result)
+    finally:
+        for raster_backend in raster_backends.values():
+            raster_backend.close()
 
-    if dataset_name == 'nightlight':
-        return processor_modules.process_nightlight()
 
-    if dataset_name == 'human_settlement_layer_built_up':
-        return processor_modules.process_human_settlement_built()
+def getGroupPoints(points, fetch_buffer_size):
+    """
+    Get points of a multi-buffer run as points of a single buffer size, to fetch a group of buffer sizes
+    :param: points: list of lat, lon points with config information
+    :param: fetch_buffer_size: buffer extent in metres the group is fetched at
+    :return: list of points
+    """
+    return [dict(point, buffer=fetch_buffer_size, buffer_sizes=None) for point in points]
 
-    if dataset_name == 'global_human_modification':
-        return processor_modules.process_global_human_modification()
+
+def getFetchPoints(points):
+    """
+    Get points as fetched at each scale of the run. Multi-buffer runs fetch the points once
+    for each group of buffer sizes sampled at the same scale
+    :param: points: list of lat, lon points with config information
+    :return: list of lists of points, the points of the run first
+    """
+    if points[0].get('buffer_sizes') is None:
+        return [points]
+    groups = getProcessorModules(points[0]).get_buffer_groups()
+    return [points] + [getGroupPoints(points, fetch_buffer) for fetch_buffer, _ in groups[1:]]
 
 
-def saveResults(config_data, results_list):
+def getBufferGroupsFetch(points, fetch_fn):
+    """
+    Wrap fetch function of a run so multi-buffer runs also fetch the band arrays of buffer sizes
+    that a run of the buffer size alone samples at a finer scale than the largest buffer, once
+    per group of buffer sizes sampled at the same scale, over the largest buffer of the group
+    :param: points: list of lat, lon points with config information
+    :param: fetch_fn: function taking a list of points and returning keyword arguments of getResult
+    holding the band arrays, ordered as points
+    :return: fetch function
+    """
+    if points[0].get('buffer_sizes') is None:
+        return fetch_fn
+    processor_modules = getProcessorModules(points[0])
+    groups = processor_modules.get_buffer_groups()
+    fetch_scale = processor_modules.get_sample_scale() or float(processor_modules.resolution)
+    for fetch_buffer, group in groups[1:]:
+        scale = processor_modules.get_buffer_modules(fetch_buffer).get_sample_scale() or \
+            float(processor_modules.resolution)
+        print('Buffer sizes {} sampled at {:.0f}m instead of {:.0f}m of largest buffer, '
+              'fetched again over {}m'.format(', '.join(group), scale, fetch_scale, fetch_buffer))
+
+    def fetch_buffer_groups(chunk):
+        fetched = fetch_fn(chunk)
+        for fetch_buffer, _ in groups[1:]:
+            for point_data, group_data in zip(fetched, fetch_fn(getGroupPoints(chunk, fetch_buffer))):
+                point_data.setdefault('buffer_arrs', {})[fetch_buffer] = group_data['np_arr']
+        return fetched
+
+    return fetch_buffer_groups
+
+
+def extractResults(points, args, io_engine, on_result):
+    """
+    Extract features of points with the extraction mode of the run
+    :param: points: list of lat, lon points with config information
+    :param: args: parsed CLI arguments
+    :param: io_engine: IOEngine GEE requests and feature calculation are run with
+    :param: on_result: function called with index and features of each point as it completes
+    """
+    if points[0].get('query_end') is not None and (args.raster_path is not None or args.extraction_mode != 'array'):
+        raise ValueError('Time series runs are only supported with array extraction mode from GEE')
+    if points[0].get('buffer_sizes') is not None:
+        if args.extraction_mode == 'reduce':
+            raise ValueError('Multiple buffer sizes are not supported with reduce extraction mode')
+
+    if args.raster_path is not None:
+        getLocalResults(points, io_engine, args.raster_path, on_result=on_result)
+        return
+
+    if args.extraction_mode == 'tile':
+        tile_cache_dir = args.tile_cache_dir
+        if tile_cache_dir is None:
+            tile_cache_dir = '{}/tile_cache'.format(args.save_dir)
+        getTileResults(points, io_engine, tile_cache_dir, on_result=on_result)
+        return
+
+    batch_size = args.batch_size
+    if batch_size is None:
+        # Reducing server-side is always batched
+        batch_size = 64 if args.extraction_mode == 'reduce' else 1
+
+    if args.cache_dir is None or args.extraction_mode != 'array':
+        def fetch_points(chunk):
+            return fetchGovernedPoints(chunk, args.extraction_mode, io_engine)
+
+        # Only batches making GEE requests are governed, within fetchGovernedPoints
+        io_engine.run(points, getBufferGroupsFetch(points, fetch_points), getResult, batch_size=batch_size,
+                      governed=False, on_result=on_result)
+        return
+
+    array_cache = ArrayCache(args.cache_dir, args.cache_size_mb * 1024 * 1024)
+
+    def fetch_cached_points(chunk):
+        return fetchCachedPoints(chunk, array_cache, io_engine)
+
+    # Cache hits make no GEE requests, misses are governed within fetchCachedPoints
+    io_engine.run(points, getBufferGroupsFetch(points, fetch_cached_points), getResult, batch_size=batch_size,
+                  governed=False, on_result=on_result)
+    cache_stats = array_cache.get_stats()
+    print('Array cache hits: {}, misses: {}, evictions: {}, size: {:.1f} MB'.format(
+        cache_stats['hits'], cache_stats['misses'], cache_stats['evictions'],
+        cache_stats['size'] / (1024 * 1024)))
+
+
+def saveResults(config_data, results_list, run_report=None):
     """
     Save final results
     :param config_data: config file data for saving
     :param results_list: list of results generated by pyaq
+    :param run_report: RunReport assembly and save are timed in
     :return: saved xarray or .npy files
     """
     # initialize utils to save and format with config data params
     utils = Utils(config_data)
+    if run_report is None:
+        run_report = RunReport()
 
     if config_data['analysis_type'] == 'collection':
-        # if only one point queried, results_list[0] = results_xr
-        if len(results_list) == 1:
-            results_xr = results_list[0]
-        else:
-            results_xr = utils.combine_data(results_list)
-        # add time if specified by user
-        if config_data['add_time'] == 'True':
-            results_xr = utils.add_time_data(results_xr)
+        saveCollection(config_data, [list(enumerate(results_list))], len(results_list), run_report)
+        return
+
+    if config_data['analysis_type'] == 'images':
+        with run_report.stage('save'):
+            if utils.save_imgs(results_list):
+                return
+            else:
+                print('Save was unsuccessful!')
 
-        # Save as filetype desired
+
+def saveCollection(config_data, chunks, n_points, run_report=None, zarr_store=None, parquet_dataset=None,
+                   time_mode='daily'):
+    """
+    Assemble features of points one chunk at a time and save them, so
+    memory is bounded by the output and not by the number of results
+    :param config_data: config file data for saving
+    :param chunks: iterable of lists of (point index, FeatureRecord), i.e. from CheckpointStore.iter_chunks
+    :param n_points: number of points
+    :param run_report: RunReport assembly and save are timed in
+    :param zarr_store: path of shared zarr store, see Utils.save_zarr
+    :param parquet_dataset: path of shared parquet dataset, see Utils.save_parquet
+    :param time_mode: daily or bounds time axis, see Utils.add_time_data
+    """
+    utils = Utils(config_data)
+    if run_report is None:
+        run_report = RunReport()
+
+    with run_report.stage('assembly'):
+        features = utils.assemble_features(chunks, n_points)
+        columns = None
+        if config_data.get('query_end') is not None or config_data.get('buffer_sizes') is not None:
+            # Time series runs are saved with a time step for each query period, multi-buffer runs
+            # with a buffer step for each buffer size
+            if config_data['file_type'] in ['netcdf', 'zarr']:
+                results_xr = utils.combine_labels(*features)
+                if config_data['add_time'] in [True, 'True']:
+                    if config_data.get('query_end') is None:
+                        results_xr = utils.add_time_data(results_xr, time_mode)
+                    elif time_mode == 'daily':
+                        results_xr = utils.expand_time_data(results_xr)
+            else:
+                features, columns = utils.get_labelled_features(features)
+        elif config_data['file_type'] in ['netcdf', 'zarr']:
+            names, lats, lons, values = features
+            # if only one point queried, results_xr holds scalar lat, lon
+            if n_points == 1:
+                results_xr = FeatureRecord(lats[0], lons[0], names, values[0]).to_dataset()
+            else:
+                results_xr = utils.combine_features(names, lats, lons, values)
+            # add time if specified by user
+            if config_data['add_time'] in [True, 'True']:
+                results_xr = utils.add_time_data(results_xr, time_mode)
+
+    # Save as filetype desired
+    with run_report.stage('save'):
         # csv
         if config_data['file_type'] == 'csv':
-            utils.save_custom_df(results_list)
+            utils.save_features_df(features, columns)
             return
         if config_data['file_type'] == 'netcdf':
             # netcdf
-            if utils.save_collection(results_xr):
-                return
-            else:
+            if not utils.save_collection(results_xr):
                 print('Save was unsuccessful!')
-
-    if config_data['analysis_type'] == 'images':
-        if utils.save_imgs(results_list):
-            return
-        else:
-            print('Save was unsuccessful!')
+        if config_data['file_type'] == 'zarr':
+            print('Saved to {}'.format(utils.save_zarr(results_xr, zarr_store)))
+        if config_data['file_type'] == 'parquet':
+            print('Saved to {}'.format(utils.save_parquet(features, parquet_dataset, columns=columns)))
+        if config_data['file_type'] == 'arrow':
+            print('Saved to {}'.format(utils.save_arrow(features, columns=columns)))
 
 
 if __name__ == '__main__':
@@ -234,21 +738,82 @@ if __name__ == '__main__':
 
     args = parser.parse_args()
 
+    # Initialize ee, not needed when reading from a local raster or the GEE stand-in
+    if args.raster_path is None and not args.mock_gee:
+        ee.Initialize(opt_url='https://earthengine-highvolume.googleapis.com')
+
+    run_report = RunReport()
     # Generate config file from user inputs to run through pipeline
-    generate_config = GenerateConfig(args.gee_data, args.region, args.date, args.analysis_type,
-                                     args.add_time, args.buffer_size, args.configs_dir, args.save_dir,
-                                     args.band, args.save_type)
-    data = generate_config.generate_config_dict()
-    items = getRequests(data)
-    pool = multiprocessing.Pool(25)
-    results = []
-    for result in pool.starmap(getResult, enumerate(items)):
-        results.append(result)
-    pool.close()
-    pool.join()
-
-    # Save results
-    saveResults(data, results)
+    with run_report.stage('config'):
+        # Band arrays are fetched at the largest buffer size
+        buffer_sizes = args.buffer_size if len(args.buffer_size) > 1 else None
+        generate_config = GenerateConfig(args.gee_data, args.region, args.date, args.analysis_type,
+                                         args.add_time, max(args.buffer_size, key=float), args.configs_dir,
+                                         args.save_dir, args.band, args.save_type, args.end_date, buffer_sizes)
+        data = generate_config.generate_config_dict()
+    with run_report.stage('requests'):
+        items = getRequests(data)
+    # All I/O workers share one governor so throttling slows the whole run down together
+    governor = RateGovernor(rate=min(10.0, args.max_request_rate), max_rate=args.max_request_rate,
+                            max_concurrency=args.io_workers)
+    io_engine = IOEngine(args.io_workers, args.cpu_workers, governor, run_report)
+    # Results are checkpointed as points complete, so an interrupted run loses only in-flight points.
+    # Band arrays of images runs are saved straight to the image store, which is resumed from instead
+    if data['analysis_type'] == 'images':
+        checkpoint_store = Utils(data).get_image_store(items)
+    else:
+        checkpoint_dir = args.checkpoint_dir
+        if checkpoint_dir is None:
+            checkpoint_dir = '{}/checkpoints'.format(args.save_dir)
+        checkpoint_store = CheckpointStore(checkpoint_dir, items)
+    done = checkpoint_store.open(resume=args.resume)
+    pending = [i for i in range(len(items)) if i not in done]
+    pending_items = [items[i] for i in pending]
+    if args.resume:
+        print('Resuming run with {} of {} points already extracted'.format(len(done), len(items)))
+    progress = Progress(len(items), done=len(done))
+
+    # Results stream into the checkpoint in completion order, so slow points do not hold up the others
+    def save_result(index, result):
+        checkpoint_store.append(pending[index], result)
+        progress.update()
+
+    # The real fetch code of the run makes its requests to the GEE stand-in
+    mock_ee = None
+    if args.mock_gee:
+        mock_ee = MockEE(latency=args.mock_latency, error_rate=args.mock_error_rate,
+                         throttle_rate=args.mock_throttle_rate, pixel_error_rate=args.mock_pixel_error_rate,
+                         max_concurrent=args.mock_max_concurrent)
+
+    try:
+        if len(pending_items) > 0:
+            with run_report.stage('extraction'), patch_ee(mock_ee):
+                extractResults(pending_items, args, io_engine, save_result)
+            progress.finish()
+    finally:
+        checkpoint_store.close()
+
+    if mock_ee is not None:
+        mock_stats = mock_ee.get_stats()
+        print('GEE stand-in requests: {}, errors: {}, throttled: {}, pixel errors: {}'.format(
+            mock_stats['requests'], mock_stats['errors'], mock_stats['throttled'], mock_stats['pixel_errors']))
+
+    status = governor.get_status()
+    print('GEE requests retried: {}, throttled: {}, final rate limit: {:.1f} requests/s'.format(
+        status['retries'], status['throttled'], status['rate_limit']))
+
+    # Save results, collection features are streamed from the checkpoint in chunks
+    checkpoint_store.check_complete()
+    if data['analysis_type'] == 'collection':
+        saveCollection(data, checkpoint_store.iter_chunks(args.chunk_size), len(items), run_report,
+                       args.zarr_store, args.parquet_dataset, args.time_mode)
+    else:
+        print('Saved to {}'.format(checkpoint_store.path))
+
+    report_path = args.report_path
+    if report_path is None:
+        report_path = '{}/run_report.json'.format(args.save_dir)
+    run_report.save(report_path, governor)
 
     # get the end time of program
     et = time.time()
@@ -0,0 +1,165 @@
+"""
+Module for timing the stages of a run and recording request latency,
+throughput and fallbacks, saved as a json run report
+"""
+
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+import numpy as np
+
+# Fallbacks taken during the run, i.e. resampling or shrinking buffers, counted where they happen
+RUN_EVENTS = Counter()
+RUN_EVENTS_LOCK = threading.Lock()
+
+
+def count_event(name, n=1):
+    """
+    Count fallback taken during the run
+    :param name: event name
+    :param n: number of events
+    """
+    with RUN_EVENTS_LOCK:
+        RUN_EVENTS[name] += n
+
+
+def get_nbytes(data):
+    """
+    Get bytes of numpy arrays in fetched data
+    :param data: array, or list or dictionary holding arrays
+    :return: number of bytes
+    """
+    if isinstance(data, np.ndarray):
+        return data.nbytes
+    if isinstance(data, dict):
+        return sum(get_nbytes(value) for value in data.values())
+    if isinstance(data, (list, tuple)):
+        return sum(get_nbytes(value) for value in data)
+    return 0
+
+
+def get_percentiles(values):
+    """
+    Get summary of timings
+    :param values: list of seconds
+    :return: dictionary of count, mean, p50, p95, p99, max seconds
+    """
+    if len(values) == 0:
+        return {'count': 0}
+    values = np.array(values)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'count': len(values), 'total': float(values.sum()), 'mean': float(values.mean()), 'p50': float(p50),
+            'p95': float(p95), 'p99': float(p99), 'max': float(values.max())}
+
+
+class RunReport:
+    def __init__(self):
+        """
+        Instrumentation of a run: seconds of each stage, latency of every GEE request,
+        bytes of the decoded arrays fetched, seconds calculating features of each point and fallbacks taken
+        """
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.stages = {}
+        self.fetch_latencies = []
+        self.fetch_errors = 0
+        self.bytes_fetched = 0
+        self.compute_times = []
+        self.points = 0
+        self.events_start = Counter(RUN_EVENTS)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time stage of run, i.e. with run_report.stage('save'):
+        :param name: stage name
+        """
+        st = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - st
+
+    def timed_fetch(self, fn):
+        """
+        Wrap function making a GEE request to record its latency and the bytes of its decoded result
+        :param fn: function making GEE request
+        :return: wrapped function
+        """
+        def fetch(*args, **kwargs):
+            st = time.perf_counter()
+            try:
+                fetched = fn(*args, **kwargs)
+            except Exception:
+                with self.lock:
+                    self.fetch_latencies.append(time.perf_counter() - st)
+                    self.fetch_errors += 1
+                raise
+            latency = time.perf_counter() - st
+            nbytes = get_nbytes(fetched)
+            with self.lock:
+                self.fetch_latencies.append(latency)
+                self.bytes_fetched += nbytes
+            return fetched
+        return fetch
+
+    def record_compute(self, seconds):
+        """
+        Record seconds calculating features of a point
+        """
+        with self.lock:
+            self.compute_times.append(seconds)
+            self.points += 1
+
+    def get_report(self, governor=None):
+        """
+        Get run report
+        :param governor: RateGovernor of the run, for retries and throttling
+        :return: dictionary of run report
+        """
+        extraction_seconds = self.stages.get('extraction', 0.0)
+        events = Counter(RUN_EVENTS)
+        events.subtract(self.events_start)
+        with self.lock:
+            report = {'start': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.start_time)),
+                      'seconds': time.time() - self.start_time,
+                      'stages': dict(self.stages),
+                      'points': self.points,
+                      'points_per_second': self.points / extraction_seconds if extraction_seconds > 0 else None,
+                      'requests': {'latency': get_percentiles(self.fetch_latencies),
+                                   'errors': self.fetch_errors,
+                                   'bytes_fetched': self.bytes_fetched},
+                      'compute': get_percentiles(self.compute_times),
+                      'events': {name: count for name, count in events.items() if count > 0}}
+        if governor is not None:
+            report['governor'] = governor.get_status()
+        return report
+
+    def save(self, report_path, governor=None):
+        """
+        Save run report as json and print summary
+        :param report_path: path of json file
+        :param governor: RateGovernor of the run, for retries and throttling
+        :return: dictionary of run report
+        """
+        report = self.get_report(governor)
+        report_dir = os.path.dirname(report_path)
+        if report_dir != '' and not os.path.exists(report_dir):
+            os.makedirs(report_dir)
+        with open(report_path, 'w') as json_file:
+            json.dump(report, json_file, indent=4)
+
+        print('Stage seconds: {}'.format(', '.join('{}: {:.2f}'.format(name, seconds)
+                                                   for name, seconds in report['stages'].items())))
+        latency = report['requests']['latency']
+        if latency['count'] > 0:
+            print('GEE requests: {}, latency p50: {:.2f}s, p95: {:.2f}s, p99: {:.2f}s, fetched: {:.1f} MB'.format(
+                latency['count'], latency['p50'], latency['p95'], latency['p99'],
+                report['requests']['bytes_fetched'] / (1024 * 1024)))
+        if report['points_per_second'] is not None:
+            print('Points: {}, {:.2f} points/s'.format(report['points'], report['points_per_second']))
+        print('Run report saved to {}'.format(report_path))
+        return report
@@ -0,0 +1,63 @@
+"""
+Test functions in array_cache
+"""
+from array_cache import ArrayCache
+import numpy as np
+import os
+
+point = {'gee_data': 'MODIS/006/MCD12Q1', 'band': 'LC_Type1', 'query_year': '2010', 'query_month': '01',
+         't_cadence': 'yearly', 'analysis_type': 'collection', 'resolution': '500', 'buffer': '55500',
+         'coordinates': [10.0, 45.0]}
+
+
+def test_get_key(tmp_path):
+    """Test keys differ by point parameters and sampling scale"""
+    array_cache = ArrayCache(str(tmp_path))
+    other_point = dict(point, coordinates=[10.0, 46.0])
+    assert array_cache.get_key(point, 500) == array_cache.get_key(dict(point), 500.0)
+    assert array_cache.get_key(point, 500) != array_cache.get_key(other_point, 500)
+    assert array_cache.get_key(point, 500) != array_cache.get_key(point, 1000)
+
+
+def test_put_get(tmp_path):
+    """Test cached array is returned and hits and misses are counted"""
+    array_cache = ArrayCache(str(tmp_path))
+    key = array_cache.get_key(point, 500)
+    assert array_cache.get(key) is None
+    band_arr = np.arange(12).reshape(3, 4)
+    array_cache.put(key, band_arr)
+    assert np.array_equal(array_cache.get(key), band_arr)
+    # Failed samples are not cached
+    array_cache.put('ab' * 32, np.nan)
+    assert array_cache.get('ab' * 32) is None
+    assert array_cache.get_stats()['hits'] == 1
+    assert array_cache.get_stats()['misses'] == 2
+
+
+def test_put_get_time_series(tmp_path):
+    """Test arrays of every time step of time series runs are cached"""
+    array_cache = ArrayCache(str(tmp_path))
+    series_point = dict(point, query_end='2012-01-01')
+    key = array_cache.get_key(series_point, 500)
+    assert key != array_cache.get_key(point, 500)
+    band_arr = np.arange(36).reshape(3, 3, 4)
+    array_cache.put(key, band_arr)
+    assert np.array_equal(array_cache.get(key), band_arr)
+
+
+def test_evict(tmp_path):
+    """Test least recently used arrays are evicted once over max size"""
+    array_cache = ArrayCache(str(tmp_path))
+    rng = np.random.default_rng(0)
+    keys = ['{:064d}'.format(i) for i in range(4)]
+    for i in range(4):
+        array_cache.put(keys[i], rng.random((50, 50)))
+        os.utime(array_cache.get_path(keys[i]), (i, i))
+    # Access first array so it is the most recently used
+    array_cache.get(keys[0])
+    array_cache.max_bytes = array_cache.size * 3 // 4
+    array_cache.put(keys[3], rng.random((50, 50)))
+    assert array_cache.get(keys[0]) is not None
+    assert array_cache.get(keys[1]) is None
+    assert array_cache.get_stats()['evictions'] >= 1
+    assert array_cache.size <= array_cache.max_bytes
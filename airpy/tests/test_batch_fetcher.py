@@ -0,0 +1,60 @@
+"""
+Test functions in batch_fetcher
+"""
+from batch_fetcher import BatchFetcher, REDUCE_MAX_PIXELS
+from processor_modules import ProcessorModules
+from mock_backend import MockEE, patch_ee
+from utils import Utils
+import numpy as np
+
+
+class TestBatchFetcher():
+    def setup_method(self):
+        # batch fetcher over modis collection, no GEE requests are made by these tests
+        self.point = {'coordinates': [-118.125, 34.205]}
+        processor_modules = ProcessorModules(self.point, 'MODIS/006/MCD12Q1', 'LC_Type1', 'yearly', 'jan', 2015,
+                                             'modis', '500', 5000, Utils())
+        self.batch_fetcher = BatchFetcher(processor_modules, batch_size=10, max_pixels=1000)
+
+    def test_get_point_pixels(self):
+        """Test function to estimate pixels over buffer extent"""
+        # 5000m buffer at 500m resolution is a 21 x 21 pixel extent
+        assert self.batch_fetcher.get_point_pixels() == 441
+
+    def test_get_batches(self):
+        """Test function to split points into batches"""
+        # Pixel budget allows 2 points per request, below batch_size of 10
+        batches = self.batch_fetcher.get_batches(list(range(5)))
+        assert batches == [[0, 1], [2, 3], [4]]
+
+        self.batch_fetcher.max_pixels = 100000
+        batches = self.batch_fetcher.get_batches(list(range(25)))
+        assert [len(b) for b in batches] == [10, 10, 5]
+
+    def test_parse_histogram(self):
+        """Test function to convert GEE histogram keys to class values"""
+        histogram = self.batch_fetcher.parse_histogram({'3': 10, '17': 2.0, '16.5': 1})
+        assert histogram == {3: 10, 17: 2, 16.5: 1}
+        # Empty histogram, no pixels in buffer extent
+        assert self.batch_fetcher.parse_histogram({}) == {17: 1}
+
+    def test_reduce_matches_array(self):
+        """Test features reduced server-side match features of fetched arrays of the same points"""
+        points = [self.point, {'coordinates': [-117.0, 34.205]}]
+        for args in [('MODIS/006/MCD12Q1', 'LC_Type1', 'yearly', 'jan', 2015, 'modis', '500'),
+                     ('NOAA/VIIRS/DNB/MONTHLY_V1/VCMCFG', 'avg_rad', 'monthly', 'jan', 2019, 'nightlight', '463.83')]:
+            processor_modules = ProcessorModules(self.point, *args, 5000, Utils())
+            batch_fetcher = BatchFetcher(processor_modules)
+            with patch_ee(MockEE(latency=0)):
+                arrays = batch_fetcher.fetch_arrays(points)
+                if args[5] == 'modis':
+                    reductions = [{'histogram': histogram} for histogram in batch_fetcher.fetch_histograms(points)]
+                else:
+                    # Nightlight is sampled at its fixed 500m sample scale, not the native 463.83m
+                    assert batch_fetcher.get_sample_scale(REDUCE_MAX_PIXELS) == 500
+                    reductions = [{'stats': stats} for stats in batch_fetcher.fetch_stats(points)]
+            for point, np_arr, reduction in zip(points, arrays, reductions):
+                array_record = ProcessorModules(point, *args, 5000, Utils(), np_arr).process_features()
+                reduce_record = ProcessorModules(point, *args, 5000, Utils(), **reduction).process_features()
+                assert array_record.names == reduce_record.names
+                assert np.allclose(array_record.values, reduce_record.values)
@@ -0,0 +1,44 @@
+"""
+Test functions in benchmark
+"""
+from benchmark import parser, runBenchmark, runStage, STAGES
+import glob
+import tracemalloc
+import xarray as xr
+
+
+def test_runBenchmark(tmp_path):
+    """Test every stage is timed over a small region"""
+    args = parser.parse_args(['--sizes', 'mini_test', '--buffer_size', '5000', '--io_workers', '4',
+                              '--save_dir', str(tmp_path)])
+    results = []
+    runBenchmark(args, 'mini_test', str(tmp_path), results)
+    assert [result['stage'] for result in results] == STAGES
+    for result in results:
+        assert result['points'] > 0
+        assert result['seconds'] >= 0
+        assert result['peak_memory_mb'] >= 0
+    # Features are saved with the time axis added by the add_time stage
+    saved = glob.glob('{}/*_with_time.nc'.format(tmp_path))
+    assert len(saved) == 1
+    with xr.open_dataset(saved[0]) as ds:
+        assert 'time' in ds.dims
+
+    results = []
+    args = parser.parse_args(['--stages', 'add_time', '--save_dir', str(tmp_path)])
+    runBenchmark(args, 'mini_test', str(tmp_path), results)
+    assert [result['stage'] for result in results] == ['add_time']
+
+
+def test_runStage():
+    """Test stage is timed without tracemalloc and its memory measured in a separate run"""
+    tracing = []
+
+    def stage(n):
+        tracing.append(tracemalloc.is_tracing())
+        return list(range(n))
+
+    results = []
+    assert runStage(results, 'mini_test', 'stage', 10, stage, 100000) == list(range(100000))
+    assert tracing == [False, True]
+    assert results[0]['peak_memory_mb'] > 1
@@ -0,0 +1,80 @@
+"""
+Test functions in checkpoint_store
+"""
+from checkpoint_store import CheckpointStore
+from io_engine import IOEngine
+import numpy as np
+import pytest
+
+points = [{'coordinates': [lon, 10.0]} for lon in range(5)]
+
+
+def fetch_points(batch):
+    return [{'value': p['coordinates'][0]} for p in batch]
+
+
+def compute_point(index, point, value):
+    return {'lat': 10.0, 'lon': value, 'data_array': np.zeros((2, 2)) + value}
+
+
+def test_resume(tmp_path):
+    """Test results saved before an interruption are loaded on resume"""
+    checkpoint_store = CheckpointStore(str(tmp_path), points)
+    assert checkpoint_store.open() == set()
+    checkpoint_store.append(3, compute_point(3, points[3], 3))
+    checkpoint_store.append(0, compute_point(0, points[0], 0))
+    checkpoint_store.close()
+
+    checkpoint_store = CheckpointStore(str(tmp_path), points)
+    done = checkpoint_store.open(resume=True)
+    assert sorted(done) == [0, 3]
+    assert np.array_equal(checkpoint_store.load()[3]['data_array'], np.zeros((2, 2)) + 3)
+    with pytest.raises(ValueError):
+        checkpoint_store.get_results()
+    with pytest.raises(ValueError):
+        checkpoint_store.check_complete()
+
+    pending = [i for i in range(len(points)) if i not in done]
+    io_engine = IOEngine(io_workers=2, cpu_workers=0)
+    io_engine.run([points[i] for i in pending], fetch_points, compute_point,
+                  on_result=lambda i, result: checkpoint_store.append(pending[i], result))
+    checkpoint_store.close()
+    assert [result['lon'] for result in checkpoint_store.get_results()] == [0, 1, 2, 3, 4]
+
+
+def test_partial_record(tmp_path):
+    """Test a partially written last record is dropped"""
+    checkpoint_store = CheckpointStore(str(tmp_path), points)
+    checkpoint_store.open()
+    checkpoint_store.append(1, compute_point(1, points[1], 1))
+    checkpoint_store.close()
+    with open(checkpoint_store.path, 'ab') as f:
+        f.write(b'\x40\x00\x00\x00\x00\x00\x00\x00partial')
+    assert list(checkpoint_store.open(resume=True)) == [1]
+    checkpoint_store.append(2, compute_point(2, points[2], 2))
+    checkpoint_store.close()
+    assert sorted(checkpoint_store.load()) == [1, 2]
+
+
+def test_new_run(tmp_path):
+    """Test checkpoints of different runs are kept apart, and a new run starts a new checkpoint"""
+    checkpoint_store = CheckpointStore(str(tmp_path), points)
+    assert CheckpointStore(str(tmp_path), points[:2]).path != checkpoint_store.path
+    checkpoint_store.open()
+    checkpoint_store.append(1, compute_point(1, points[1], 1))
+    checkpoint_store.close()
+    assert checkpoint_store.open(resume=False) == set()
+    checkpoint_store.close()
+    assert checkpoint_store.load() == {}
+
+
+def test_iter_chunks(tmp_path):
+    """Test records are read back in chunks, in the order they were saved"""
+    checkpoint_store = CheckpointStore(str(tmp_path), points)
+    checkpoint_store.open()
+    for i in [4, 2, 0, 1, 3]:
+        checkpoint_store.append(i, compute_point(i, points[i], i))
+    checkpoint_store.close()
+    checkpoint_store.check_complete()
+    chunks = list(checkpoint_store.iter_chunks(2))
+    assert [[index for index, _ in chunk] for chunk in chunks] == [[4, 2], [0, 1], [3]]
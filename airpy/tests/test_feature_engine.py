@@ -0,0 +1,62 @@
+"""
+Test functions in feature_engine and feature_spec
+"""
+from feature_engine import FeatureEngine
+from feature_spec import load_feature_specs, get_class_table
+from processor_modules import ProcessorModules
+from metric_utils import MetricUtils
+from utils import Utils
+from gee_class_constants import FIRE_LC
+import numpy as np
+import json
+import pytest
+
+
+def test_feature_names():
+    """Test feature names follow the dataset spec"""
+    feature_engine = FeatureEngine('fire', 'LandCover')
+    assert len(feature_engine.names) == 21
+    assert feature_engine.names[:2] == ['fire.LandCover.mode', 'fire.LandCover.var']
+    # Unburnt is output after the other land cover classes
+    assert feature_engine.names[-2:] == ['fire.LandCover.{}'.format(FIRE_LC[160]['class']), 'fire.LandCover.burnt']
+    assert FeatureEngine('pop', 'population_density').names == ['pop.population_density.{}'.format(stat)
+                                                               for stat in ['var', 'mean', 'max', 'min']]
+    assert feature_engine.get_reduction() == 'histogram'
+    assert FeatureEngine('nightlight', 'avg_rad').get_reduction() == 'stats'
+
+
+def test_compute():
+    """Test features from a histogram match features from the array"""
+    ghsl_array = np.array([[0, 0, 11], [21, 2, 21]])
+    feature_engine = FeatureEngine('human_settlement_layer_built_up', 'built_characteristics')
+    values = feature_engine.compute(MetricUtils(ghsl_array))
+    assert np.allclose(values, feature_engine.compute(MetricUtils(histogram={0: 2, 2: 1, 11: 1, 21: 2})))
+    features = dict(zip(feature_engine.names, values))
+    prefix = 'human_settlement_layer_built_up.built_characteristics.'
+    assert features[prefix + 'mode'] == 21
+    # Classes 21-25 are calculated from their own pixels
+    assert features[prefix + 'built_res_3'] == 0.25
+    assert features[prefix + 'built_non_res_3'] == 0.5
+    assert features[prefix + 'built'] == 0.25
+
+
+def test_sample_scale():
+    """Test nightlight is sampled at 500m, or coarser if the buffer requires it"""
+    processor_modules = ProcessorModules({'coordinates': [0, 0]}, 'NOAA/VIIRS/DNB/MONTHLY_V1/VCMCFG', 'avg_rad',
+                                         'monthly', '01', 2020, 'nightlight', '463.83', 55500, Utils())
+    assert processor_modules.get_sample_scale() == 500
+    processor_modules.buffer_size = 200000
+    assert processor_modules.get_sample_scale() > 500
+
+
+def test_load_feature_specs(tmp_path):
+    """Test feature specs are checked when loaded"""
+    specs = load_feature_specs()
+    assert list(get_class_table(specs['fire']))[-1] == 160
+    assert get_class_table(specs['pop']) is None
+
+    collection = {'gee_dataset': {'test': {'name': 'test', 'features': {'default_value': 0, 'stats': ['median']}}}}
+    collection_file = tmp_path / 'gee_collections.json'
+    collection_file.write_text(json.dumps(collection))
+    with pytest.raises(ValueError):
+        load_feature_specs(str(collection_file))
@@ -0,0 +1,41 @@
+"""
+Test functions in feature_record
+"""
+from feature_record import FeatureRecord
+from utils import Utils
+import numpy as np
+import pickle
+import xarray as xr
+
+utils = Utils()
+names = ['pop.population.var', 'pop.population.mean']
+
+
+def test_to_dataset():
+    """Test record converts to xarray with lat, lon coordinates"""
+    record = FeatureRecord(34.205, -118.125, names, [2.5, 10])
+    ds = record.to_dataset()
+    assert list(ds.data_vars) == names
+    assert sorted(ds.coords) == ['lat', 'lon']
+    assert float(ds['pop.population.mean']) == 10.0
+    assert record.get('pop.population.var') == 2.5
+
+
+def test_pickle():
+    """Test record has no instance dict and round trips through pickle"""
+    record = FeatureRecord(1.0, 2.0, names, [np.nan, 3.0])
+    assert not hasattr(record, '__dict__')
+    loaded = pickle.loads(pickle.dumps(record))
+    assert loaded.names == record.names
+    assert np.array_equal(loaded.values, record.values, equal_nan=True)
+
+
+def test_combine_records():
+    """Test records are combined as their datasets would be"""
+    records = [FeatureRecord(lat, lon, names, [lat, lon]) for lat, lon in [(3.5, 1.0), (-2.0, 1.0), (3.5, 0.0)]]
+    records.append(FeatureRecord(0.0, 0.0, names[:1] + ['pop.population.max'], [5.0, 6.0]))
+    combined = utils.combine_data(records)
+    xr.testing.assert_identical(combined, utils.combine_data([record.to_dataset() for record in records]))
+    assert list(combined.data_vars) == names + ['pop.population.max']
+    assert combined['pop.population.mean'].sel(lat=-2.0, lon=1.0) == 1.0
+    assert np.isnan(combined['pop.population.max'].sel(lat=3.5, lon=1.0))
@@ -71,3 +71,39 @@ class TestGenerateConfig():
                                          self.save_dir)
         with pytest.raises(ValueError):
             generate_config.get_gee_collection_data()
+
+
+    def test_check_end_date(self):
+        """Test function that checks end date of time series runs"""
+        nightlight = {"name": "nightlight", "min_date": "2012-04-01", "max_date": "2024-02-01",
+                      "features": {"image": "collection"}}
+        for end_date in ['2012-01-01', '2025-01-01']:
+            generate_config = GenerateConfig('nightlight', self.region, '2013-01-01', self.analysis_type,
+                                             self.add_time, self.buffer_size, self.configs_dir,
+                                             self.save_dir, end_date=end_date)
+            with pytest.raises(ValueError):
+                generate_config.check_end_date(nightlight)
+
+        generate_config = GenerateConfig('nightlight', self.region, '2013-01-01', self.analysis_type,
+                                         self.add_time, self.buffer_size, self.configs_dir,
+                                         self.save_dir, end_date='2022-12-01')
+        assert generate_config.check_end_date(nightlight) == '2022-12-01'
+        with pytest.raises(ValueError):
+            generate_config.check_end_date(dict(nightlight, features={"image": "first"}))
+
+    def test_check_buffer_sizes(self):
+        """Test function that checks buffer sizes of multi-buffer runs"""
+        generate_config = GenerateConfig('fire', self.region, '2019-01-01', self.analysis_type,
+                                         self.add_time, '55500', self.configs_dir, self.save_dir,
+                                         buffer_sizes=['55500', '5000', '25000', '5000'])
+        assert generate_config.check_buffer_sizes() == ['5000', '25000', '55500']
+
+        generate_config.buffer_size = '25000'
+        with pytest.raises(ValueError):
+            generate_config.check_buffer_sizes()
+
+        generate_config = GenerateConfig('fire', self.region, '2019-01-01', 'images',
+                                         self.add_time, '55500', self.configs_dir, self.save_dir,
+                                         buffer_sizes=['5000', '55500'])
+        with pytest.raises(ValueError):
+            generate_config.check_buffer_sizes()
@@ -0,0 +1,69 @@
+"""
+Test functions in image_store
+"""
+from image_store import ImageStore
+import numpy as np
+import pytest
+
+points = [{'coordinates': [lon, 10.0]} for lon in range(5)]
+
+
+def get_result(index):
+    # Arrays of points differ in shape, as sampleRectangle arrays do
+    return {'lat': 10.0, 'lon': float(index), 'data_array': np.arange((index + 2) * 3).reshape(index + 2, 3)}
+
+
+def test_append_get(tmp_path):
+    """Test arrays of any shape saved in completion order are read back by point"""
+    path = str(tmp_path / 'images.h5')
+    image_store = ImageStore(path, points, {'band': 'LandCover'}, chunk_pixels=8, sync_every=2)
+    assert image_store.open() == set()
+    for index in [4, 1, 0, 3, 2]:
+        image_store.append(index, get_result(index))
+    image_store.close()
+    image_store.check_complete()
+
+    image_store = ImageStore(path)
+    for index in range(len(points)):
+        assert np.array_equal(image_store.get_image(index), get_result(index)['data_array'])
+    assert image_store.get_index(10.0, 3) == 3
+    assert image_store.get_index(11.0, 3) is None
+    assert image_store.file.attrs['band'] == 'LandCover'
+    image_store.close()
+
+
+def test_mixed_dtypes(tmp_path):
+    """Test float arrays are not cast to the integer dtype of the first array saved"""
+    path = str(tmp_path / 'images.h5')
+    image_store = ImageStore(path, points[:2])
+    image_store.open()
+    image_store.append(0, get_result(0))
+    image_store.append(1, {'lat': 10.0, 'lon': 1.0, 'data_array': np.full((2, 2), 0.25)})
+    image_store.close()
+
+    image_store = ImageStore(path)
+    assert np.array_equal(image_store.get_image(0), get_result(0)['data_array'])
+    assert np.array_equal(image_store.get_image(1), np.full((2, 2), 0.25))
+    image_store.close()
+
+
+def test_resume(tmp_path):
+    """Test arrays saved before an interruption are kept on resume"""
+    path = str(tmp_path / 'images.h5')
+    image_store = ImageStore(path, points)
+    image_store.open()
+    image_store.append(3, get_result(3))
+    image_store.close()
+
+    image_store = ImageStore(path, points)
+    assert image_store.open(resume=True) == {3}
+    with pytest.raises(ValueError):
+        image_store.check_complete()
+    for index in [0, 1, 2, 4]:
+        image_store.append(index, get_result(index))
+    image_store.close()
+    image_store.check_complete()
+    assert np.array_equal(ImageStore(path).get_image(3), get_result(3)['data_array'])
+
+    with pytest.raises(ValueError):
+        ImageStore(path, points[:2]).open(resume=True)
@@ -0,0 +1,54 @@
+"""
+Test functions in io_engine
+"""
+from io_engine import IOEngine, get_mp_context
+import time
+
+points = [{'coordinates': [lon, 10.0]} for lon in range(20)]
+
+
+def fetch_points(batch):
+    # Stand-in for GEE requests, returns keyword arguments for compute_point
+    time.sleep(0.01)
+    return [{'value': p['coordinates'][0] * 2} for p in batch]
+
+
+def compute_point(index, point, value):
+    return index, point['coordinates'][0], value
+
+
+def test_map_io():
+    """Test function to run requests concurrently in threads"""
+    io_engine = IOEngine(io_workers=8, cpu_workers=0)
+    assert io_engine.map_io(lambda a, b: a + b, [(1, 2), (3, 4)]) == [3, 7]
+
+
+def test_run():
+    """Test results are ordered as points, calculated in the main process"""
+    io_engine = IOEngine(io_workers=4, cpu_workers=0)
+    results = io_engine.run(points, fetch_points, compute_point, batch_size=3)
+    assert results == [(i, i, i * 2) for i in range(20)]
+
+
+def test_run_process_pool():
+    """Test results are ordered as points, calculated in a process pool"""
+    io_engine = IOEngine(io_workers=4, cpu_workers=2)
+    results = io_engine.run(points, fetch_points, compute_point)
+    assert results == [(i, i, i * 2) for i in range(20)]
+
+
+def test_get_mp_context():
+    """Test CPU processes are never forked from the process running the I/O threads"""
+    assert get_mp_context().get_start_method() in ['forkserver', 'spawn']
+
+
+def test_run_streamed():
+    """Test results are streamed to on_result in completion order and not held by the engine"""
+    io_engine = IOEngine(io_workers=4, cpu_workers=0)
+    streamed = {}
+
+    def on_result(i, result):
+        streamed[i] = result
+
+    assert io_engine.run(points, fetch_points, compute_point, batch_size=3, on_result=on_result) is None
+    assert streamed == {i: (i, i, i * 2) for i in range(20)}
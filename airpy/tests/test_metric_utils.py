@@ -30,6 +30,8 @@ true_fire_pct_cov = {
 }
 
 metric_utils = mu.MetricUtils(test_array)
+# Histogram of test_array as reduced server-side by GEE
+hist_metric_utils = mu.MetricUtils(histogram={3: 3, 5: 1, 160: 2})
 
 def test_get_mode():
     """Test function to calculate mode of array"""
@@ -49,10 +51,62 @@ def test_calc_burnt_pct():
     assert metric_utils.calc_burnt_pct() == true_burnt
 
 
-
-
-
-
-
-
-
+def test_histogram_metrics():
+    """Test metrics calculated from a histogram match those calculated from the array"""
+    assert hist_metric_utils.get_mode() == metric_utils.get_mode()
+    assert np.isclose(hist_metric_utils.get_var(), metric_utils.get_var())
+    assert hist_metric_utils.get_perc_cov('modis') == true_modis_pct_cov
+    assert hist_metric_utils.get_perc_cov('fire') == true_fire_pct_cov
+    assert hist_metric_utils.calc_burnt_pct() == metric_utils.calc_burnt_pct()
+
+
+def test_histogram_nonzero_metrics():
+    """Test nonzero metrics calculated from a histogram match those calculated from the array"""
+    ghsl_array = np.array([[0, 0, 11], [11, 2, 21]])
+    ghsl_metric_utils = mu.MetricUtils(ghsl_array)
+    ghsl_hist_metric_utils = mu.MetricUtils(histogram={0: 2, 2: 1, 11: 2, 21: 1})
+    assert ghsl_hist_metric_utils.get_nonzero_mode() == ghsl_metric_utils.get_nonzero_mode()
+    assert np.isclose(ghsl_hist_metric_utils.get_nonzero_var(), ghsl_metric_utils.get_nonzero_var())
+    assert ghsl_hist_metric_utils.calc_built_pct() == ghsl_metric_utils.calc_built_pct()
+    assert ghsl_hist_metric_utils.get_perc_cov('human_settlement_layer_built_up') == \
+           ghsl_metric_utils.get_perc_cov('human_settlement_layer_built_up')
+
+
+def test_stats_metrics():
+    """Test metrics read from statistics reduced server-side by GEE"""
+    stats = {'mean': 55.66, 'min': 3, 'max': 160, 'variance': 5474.2, 'mode': 3}
+    stats_metric_utils = mu.MetricUtils(stats=stats)
+    assert stats_metric_utils.get_mean() == stats['mean']
+    assert stats_metric_utils.get_min() == stats['min']
+    assert stats_metric_utils.get_max() == stats['max']
+    assert stats_metric_utils.get_var() == stats['variance']
+    assert stats_metric_utils.get_mode() == stats['mode']
+
+
+def test_class_coverage():
+    """Test class coverage counted in one pass matches counting per class"""
+    class_coverage = mu.get_class_coverage('fire')
+    counts = class_coverage.count(test_array)
+    assert counts[3] == 3 and counts[160] == 2
+    assert class_coverage.get_total(counts) == 6
+    mode, ambiguous = class_coverage.get_mode(counts)
+    assert mode == 3 and not ambiguous
+    # Resampled values that are not a class only count to the total
+    resampled = np.array([[3.5, np.nan, 160], [160, 160, 3]])
+    pct_cov = mu.MetricUtils(resampled).get_perc_cov('fire')
+    assert pct_cov[160]['pct_cov'] == 0.5
+    assert class_coverage.count(resampled)[class_coverage.other] == 2
+
+
+def test_class_coverage_batch():
+    """Test a stacked batch of arrays is counted as each array individually"""
+    class_coverage = mu.get_class_coverage('human_settlement_layer_built_up')
+    batch = np.stack([np.array([[0, 0, 11], [11, 2, 21]]), np.array([[0, 0, 0], [0, 0, 0]])])
+    counts = class_coverage.count(batch)
+    assert np.array_equal(counts[0], class_coverage.count(batch[0]))
+    mode, _ = class_coverage.get_mode(counts, nonzero=True)
+    assert mode.tolist() == [11, 0]
+    pct_cov = class_coverage.get_pct_cov(counts, nonzero=True)
+    assert pct_cov.shape == (2, len(class_coverage.classes))
+    assert pct_cov[0, list(class_coverage.classes).index(11)] == 0.5
+    assert not pct_cov[1].any()
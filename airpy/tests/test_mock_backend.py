@@ -0,0 +1,132 @@
+"""
+Test functions in mock_backend
+"""
+from mock_backend import MockEE, patch_ee
+from processor_modules import ProcessorModules
+from batch_fetcher import BatchFetcher
+from raster_backend import EEBackend
+from rate_governor import RateGovernor
+from utils import Utils
+from gee_class_constants import FIRE_LC
+import numpy as np
+import pytest
+
+
+class TestMockEE():
+    def setup_method(self):
+        self.point = {'coordinates': [-118.125, 34.205], 'buffer': 5000}
+        self.processor_modules = ProcessorModules(self.point, 'ESA/CCI/FireCCI/5_1', 'LandCover', 'yearly', 'jan',
+                                                  2019, 'fire', '250', 5000, Utils())
+
+    def test_fetch_arrays(self):
+        """Test batched and single point requests sample the same synthetic pixels"""
+        points = [self.point, {'coordinates': [-117.0, 34.205], 'buffer': 5000}]
+        with patch_ee(MockEE(latency=0)) as mock_ee:
+            arrays = BatchFetcher(self.processor_modules).fetch_arrays(points)
+            assert mock_ee.get_stats()['requests'] == 1
+            assert np.array_equal(arrays[0], EEBackend(self.processor_modules).fetch_arrays([self.point])[0])
+        assert arrays[0].shape[0] == 41
+        assert set(np.unique(arrays[0])) <= set(FIRE_LC)
+        assert not np.array_equal(arrays[0], arrays[1])
+
+    def test_errors(self):
+        """Test GEE errors are raised and retried by the rate governor"""
+        with patch_ee(MockEE(latency=0, throttle_rate=1.0)):
+            with pytest.raises(Exception, match='429'):
+                BatchFetcher(self.processor_modules).fetch_arrays([self.point])
+            # Only pixel limit errors are handled by shrinking the buffer
+            with pytest.raises(Exception, match='429'):
+                EEBackend(self.processor_modules).fetch_arrays([self.point])
+
+        with patch_ee(MockEE(latency=0, throttle_rate=0.5, seed=1)) as mock_ee:
+            governor = RateGovernor(rate=1000.0, max_rate=1000.0)
+            governor.backoff = 0.0
+            band_arr = governor.call(EEBackend(self.processor_modules).fetch_arrays, [self.point], delay=0)[0]
+            assert band_arr.shape[0] == 41
+            assert governor.get_status()['throttled'] == mock_ee.get_stats()['throttled']
+
+    def test_pixel_error(self):
+        """Test too many pixels errors shrink the buffer and unbatch batches"""
+        lon, lat = self.point['coordinates']
+        with patch_ee(MockEE(latency=0, pixel_error_rate=1.0)):
+            with pytest.raises(Exception, match='Image.sampleRectangle'):
+                EEBackend(self.processor_modules).fetch_arrays([self.point])
+
+        with patch_ee(MockEE(latency=0)) as mock_ee:
+            # Buffer over the pixel limit of the image at 250m, only the 40% buffer is sampled
+            img = self.processor_modules.prepare_image()
+            self.processor_modules.buffer_size = 90000
+            band_arr = self.processor_modules.sample_band_array(lat, lon, img)
+            assert mock_ee.get_stats()['pixel_errors'] == 1
+            sq_extent = Utils().get_buffer_extent(lat, lon, 36000, 160, img)
+            assert np.array_equal(band_arr, np.array(sq_extent.get('LandCover').getInfo()))
+
+        # The first request, the batch, fails as a whole and every point is sampled individually
+        points = [self.point, {'coordinates': [-117.0, 34.205], 'buffer': 5000}]
+        self.processor_modules.buffer_size = 5000
+        with patch_ee(MockEE(latency=0, pixel_error_rate=0.5, seed=7)) as mock_ee:
+            arrays = BatchFetcher(self.processor_modules).fetch_arrays(points)
+            assert mock_ee.get_stats() == {'requests': 3, 'errors': 0, 'throttled': 0, 'pixel_errors': 1}
+        with patch_ee(MockEE(latency=0, seed=7)):
+            assert all(np.array_equal(arr, EEBackend(self.processor_modules).fetch_arrays([point])[0])
+                       for arr, point in zip(arrays, points))
+
+    def test_time_series(self):
+        """Test time steps of time series runs are sampled in one request and featurized per step"""
+        point = dict(self.point, query_end='2021-06-01')
+        processor_modules = ProcessorModules(point, 'ESA/CCI/FireCCI/5_1', 'LandCover', 'yearly', 'jan', 2019,
+                                             'fire', '250', 5000, Utils())
+        with patch_ee(MockEE(latency=0)) as mock_ee:
+            band_arr = EEBackend(processor_modules).fetch_arrays([point])[0]
+            assert mock_ee.get_stats()['requests'] == 1
+        assert band_arr.shape[:2] == (3, 41)
+        assert not np.array_equal(band_arr[0], band_arr[1])
+
+        processor_modules.np_arr = band_arr
+        record = processor_modules.process_features()
+        assert record.names[0] == 'fire.LandCover.mode@2019'
+        assert len([name for name in record.names if name.endswith('@2020')]) == len(record) // 3
+        assert record.get('fire.LandCover.mode@2021') in FIRE_LC
+
+    def test_buffer_sizes(self):
+        """Test features of every buffer size are calculated from one fetch at the largest buffer"""
+        point = dict(self.point, buffer='20000', buffer_sizes=['5000', '20000'])
+        processor_modules = ProcessorModules(point, 'ESA/CCI/FireCCI/5_1', 'LandCover', 'yearly', 'jan', 2019,
+                                             'fire', '250', '20000', Utils())
+        with patch_ee(MockEE(latency=0)) as mock_ee:
+            band_arr = EEBackend(processor_modules).fetch_arrays([point])[0]
+            assert mock_ee.get_stats()['requests'] == 1
+            single_arr = EEBackend(self.processor_modules).fetch_arrays([self.point])[0]
+        assert band_arr.shape[0] == 161
+        # Window of the 5000m buffer matches the array of a 5000m run at the same scale
+        assert processor_modules.get_buffer_window(band_arr, '5000').shape[0] == single_arr.shape[0]
+        assert np.array_equal(processor_modules.get_buffer_window(band_arr, '20000'), band_arr)
+
+        processor_modules.np_arr = band_arr
+        record = processor_modules.process_features()
+        assert record.names[0] == 'fire.LandCover.mode@5000m'
+        assert len([name for name in record.names if name.endswith('@20000m')]) == len(record) // 2
+
+    def test_buffer_groups(self):
+        """Test buffer sizes sampled at a finer scale than the largest buffer are fetched again at that scale"""
+        point = dict(self.point, buffer='90000', buffer_sizes=['5000', '20000', '90000'])
+        processor_modules = ProcessorModules(point, 'ESA/CCI/FireCCI/5_1', 'LandCover', 'yearly', 'jan', 2019,
+                                             'fire', '250', '90000', Utils())
+        # 90000m is resampled to stay under the pixel limit, 5000m and 20000m are sampled at 250m
+        assert processor_modules.get_buffer_groups() == [('90000', ['90000']), ('20000', ['5000', '20000'])]
+
+        with patch_ee(MockEE(latency=0)):
+            band_arr = EEBackend(processor_modules).fetch_arrays([point])[0]
+            group_arr = EEBackend(processor_modules.get_buffer_modules('20000')).fetch_arrays([point])[0]
+            single_record = ProcessorModules(self.point, 'ESA/CCI/FireCCI/5_1', 'LandCover', 'yearly', 'jan', 2019,
+                                             'fire', '250', '5000', Utils()).process_features()
+            # Arrays of finer groups not fetched in advance are fetched by the point
+            fetched_record = processor_modules.process_features()
+        processor_modules.np_arr = band_arr
+        processor_modules.buffer_arrs = {'20000': group_arr}
+        record = processor_modules.process_features()
+
+        assert record.names == fetched_record.names
+        assert np.allclose(record.values, fetched_record.values)
+        for name in single_record.names:
+            assert record.get('{}@5000m'.format(name)) == single_record.get(name)
@@ -3,8 +3,8 @@ Test functions in processor_modules
 """
 from processor_modules import ProcessorModules
 from utils import Utils
-import xarray as xr
-import ee
+from feature_record import FeatureRecord
+from mock_backend import MockEE, patch_ee
 from functools import reduce
 from gee_class_constants import MODIS_LC_Type1, FIRE_LC, GHSL_Built_Class
 
@@ -18,7 +18,12 @@ class TestProcessorModules():
         self.buffer_size = 55500
         self.utils = Utils()
         self.dims = ['lat', 'lon']
-        ee.Initialize()
+        # GEE requests are made to the GEE stand-in so the tests run offline
+        self.patch_ee = patch_ee(MockEE(latency=0))
+        self.patch_ee.__enter__()
+
+    def teardown_method(self):
+        self.patch_ee.__exit__(None, None, None)
 
     def test_process_collection_for_img(self):
         """Test function for processing gee collection and saving as image"""
@@ -35,11 +40,11 @@ class TestProcessorModules():
     def test_process_modis(self):
         """
         Test function for processing modis land cover collection
-        Output of process_modis should be xarray dataset with
+        Output of process_modis should be FeatureRecord with
         20 variables and lat, lon dimensions
 
         """
-        # output of process fire should be xarray dataset with X variables and lat, lon dims
+        # output of process fire should be FeatureRecord with X variables and lat, lon dims
         band = 'LC_Type1'
         dataset_name = 'modis'
         collection = 'MODIS/006/MCD12Q1'
@@ -58,14 +63,14 @@ class TestProcessorModules():
         stats_vars.extend(class_vars)
         combined_vars = stats_vars
         true_ds_vars = reduce(lambda res, item: res + [prefix + item], combined_vars, [])
-        assert type(processor_modules.process_modis()) is xr.core.dataset.Dataset
-        assert sorted([i for i in processor_modules.process_modis().data_vars]) == sorted(true_ds_vars)
-        assert sorted([i for i in processor_modules.process_modis().coords]) == sorted(self.dims)
+        assert type(processor_modules.process_modis()) is FeatureRecord
+        assert sorted([i for i in processor_modules.process_modis().to_dataset().data_vars]) == sorted(true_ds_vars)
+        assert sorted([i for i in processor_modules.process_modis().to_dataset().coords]) == sorted(self.dims)
 
     def test_process_fire(self):
         """
         Test function for processing fire collection
-        Output of process_fire should be xarray dataset with
+        Output of process_fire should be FeatureRecord with
         18 variables and lat, lon dimensions
         """
         band = 'LandCover'
@@ -86,13 +91,13 @@ class TestProcessorModules():
         stats_vars.extend(class_vars)
         combined_vars = stats_vars
         true_ds_vars = reduce(lambda res, item: res + [prefix + item], combined_vars, [])
-        assert type(processor_modules.process_fire()) is xr.core.dataset.Dataset
-        assert sorted([i for i in processor_modules.process_fire().data_vars]) == sorted(true_ds_vars)
-        assert sorted([i for i in processor_modules.process_fire().coords]) == sorted(self.dims)
+        assert type(processor_modules.process_fire()) is FeatureRecord
+        assert sorted([i for i in processor_modules.process_fire().to_dataset().data_vars]) == sorted(true_ds_vars)
+        assert sorted([i for i in processor_modules.process_fire().to_dataset().coords]) == sorted(self.dims)
 
     def test_process_pop(self):
         """Test function for processing population collection
-        Output of process_pop should be xarray dataset with
+        Output of process_pop should be FeatureRecord with
         5 variables and lat, lon dimensions
         """
         band = 'population_density'
@@ -107,13 +112,13 @@ class TestProcessorModules():
         true_ds_vars = ['var', 'max', 'min', 'mean']
         true_ds_vars = reduce(lambda res, item: res + [prefix + item], true_ds_vars, [])
 
-        assert type(processor_modules.process_pop()) is xr.core.dataset.Dataset
-        assert sorted([i for i in processor_modules.process_pop().data_vars]) == sorted(true_ds_vars)
-        assert sorted([i for i in processor_modules.process_pop().coords]) == sorted(self.dims)
+        assert type(processor_modules.process_pop()) is FeatureRecord
+        assert sorted([i for i in processor_modules.process_pop().to_dataset().data_vars]) == sorted(true_ds_vars)
+        assert sorted([i for i in processor_modules.process_pop().to_dataset().coords]) == sorted(self.dims)
 
     def test_process_nightlight(self):
         """Test function for processing nightlight collection
-        Output of process_nightlight should be xarray dataset with
+        Output of process_nightlight should be FeatureRecord with
         5 variables and lat, lon dimensions
         """
         band = 'avg_rad'
@@ -128,15 +133,15 @@ class TestProcessorModules():
         true_ds_vars = ['var', 'mean', 'max', 'min']
         true_ds_vars = reduce(lambda res, item: res + [prefix + item], true_ds_vars, [])
 
-        assert type(processor_modules.process_nightlight()) is xr.core.dataset.Dataset
-        assert sorted([i for i in processor_modules.process_nightlight().data_vars]) == sorted(true_ds_vars)
-        assert sorted([i for i in processor_modules.process_nightlight().coords]) == sorted(self.dims)
+        assert type(processor_modules.process_nightlight()) is FeatureRecord
+        assert sorted([i for i in processor_modules.process_nightlight().to_dataset().data_vars]) == sorted(true_ds_vars)
+        assert sorted([i for i in processor_modules.process_nightlight().to_dataset().coords]) == sorted(self.dims)
 
     def test_process_human_settlement_built(self):
         """
         Test function for processing GHSL collection
-        Output of process_human_settlement_built should be xarray
-        dataset with 5 variables and lat, lon dimensions
+        Output of process_human_settlement_built should be
+        FeatureRecord with 5 variables and lat, lon dimensions
         """
         band = 'built_characteristics'
         dataset_name = 'human_settlement_layer_built_up'
@@ -157,15 +162,15 @@ class TestProcessorModules():
         stats_vars.extend(class_vars)
         combined_vars = stats_vars
         true_ds_vars = reduce(lambda res, item: res + [prefix + item], combined_vars, [])
-        assert type(processor_modules.process_human_settlement_built()) is xr.core.dataset.Dataset
-        assert sorted([i for i in processor_modules.process_human_settlement_built().data_vars]) == sorted(true_ds_vars)
-        assert sorted([i for i in processor_modules.process_human_settlement_built().coords]) == sorted(self.dims)
+        assert type(processor_modules.process_human_settlement_built()) is FeatureRecord
+        assert sorted([i for i in processor_modules.process_human_settlement_built().to_dataset().data_vars]) == sorted(true_ds_vars)
+        assert sorted([i for i in processor_modules.process_human_settlement_built().to_dataset().coords]) == sorted(self.dims)
 
     def test_process_global_human_modification(self):
         """
         Test function for processing gHM collection
-        Output of process_global_human_modification should be xarray
-        dataset with 5 variables and lat, lon dimensions
+        Output of process_global_human_modification should be
+        FeatureRecord with 5 variables and lat, lon dimensions
         """
         band = 'gHM'
         dataset_name = 'global_human_modification'
@@ -180,9 +185,19 @@ class TestProcessorModules():
         true_ds_vars = ['var', 'mean', 'max', 'min', 'mode']
         true_ds_vars = reduce(lambda res, item: res + [prefix + item], true_ds_vars, [])
 
-        assert type(processor_modules.process_global_human_modification()) is xr.core.dataset.Dataset
-        assert sorted([i for i in processor_modules.process_global_human_modification().data_vars]) == \
+        assert type(processor_modules.process_global_human_modification()) is FeatureRecord
+        assert sorted([i for i in processor_modules.process_global_human_modification().to_dataset().data_vars]) == \
                sorted(true_ds_vars)
-        assert sorted([i for i in processor_modules.process_global_human_modification().coords]) == \
+        assert sorted([i for i in processor_modules.process_global_human_modification().to_dataset().coords]) == \
                sorted(self.dims)
 
+    def test_prepare_image_shared(self):
+        """Test GEE image is built once and shared by all points of a run"""
+        collection = 'MODIS/006/MCD12Q1'
+        processor_modules = ProcessorModules(self.point, collection, 'LC_Type1', 'yearly', self.month, self.year,
+                                             'modis', '500', self.buffer_size, self.utils)
+        other_point = ProcessorModules({'coordinates': [30.125, -1.945]}, collection, 'LC_Type1', 'yearly',
+                                       self.month, self.year, 'modis', '500', self.buffer_size, self.utils)
+        assert processor_modules.prepare_image() is other_point.prepare_image()
+        # Reduction pixel limit resamples differently, so is prepared separately
+        assert processor_modules.prepare_image(4194304) is not processor_modules.prepare_image()
@@ -0,0 +1,31 @@
+"""
+Test functions in progress
+"""
+from progress import Progress
+import io
+
+
+def test_progress():
+    """Test progress lines of points done, rate and ETA"""
+    stream = io.StringIO()
+    progress = Progress(10, done=2, interval=0, stream=stream)
+    assert progress.get_eta() is None
+    progress.samples[0] = (progress.samples[0][0] - 4, 2)
+    progress.update(4)
+    # 4 points in 4 seconds, 4 points left
+    assert abs(progress.get_rate() - 1.0) < 0.01
+    assert abs(progress.get_eta() - 4.0) < 0.1
+    assert stream.getvalue().splitlines()[-1].startswith('Extracted 6/10 points (60.0%)')
+    progress.finish()
+    assert stream.getvalue().splitlines()[-1].startswith('Extracted 6/10 points in')
+
+
+def test_progress_interval():
+    """Test progress is printed at most once per interval, and when all points are done"""
+    stream = io.StringIO()
+    progress = Progress(3, interval=60, stream=stream)
+    for i in range(3):
+        progress.update()
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 2
+    assert lines[-1].startswith('Extracted 3/3 points (100.0%)')
@@ -0,0 +1,62 @@
+"""
+Test functions in raster_backend
+"""
+from raster_backend import RasterBackend, LocalRasterBackend
+from processor_modules import ProcessorModules
+from utils import Utils
+import numpy as np
+import xarray as xr
+import pytest
+
+
+class TestLocalRasterBackend():
+    def setup_method(self):
+        # 0.1 degree population grid, each pixel value encodes its row, col
+        self.lats = np.round(np.arange(49.95, 30, -0.1), 2)
+        self.lons = np.round(np.arange(-129.95, -110, 0.1), 2)
+        rows, cols = np.meshgrid(np.arange(len(self.lats)), np.arange(len(self.lons)), indexing='ij')
+        self.grid = (rows * 1000 + cols).astype(np.float64)
+        self.processor_modules = ProcessorModules({'coordinates': [-118.125, 34.205]},
+                                                  'CIESIN/GPWv411/GPW_Population_Density', 'population_density',
+                                                  'yearly', 'jan', 2020, 'pop', '11132', 55500, Utils())
+
+    def make_netcdf(self, tmp_path, grid):
+        raster_path = str(tmp_path / 'pop.nc')
+        data = xr.DataArray(grid[np.newaxis], dims=['time', 'lat', 'lon'],
+                            coords={'time': np.array(['2020-01-01'], dtype='datetime64[ns]'),
+                                    'lat': self.lats, 'lon': self.lons})
+        data.to_dataset(name='population_density').to_netcdf(raster_path)
+        return raster_path
+
+    def test_get_band_array(self, tmp_path):
+        """Test function to read buffer extent of point from local NetCDF raster"""
+        raster_backend = LocalRasterBackend(self.processor_modules, self.make_netcdf(tmp_path, self.grid))
+        row_start, row_end, col_start, col_end = raster_backend.get_window(34.205, -118.125, 55500)
+        band_arr = raster_backend.get_band_array(34.205, -118.125, 55500)
+        assert band_arr.shape == (row_end - row_start, col_end - col_start)
+        assert np.array_equal(band_arr, self.grid[row_start:row_end, col_start:col_end])
+        # Pixel centres within 0.5 degrees of the point
+        assert np.all(np.abs(self.lats[row_start:row_end] - 34.205) <= 55500 / 111320)
+        raster_backend.close()
+
+    def test_fetch_arrays(self, tmp_path):
+        """Test masked pixels and points outside the raster are set to the default value"""
+        grid = self.grid.copy()
+        grid[:, :] = np.nan
+        raster_backend = LocalRasterBackend(self.processor_modules, self.make_netcdf(tmp_path, grid))
+        points = [{'coordinates': [-118.125, 34.205], 'buffer': 55500},
+                  {'coordinates': [10.0, 10.0], 'buffer': 55500}]
+        arrays = raster_backend.fetch_arrays(points)
+        assert np.all(arrays[0] == 0)
+        assert np.array_equal(arrays[1], np.zeros((2, 2)))
+        raster_backend.close()
+
+    def test_unsupported_raster(self, tmp_path):
+        """Test unsupported raster files raise an error"""
+        with pytest.raises(ValueError):
+            LocalRasterBackend(self.processor_modules, str(tmp_path / 'pop.csv'))
+
+    def test_abstract_backend(self):
+        """Test backends must implement get_band_array"""
+        with pytest.raises(TypeError):
+            RasterBackend(self.processor_modules)
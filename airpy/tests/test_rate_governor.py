@@ -0,0 +1,105 @@
+"""
+Test functions in rate_governor
+"""
+from rate_governor import RateGovernor
+from io_engine import IOEngine
+import pytest
+import time
+
+
+class FlakyRequest:
+    """Stand-in for a GEE request throttled a number of times before succeeding"""
+    def __init__(self, failures, message='429 Too Many Requests'):
+        self.failures = failures
+        self.message = message
+        self.calls = 0
+
+    def __call__(self, value):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise Exception(self.message)
+        return value
+
+
+def test_throttle_decrease():
+    """Test rate and concurrency are halved when throttled"""
+    governor = RateGovernor(rate=8.0, max_concurrency=16)
+    governor.acquire()
+    governor.release(0.1, throttled=True)
+    assert governor.rate == 4.0
+    assert governor.concurrency == 2.0
+    assert governor.get_status()['throttled'] == 1
+
+
+def test_success_increase():
+    """Test rate and concurrency increase additively on success, up to their limits"""
+    governor = RateGovernor(rate=1000.0, max_rate=1000.05, max_concurrency=4, rate_increase=1.0)
+    for _ in range(100):
+        governor.acquire()
+        governor.release(0.1)
+    assert governor.rate == 1000.05
+    assert governor.concurrency == 4.0
+    assert governor.get_status()['in_flight'] == 0
+
+
+def test_latency_decrease():
+    """Test concurrency is reduced when latency grows well above the fastest seen"""
+    governor = RateGovernor(rate=1000.0, max_concurrency=64)
+    for latency in [0.1] * 10 + [5.0] * 10:
+        governor.acquire()
+        governor.release(latency)
+    assert governor.concurrency < 16
+
+
+def test_latency_window():
+    """Test fastest latency is only taken over the latency window, so one fast request does not reduce concurrency"""
+    governor = RateGovernor(rate=1000.0, max_concurrency=64, latency_window=0.05)
+    governor.acquire()
+    governor.release(0.001)
+    time.sleep(0.1)
+    for _ in range(20):
+        governor.acquire()
+        governor.release(0.1)
+    assert governor.min_latency == 0.1
+    assert governor.concurrency >= 16
+
+
+def test_completed_pruned():
+    """Test finish times of completed requests are pruned as requests are released"""
+    governor = RateGovernor(rate=1000.0)
+    governor.completed.extend([time.monotonic() - 100] * 1000)
+    governor.acquire()
+    governor.release(0.1)
+    assert len(governor.completed) == 1
+
+
+def test_is_throttled():
+    governor = RateGovernor()
+    assert governor.is_throttled(Exception('Too many concurrent aggregations.'))
+    assert not governor.is_throttled(Exception('Image.sampleRectangle: Too many pixels in sample'))
+
+
+def test_call_retry():
+    """Test throttled requests are retried after the shared pause"""
+    governor = RateGovernor(rate=1000.0)
+    governor.backoff = 0.01
+    request = FlakyRequest(2)
+    assert governor.call(request, 5) == 5
+    assert request.calls == 3
+    assert governor.get_status()['retries'] == 2
+
+
+def test_call_raise():
+    """Test error is raised once retries are exhausted"""
+    governor = RateGovernor(rate=1000.0)
+    request = FlakyRequest(5, message='Internal error')
+    with pytest.raises(Exception, match='Internal error'):
+        governor.call(request, 5, tries=2, delay=0.01)
+
+
+def test_io_engine_governed():
+    """Test all I/O threads share one governor"""
+    governor = RateGovernor(rate=1000.0, max_concurrency=8)
+    io_engine = IOEngine(io_workers=8, cpu_workers=0, governor=governor)
+    assert io_engine.map_io(lambda a: a * 2, [(i,) for i in range(20)]) == [i * 2 for i in range(20)]
+    assert governor.get_rate() > 0
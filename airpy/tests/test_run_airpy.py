@@ -2,16 +2,16 @@
 Test run_airpy pipeline
 """
 from run_airpy import *
-import xarray as xr
+from feature_record import FeatureRecord
+from mock_backend import MockEE, patch_ee
 import json
+import pytest
 
 config_file = 'test_config.json'
 
 with open('../airpy/tests/{}'.format(config_file), 'r') as file:
     config_data = json.load(file)
 
-ee.Initialize()
-
 def test_getRequests():
     """Test function for generating list of points to query from GEE"""
     assert type(getRequests(config_data)) is list
@@ -20,5 +20,46 @@ def test_getRequests():
 def test_getResult():
     """Test function to calculate GEE results"""
     items = getRequests(config_data)
-    assert type(getResult(0, items[0])) is xr.core.dataset.Dataset
-    assert len(getResult(0, items[0])) > 0
\ No newline at end of file
+    with patch_ee(MockEE(latency=0)):
+        assert type(getResult(0, items[0])) is FeatureRecord
+        assert len(getResult(0, items[0])) > 0
+
+
+def test_fetchGovernedPoints():
+    """Test only points requested from GEE are fetched through the rate governor"""
+    items = getRequests(config_data)
+    # Points in the Indian Ocean, which fire skips
+    skipped = [dict(items[0], coordinates=[80.0, -20.0]), dict(items[1], coordinates=[90.0, -30.0])]
+    requested = dict(items[0], coordinates=[-118.125, 34.205])
+    governor = RateGovernor(rate=1000.0)
+    io_engine = IOEngine(io_workers=2, cpu_workers=0, governor=governor)
+    with patch_ee(MockEE(latency=0)) as mock_ee:
+        fetched = fetchGovernedPoints(skipped, 'array', io_engine)
+        assert governor.min_latency is None and len(governor.completed) == 0
+        assert all((point_data['np_arr'] == 160).all() for point_data in fetched)
+
+        fetched = fetchGovernedPoints(skipped + [requested], 'array', io_engine)
+        assert len(governor.completed) == 1
+        assert mock_ee.get_stats()['requests'] == 1
+        assert fetched[2]['np_arr'].shape[0] > 2
+
+def test_getBufferGroupsFetch():
+    """Test finer scale buffer sizes of multi-buffer runs are fetched again, once per group"""
+    items = [dict(item, buffer='90000', buffer_sizes=['5000', '20000', '90000']) for item in getRequests(config_data)]
+    fetched_buffers = []
+
+    def fetch_fn(chunk):
+        fetched_buffers.append(chunk[0]['buffer'])
+        return [{'np_arr': point['buffer']} for point in chunk]
+
+    fetched = getBufferGroupsFetch(items, fetch_fn)(items[:2])
+    assert fetched_buffers == ['90000', '20000']
+    assert fetched[1] == {'np_arr': '90000', 'buffer_arrs': {'20000': '20000'}}
+    assert getBufferGroupsFetch(getRequests(config_data), fetch_fn) is fetch_fn
+
+
+def test_buffer_size_required():
+    """Test runs without a buffer size are rejected"""
+    with pytest.raises(SystemExit):
+        parser.parse_args(['--gee_data', 'fire', '--region', 'mini_test', '--date', '2019-01-01',
+                           '--analysis_type', 'collection', '--configs_dir', 'configs', '--save_dir', 'runs'])
@@ -0,0 +1,60 @@
+"""
+Test functions in run_report
+"""
+from run_report import RunReport, count_event, get_percentiles
+from io_engine import IOEngine
+import numpy as np
+import pytest
+import json
+
+
+def fetch_points(batch):
+    # Stand-in for GEE requests, returns a 10x10 float64 array per point
+    return [{'np_arr': np.zeros((10, 10))} for p in batch]
+
+
+def compute_point(index, point, np_arr):
+    return index
+
+
+def test_run_report(tmp_path):
+    """Test request latency, bytes fetched and feature calculation are recorded by the IOEngine"""
+    run_report = RunReport()
+    io_engine = IOEngine(io_workers=4, cpu_workers=0, run_report=run_report)
+    points = [{'coordinates': [lon, 10.0]} for lon in range(10)]
+    with run_report.stage('extraction'):
+        assert io_engine.run(points, fetch_points, compute_point, batch_size=2) == list(range(10))
+    count_event('shrunk_buffers')
+
+    report = run_report.save(str(tmp_path / 'reports' / 'run_report.json'))
+    assert report['requests']['latency']['count'] == 5
+    assert report['requests']['bytes_fetched'] == 10 * 800
+    assert report['compute']['count'] == 10
+    assert report['points'] == 10
+    assert report['stages']['extraction'] > 0
+    assert report['events'] == {'shrunk_buffers': 1}
+    with open(str(tmp_path / 'reports' / 'run_report.json'), 'r') as file:
+        assert json.load(file)['points'] == 10
+
+
+def test_timed_fetch_error():
+    """Test failed requests are recorded and raised"""
+    run_report = RunReport()
+
+    def fail():
+        raise Exception('429 Too Many Requests')
+
+    with pytest.raises(Exception):
+        run_report.timed_fetch(fail)()
+    report = run_report.get_report()
+    assert report['requests']['errors'] == 1
+    assert report['requests']['latency']['count'] == 1
+
+
+def test_get_percentiles():
+    """Test summary of timings"""
+    summary = get_percentiles(list(np.arange(1, 101) / 100))
+    assert summary['count'] == 100
+    assert summary['p50'] == pytest.approx(0.505)
+    assert summary['p99'] == pytest.approx(0.9901)
+    assert get_percentiles([]) == {'count': 0}
@@ -0,0 +1,53 @@
+"""
+Test functions in tile_mosaic
+"""
+from tile_mosaic import TileMosaic
+from processor_modules import ProcessorModules
+from utils import Utils
+import numpy as np
+
+
+class TestTileMosaic():
+    def setup_method(self):
+        # coarse 50km grid with small tiles, tiles are written to the cache so no GEE requests are made
+        self.point = {'coordinates': [-118.125, 34.205], 'buffer': 200000}
+        self.processor_modules = ProcessorModules(self.point, 'MODIS/006/MCD12Q1', 'LC_Type1', 'yearly', 'jan',
+                                                  2015, 'modis', '50000', 200000, Utils())
+
+    def make_mosaic(self, cache_dir):
+        tile_mosaic = TileMosaic(self.processor_modules, str(cache_dir), tile_size=16)
+        # Global grid where each pixel value encodes its row, col
+        rows, cols = np.meshgrid(np.arange(tile_mosaic.n_rows), np.arange(tile_mosaic.n_cols), indexing='ij')
+        self.grid = rows * 10000 + cols
+        for tile_row in range(int(np.ceil(tile_mosaic.n_rows / 16))):
+            for tile_col in range(int(np.ceil(tile_mosaic.n_cols / 16))):
+                np.save(tile_mosaic.get_tile_path(tile_row, tile_col),
+                        self.grid[tile_row * 16:(tile_row + 1) * 16, tile_col * 16:(tile_col + 1) * 16])
+        return tile_mosaic
+
+    def test_get_band_array(self, tmp_path):
+        """Test function to cut buffer extent out of cached tiles"""
+        tile_mosaic = self.make_mosaic(tmp_path)
+        row_start, row_end, col_start, col_end = tile_mosaic.get_window(34.205, -118.125, 200000)
+        band_arr = tile_mosaic.get_band_array(34.205, -118.125, 200000)
+        assert band_arr.shape == (row_end - row_start, col_end - col_start)
+        assert np.array_equal(band_arr, self.grid[row_start:row_end, col_start:col_end])
+
+    def test_get_band_array_antimeridian(self, tmp_path):
+        """Test function to cut buffer extent crossing the antimeridian out of cached tiles"""
+        tile_mosaic = self.make_mosaic(tmp_path)
+        row_start, row_end, col_start, col_end = tile_mosaic.get_window(10, 179.9, 200000)
+        cols = np.arange(col_start, col_end) % tile_mosaic.n_cols
+        band_arr = tile_mosaic.get_band_array(10, 179.9, 200000)
+        assert np.array_equal(band_arr, self.grid[row_start:row_end][:, cols])
+
+    def test_get_required_tiles(self, tmp_path):
+        """Test function to get tiles covering buffers of points"""
+        tile_mosaic = TileMosaic(self.processor_modules, str(tmp_path), tile_size=16)
+        points = [self.point, {'coordinates': [-117.0, 34.205], 'buffer': 200000}]
+        tiles = tile_mosaic.get_required_tiles(points)
+        tiles_1 = tile_mosaic.get_point_tiles(34.205, -118.125, 200000)
+        tiles_2 = tile_mosaic.get_point_tiles(34.205, -117.0, 200000)
+        assert set(tiles) == tiles_1 | tiles_2
+        # Neighbouring points share tiles
+        assert len(tiles) < len(tiles_1) + len(tiles_2)
@@ -3,12 +3,14 @@ Test functions in utils
 """
 
 from utils import Utils
+from feature_record import FeatureRecord
+from mock_backend import MockEE, patch_ee
 import json
-import ee
 import numpy as np
 import xarray as xr
 from datetime import datetime, timedelta
 import pandas as pd
+import pytest
 
 # Defining some constants
 config_file = 'test_config.json'
@@ -26,14 +28,17 @@ true_ds = xr.Dataset(
 
 true_df = true_ds.to_dataframe(dim_order=None)
 
-ee.Initialize()
 cadence = config_data['dataset']['t_cadence']
 month = config_data['query_month']
 year = config_data['query_year']
-collection = ee.ImageCollection(config_data['dataset']['collection']).\
-    filterDate('{}-01-01'.format(year, '{}-01-01'.format(year + 1)))
-# Select band type
-data = collection.select(config_data['dataset']['band'])
+
+
+def get_data(mock_ee):
+    """Get band of the test collection, from the GEE stand-in so the tests run offline"""
+    collection = mock_ee.ImageCollection(config_data['dataset']['collection']).\
+        filterDate('{}-01-01'.format(year), '{}-01-01'.format(year + 1))
+    # Select band type
+    return collection.select(config_data['dataset']['band'])
 
 
 def test_add_time_data():
@@ -49,32 +54,45 @@ def test_add_time_data():
     assert utils.add_time_data(true_ds) == true_ds_with_time
 
 
+def test_add_time_bounds():
+    """Test features are saved once with time bounds and expand to the daily time axis"""
+    ds_with_bounds = utils.add_time_data(true_ds, 'bounds')
+    assert ds_with_bounds.sizes['time'] == 1
+    assert list(ds_with_bounds['time_bnds'].values[0]) == [pd.Timestamp(2020, 1, 1), pd.Timestamp(2021, 1, 1)]
+    xr.testing.assert_identical(utils.expand_time_data(ds_with_bounds), utils.add_time_data(true_ds))
+
+    monthly_utils = Utils(dict(config_data, dataset=dict(config_data['dataset'], t_cadence='monthly'),
+                               query_month='feb'))
+    ds_with_time = monthly_utils.add_time_data(true_ds)
+    assert ds_with_time.sizes['time'] == 29
+    assert ds_with_time['time'].values[0] == np.datetime64('2020-02-01')
+
+
 def test_get_img_from_collect():
     """Test function to grab image from GEE collection"""
-    ee.Initialize()
-    assert utils.get_img_from_collect(data, cadence, month, year)
+    with patch_ee(MockEE(latency=0)) as mock_ee:
+        assert utils.get_img_from_collect(get_data(mock_ee), cadence, month, year)
 
 
 def test_get_buffer_extent():
     """Test function to get buffer extent from lat, lon point"""
-    ee.Initialize()
     buffer = 500
     lat = 34
     lon = -118
     default_class = 17
-    gee_img = utils.get_img_from_collect(data, cadence, month, year)
-    assert utils.get_buffer_extent(lat, lon, buffer, default_class, gee_img)
+    with patch_ee(MockEE(latency=0)) as mock_ee:
+        gee_img = utils.get_img_from_collect(get_data(mock_ee), cadence, month, year)
+        sq_extent = utils.get_buffer_extent(lat, lon, buffer, default_class, gee_img)
+        assert np.array(sq_extent.get(config_data['dataset']['band']).getInfo()).shape[0] == 5
 
 
 def test_get_allowable_buffer_size():
     """Test function to get allowable buffer size from GEE max pixel limit"""
-    ee.Initialize()
     resolution = 500
     assert utils.get_allowable_buffer_size(resolution)
 
 
 def test_get_resampled_resolution():
-    ee.Initialize()
     buffer_size = 40000
     assert utils.get_resampled_resolution_size(buffer_size)
 
@@ -99,6 +117,22 @@ def test_combine_data():
     assert type(utils.combine_data(results)) is xr.core.dataset.Dataset
 
 
+def test_combine_data_grid():
+    """Test function to combine point xarrays onto lat, lon grid"""
+    results = []
+    for lat, lon in [(3.5, 1.0), (-2.0, 1.0), (3.5, 0.0)]:
+        point_xr = utils.make_dataset(lat + lon, 'test.mean', lat, lon)
+        results.append(point_xr.merge(utils.make_dataset([lat * lon], 'test.pct', lat, lon)))
+    # Matches merging the points one at a time
+    merged = results[0].expand_dims(dim={'lat': 1, 'lon': 1})
+    for result in results[1:]:
+        merged = merged.merge(result.expand_dims(dim={'lat': 1, 'lon': 1}))
+    combined = utils.combine_data(results)
+    xr.testing.assert_identical(combined, merged)
+    assert list(combined.data_vars) == ['test.mean', 'test.pct']
+    assert np.isnan(combined['test.mean'].sel(lat=-2.0, lon=0.0))
+
+
 def test_save_collection():
     """
     Test function to save GEE collection results
@@ -156,3 +190,91 @@ def test_check_water_bodies():
 
 
 
+
+
+def test_assemble_features():
+    """Test features are assembled from chunks of records in any order, matching combine_records"""
+    records = [FeatureRecord(lat, lon, ['test.mean', 'test.max'], [lat + lon, lat * lon])
+               for lat, lon in [(3.5, 1.0), (-2.0, 1.0), (3.5, 0.0)]]
+    chunks = [[(2, records[2])], [(0, records[0]), (1, records[1])]]
+    names, lats, lons, values = utils.assemble_features(chunks, 3)
+    assert names == ['test.mean', 'test.max']
+    assert list(lats) == [3.5, -2.0, 3.5]
+    assert np.array_equal(values[:, 0], [4.5, -1.0, 3.5])
+    xr.testing.assert_identical(utils.combine_features(names, lats, lons, values), utils.combine_data(records))
+
+
+def test_save_zarr(tmp_path):
+    """Test features are saved chunked to zarr and later years are appended along time to the region group"""
+    pytest.importorskip('zarr')
+    zarr_utils = Utils(dict(config_data, save_dir=str(tmp_path)))
+    store = zarr_utils.save_zarr(true_ds, chunk_size=1)
+    saved = xr.open_zarr(store)
+    assert saved['test'].encoding['chunks'] == (1, 1)
+    xr.testing.assert_equal(saved.load(), true_ds)
+
+    shared_store = str(tmp_path / 'features.zarr')
+    zarr_utils.save_zarr(true_ds, shared_store)
+    Utils(dict(config_data, save_dir=str(tmp_path), query_year=2021)).save_zarr(true_ds + 1, shared_store)
+    saved = xr.open_zarr(shared_store, group='australia')
+    assert list(saved['time'].dt.year.values) == [2020, 2021]
+    assert np.array_equal(saved['test'].sel(time='2021').values[0], test_array + 1)
+
+
+def test_save_parquet(tmp_path):
+    """Test feature matrix is saved as typed parquet and arrow columns, partitioned by region and year"""
+    pa = pytest.importorskip('pyarrow')
+    pq = pytest.importorskip('pyarrow.parquet')
+
+    features = (['test.mean', 'test.max'], np.array([3.5, -2.0]), np.array([1.0, 0.0]),
+                np.array([[4.5, 1.0], [np.nan, 2.0]]))
+    parquet_utils = Utils(dict(config_data, save_dir=str(tmp_path)))
+    table = pq.read_table(parquet_utils.save_parquet(features))
+    assert table.column_names == ['lat', 'lon', 'test.mean', 'test.max']
+    assert table.schema.field('test.mean').type == pa.float64()
+    assert np.array_equal(table.column('test.mean').to_numpy(), [4.5, np.nan], equal_nan=True)
+    assert pa.ipc.open_file(parquet_utils.save_arrow(features)).read_all().to_pandas().equals(table.to_pandas())
+
+    dataset_dir = str(tmp_path / 'features')
+    parquet_utils.save_parquet(features, dataset_dir)
+    Utils(dict(config_data, save_dir=str(tmp_path), query_year=2021)).save_parquet(features, dataset_dir)
+    table = pq.read_table(dataset_dir, filters=[('year', '=', 2021)])
+    assert table.num_rows == 2
+    assert set(table.column('region').to_pylist()) == {'australia'}
+
+
+def test_combine_series():
+    """Test features of time series runs are saved with a time step per query period"""
+    series_utils = Utils(dict(config_data, query_year=2019, query_end='2020-06-01'))
+    records = [FeatureRecord(lat, 1.0, ['test.mean@2019', 'test.mean@2020'], [lat, lat + 1])
+               for lat in [3.5, -2.0]]
+    features = series_utils.assemble_features([list(enumerate(records))], 2)
+    combined = series_utils.combine_labels(*features)
+    assert list(combined['time'].dt.year.values) == [2019, 2020]
+    assert combined['test.mean'].sel(lat=-2.0, lon=1.0, time='2020').item() == -1.0
+    assert combined['time_bnds'].values[1, 1] == np.datetime64('2021-01-01')
+
+    (names, lats, lons, values), columns = series_utils.get_labelled_features(features)
+    assert names == ['test.mean']
+    assert list(values[:, 0]) == [3.5, -2.0, 4.5, -1.0]
+    assert list(pd.DatetimeIndex(columns['time']).year) == [2019, 2019, 2020, 2020]
+
+
+def test_combine_buffers():
+    """Test features of multi-buffer runs are saved with a buffer step per buffer size"""
+    buffer_utils = Utils(dict(config_data, buffer_sizes=['5000', '25000']))
+    records = [FeatureRecord(lat, 1.0, ['test.mean@5000m', 'test.mean@25000m'], [lat, lat + 1])
+               for lat in [3.5, -2.0]]
+    features = buffer_utils.assemble_features([list(enumerate(records))], 2)
+    combined = buffer_utils.combine_labels(*features)
+    assert list(combined['buffer'].values) == [5000.0, 25000.0]
+    assert combined['buffer'].attrs['units'] == 'm'
+    assert combined['test.mean'].sel(lat=-2.0, lon=1.0, buffer=25000).item() == -1.0
+
+    (names, lats, lons, values), columns = buffer_utils.get_labelled_features(features)
+    assert names == ['test.mean']
+    assert list(values[:, 0]) == [3.5, -2.0, 4.5, -1.0]
+    assert list(columns['buffer']) == [5000.0, 5000.0, 25000.0, 25000.0]
+    pytest.importorskip('pyarrow')
+    assert buffer_utils.get_features_table((names, lats, lons, values), columns).column_names == \
+        ['lat', 'lon', 'buffer', 'test.mean']
@@ -0,0 +1,189 @@
+"""
+Module for fetching GEE data as large cached tiles and windowing
+buffer extents of points from them locally
+"""
+
+import ee
+import numpy as np
+import os
+import math
+
+# Approximate metres per degree of latitude
+METRES_PER_DEGREE = 111320
+
+
+class TileMosaic:
+    def __init__(self, processor_modules, cache_dir, tile_size=2048):
+        """
+        Tiles are laid out on a global EPSG:4326 grid anchored at (-180, 90) at the
+        working resolution of the run, so tiles cached by one region are reused by
+        any other region queried at the same resolution
+        :param processor_modules: ProcessorModules of the run, used to build the GEE image
+        :param cache_dir: directory tiles are cached in
+        :param tile_size: width and height of tiles in pixels
+        """
+        self.processor_modules = processor_modules
+        self.band = processor_modules.band
+        self.default_value = processor_modules.get_default_value()
+        self.tile_size = tile_size
+
+        scale = processor_modules.get_sample_scale()
+        if scale is None:
+            scale = float(processor_modules.resolution)
+        self.scale = scale
+        self.pixel_deg = scale / METRES_PER_DEGREE
+        self.n_rows = int(math.ceil(180 / self.pixel_deg))
+        self.n_cols = int(math.ceil(360 / self.pixel_deg))
+
+        self.cache_dir = '{}/{}_{}_{}_{}_{}m'.format(cache_dir, processor_modules.dataset_name, self.band,
+                                                     processor_modules.year, processor_modules.month,
+                                                     round(scale, 2))
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self.img = None
+
+    def get_window(self, lat, lon, buffer_size):
+        """
+        Get global grid pixel window covering buffer extent of point
+        :param lat: latitude point
+        :param lon: longitude point
+        :param buffer_size: buffer extent in metres
+        :return: first row, last row, first col, last col (exclusive), cols may wrap the antimeridian
+        """
+        dlat = float(buffer_size) / METRES_PER_DEGREE
+        dlon = min(180.0, float(buffer_size) / (METRES_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6)))
+        row_start = max(0, int(math.floor((90 - (lat + dlat)) / self.pixel_deg)))
+        row_end = min(self.n_rows, int(math.floor((90 - (lat - dlat)) / self.pixel_deg)) + 1)
+        col_start = int(math.floor((lon - dlon + 180) / self.pixel_deg))
+        col_end = int(math.floor((lon + dlon + 180) / self.pixel_deg)) + 1
+        return row_start, row_end, col_start, col_end
+
+    def get_point_tiles(self, lat, lon, buffer_size):
+        """
+        Get tiles intersecting buffer extent of point
+        :return: set of (tile row, tile col)
+        """
+        row_start, row_end, col_start, col_end = self.get_window(lat, lon, buffer_size)
+        tile_rows = np.unique(np.arange(row_start, row_end) // self.tile_size)
+        tile_cols = np.unique((np.arange(col_start, col_end) % self.n_cols) // self.tile_size)
+        return set((int(r), int(c)) for r in tile_rows for c in tile_cols)
+
+    def get_required_tiles(self, points):
+        """
+        Get all tiles intersecting buffer extents of points that are sampled
+        :param points: list of points from getRequests
+        :return: sorted list of (tile row, tile col)
+        """
+        tiles = set()
+        for point in points:
+            lon, lat = point['coordinates']
+            if not self.processor_modules.skip_point(lat, lon):
+                tiles.update(self.get_point_tiles(lat, lon, point['buffer']))
+        return sorted(tiles)
+
+    def fetch_tiles(self, points, io_engine):
+        """
+        Download all tiles needed by points that are not already cached
+        :param points: list of points from getRequests
+        :param io_engine: IOEngine tiles are downloaded concurrently with
+        """
+        tiles = self.get_required_tiles(points)
+        missing = [tile for tile in tiles if not os.path.isfile(self.get_tile_path(*tile))]
+        print('Fetching {} of {} tiles covering {} points'.format(len(missing), len(tiles), len(points)))
+        io_engine.map_io(self.fetch_tile, missing)
+
+    def get_tile_shape(self, tile_row, tile_col):
+        """
+        Get height, width of tile, tiles at the grid edge are smaller
+        """
+        height = min(self.tile_size, self.n_rows - tile_row * self.tile_size)
+        width = min(self.tile_size, self.n_cols - tile_col * self.tile_size)
+        return height, width
+
+    def get_tile_path(self, tile_row, tile_col):
+        return '{}/tile_{}_{}_{}.npy'.format(self.cache_dir, self.tile_size, tile_row, tile_col)
+
+    def fetch_tile(self, tile_row, tile_col):
+        """
+        Download tile from GEE and cache it, if not already cached
+        :param tile_row: tile row in global grid
+        :param tile_col: tile col in global grid
+        :return: path of cached tile
+        """
+        tile_path = self.get_tile_path(tile_row, tile_col)
+        if os.path.isfile(tile_path):
+            return tile_path
+
+        if self.img is None:
+            # Masked pixels are set to the default value, as sampleRectangle does
+            self.img = self.processor_modules.prepare_image().unmask(self.default_value)
+
+        height, width = self.get_tile_shape(tile_row, tile_col)
+        request = {
+            'expression': self.img,
+            'fileFormat': 'NUMPY_NDARRAY',
+            'grid': {
+                'dimensions': {'width': width, 'height': height},
+                'affineTransform': {
+                    'scaleX': self.pixel_deg,
+                    'shearX': 0,
+                    'translateX': -180 + tile_col * self.tile_size * self.pixel_deg,
+                    'shearY': 0,
+                    'scaleY': -self.pixel_deg,
+                    'translateY': 90 - tile_row * self.tile_size * self.pixel_deg,
+                },
+                'crsCode': 'EPSG:4326',
+            },
+        }
+        tile = np.array(ee.data.computePixels(request)[self.band])
+
+        # Write then rename so an interrupted download never leaves a partial tile in the cache
+        tmp_path = '{}.{}.tmp.npy'.format(tile_path[:-4], os.getpid())
+        np.save(tmp_path, tile)
+        os.replace(tmp_path, tile_path)
+        return tile_path
+
+    def load_tile(self, tile_row, tile_col):
+        """
+        Load cached tile, memory-mapped so only windowed pixels are read from disk
+        """
+        return np.load(self.fetch_tile(tile_row, tile_col), mmap_mode='r')
+
+    def get_band_array(self, lat, lon, buffer_size):
+        """
+        Cut buffer extent of point out of cached tiles
+        :param lat: latitude point
+        :param lon: longitude point
+        :param buffer_size: buffer extent in metres
+        :return: numpy array of band
+        """
+        row_start, row_end, col_start, col_end = self.get_window(lat, lon, buffer_size)
+        rows = np.arange(row_start, row_end)
+        cols = np.arange(col_start, col_end) % self.n_cols
+
+        band_arr = None
+        for tile_row in np.unique(rows // self.tile_size):
+            row_sel = (rows // self.tile_size) == tile_row
+            for tile_col in np.unique(cols // self.tile_size):
+                col_sel = (cols // self.tile_size) == tile_col
+                tile = self.load_tile(int(tile_row), int(tile_col))
+                if band_arr is None:
+                    band_arr = np.empty((len(rows), len(cols)), dtype=tile.dtype)
+                band_arr[np.ix_(row_sel, col_sel)] = tile[np.ix_(rows[row_sel] - tile_row * self.tile_size,
+                                                                  cols[col_sel] - tile_col * self.tile_size)]
+        return band_arr
+
+    def fetch_arrays(self, points):
+        """
+        Get band arrays over buffer extent of points from cached tiles
+        :param points: list of points from getRequests, tiles must have been fetched with fetch_tiles
+        :return: list of numpy arrays, ordered as points
+        """
+        arrays = []
+        for point in points:
+            lon, lat = point['coordinates']
+            if self.processor_modules.skip_point(lat, lon):
+                arrays.append(self.processor_modules.get_default_array())
+            else:
+                arrays.append(self.get_band_array(lat, lon, point['buffer']))
+        return arrays
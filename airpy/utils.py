@@ -3,69 +3,137 @@ Module for utility functions for pyaq
 """
 
 import xarray as xr
-from datetime import datetime, timedelta
 import pandas as pd
 import ee
 import h5py
 import os
 import numpy as np
 import math
+from feature_record import FeatureRecord
+from image_store import ImageStore
+
+# Query month names of config and their month numbers
+MONTHS = {'jan': '01', 'feb': '02', 'mar': '03', 'apr': '04', 'may': '05', 'june': '06',
+          'july': '07', 'aug': '08', 'sept': '09', 'oct': '10', 'nov': '11', 'dec': '12'}
+# Separates feature name and label of features calculated for each time step of time series runs or each
+# buffer size of multi-buffer runs, i.e. nightlight.avg_rad.mean@2012-04 or fire.LandCover.mode@5000m
+LABEL_SEPARATOR = '@'
+
+
+def get_time_steps(year, month, end_date, cadence):
+    """
+    Get time steps of a time series run, every month from the query month for
+    monthly datasets, every year from the query year for yearly datasets
+    :param year: query year
+    :param month: query month, i.e. jan
+    :param end_date: last date of series, format YYYY-MM-DD
+    :param cadence: dataset time cadence, yearly or monthly
+    :return: list of (year, month) of each time step
+    """
+    month_names = {number: name for name, number in MONTHS.items()}
+    if cadence == 'monthly':
+        dates = pd.date_range(pd.Timestamp(int(year), int(MONTHS[month]), 1), end_date, freq='MS')
+        return [(date.year, month_names['{:02d}'.format(date.month)]) for date in dates]
+    return [(step_year, month) for step_year in range(int(year), pd.Timestamp(end_date).year + 1)]
+
+
+def get_label_name(name, label):
+    """
+    Get name of feature calculated for a time step or buffer size
+    :param name: feature name
+    :param label: label from get_series_label or get_buffer_label
+    :return: feature name with label, i.e. nightlight.avg_rad.mean@2012-04
+    """
+    return '{}{}{}'.format(name, LABEL_SEPARATOR, label)
+
+
+def get_series_label(year, month, cadence):
+    """
+    Get label of a time step of a time series run
+    :param year: year of time step
+    :param month: month of time step
+    :param cadence: dataset time cadence, yearly or monthly
+    :return: label, i.e. 2012-04 for monthly or 2012 for yearly datasets
+    """
+    if cadence == 'monthly':
+        return '{}-{}'.format(year, MONTHS[month])
+    return '{}'.format(year)
+
+
+def get_buffer_label(buffer_size):
+    """
+    Get label of a buffer size of a multi-buffer run
+    :param buffer_size: buffer extent in metres
+    :return: label, i.e. 5000m
+    """
+    return '{}m'.format(buffer_size)
 
 
 class Utils:
     def __init__(self, config_data=None):
         self.config_data = config_data
 
-    def add_time_data(self, ds):
+    def add_time_data(self, ds, time_mode='daily'):
         """
         Add time component to xarray dataset
         depending on time cadence (yearly, monthly)
         :param ds: xarray dataset
-        :param config_file: user-specified config file
-        :return:
+        :param time_mode: daily to add a daily time axis over the query period,
+        features are broadcast without copying but are repeated for each day when saved.
+        bounds to store features once with a single time step and CF time bounds of the
+        query period, expanded to the daily time axis when read with expand_time_data
+        :return: xarray dataset with time dim
         """
-        ds_cadence = self.config_data['dataset']['t_cadence']
-        ds_year = self.config_data['query_year']
-        ds_month = self.config_data['query_month']
-
-        startdate = datetime(ds_year, 1, 1)
-        date_list = []
-
-        mon_31_days = ['jan', 'mar', 'may', 'july', 'aug', 'oct', 'dec']
-        mon_30_days = ['apr', 'june', 'sept', 'nov']
-
-        leap_years = [2000, 2004, 2008, 2012, 2016, 2020, 2024]
-        if int(ds_year) in leap_years:
-            year_len = 366
-        else:
-            year_len = 365
-        if ds_cadence == 'yearly':
-            for i in range(year_len):
-                d = startdate + timedelta(days=i)
-                date_list.append(pd.Timestamp(d.strftime('%Y-%m-%d')))
-        elif ds_cadence == 'monthly':
-            if ds_month in mon_31_days:
-                mon_len = 31
-            elif ds_month in mon_30_days:
-                mon_len = 30
-            elif ds_month == 'feb':
-                if int(ds_year) in leap_years:
-                    mon_len = 29
-                else:
-                    mon_len = 28
-            for i in range(mon_len):
-                d = startdate + timedelta(days=i)
-                date_list.append(pd.Timestamp(d.strftime('%Y-%m-%d')))
-
-        ds = ds.expand_dims(dim={'time': date_list}, axis=0)
-        ds = ds.set_coords('time')
         # remove dim_0 artifact
         if 'dim_0' in [i for i in ds.dims]:
             ds = ds.squeeze('dim_0')
-        ds = ds.transpose('lon', 'lat', 'time')
+        start, end = self.get_time_bounds()
+
+        if time_mode == 'bounds':
+            ds = ds.expand_dims(dim={'time': [start]}, axis=0)
+            ds = ds.assign_coords(time_bnds=(('time', 'bnds'), [[start, end]]))
+            ds['time'].attrs['bounds'] = 'time_bnds'
+        elif time_mode == 'daily':
+            ds = ds.expand_dims(dim={'time': pd.date_range(start, end, inclusive='left')}, axis=0)
+        else:
+            raise ValueError('Unsupported time mode {}, must be daily or bounds'.format(time_mode))
+        ds = ds.set_coords('time')
+        ds = ds.transpose('lon', 'lat', 'time', ..., missing_dims='ignore')
 
         return ds
 
+    def get_time_bounds(self, year=None, month=None):
+        """
+        Get query period of run, the year for yearly datasets
+        or the month for monthly datasets
+        :param year: query year, default query year of run
+        :param month: query month, default query month of run
+        :return: first day, day after last day as pandas Timestamps
+        """
+        start = self.get_query_date(year, month)
+        if self.config_data['dataset']['t_cadence'] == 'monthly':
+            return start, start + pd.DateOffset(months=1)
+        return start, start + pd.DateOffset(years=1)
+
+    def expand_time_data(self, ds):
+        """
+        Expand features saved with time bounds by add_time_data to a daily time axis
+        over each time step's bounds, as saved with the daily time mode. Features of a
+        single time step are broadcast along time without copying
+        :param ds: xarray dataset with time_bnds, i.e. opened from saved netcdf or zarr
+        :return: xarray dataset with daily time axis
+        """
+        bounds = ds['time_bnds'].values
+        dates = [pd.date_range(step_start, step_end, inclusive='left') for step_start, step_end in bounds]
+        ds = ds.drop_vars('time_bnds')
+        if len(dates) == 1:
+            ds = ds.isel(time=0, drop=True).expand_dims(dim={'time': dates[0]}, axis=0)
+        else:
+            ds = ds.isel(time=np.repeat(np.arange(len(dates)), [len(step) for step in dates]))
+            ds = ds.assign_coords(time=np.concatenate([step.values for step in dates]))
+        ds['time'].attrs.pop('bounds', None)
+        return ds.transpose('lon', 'lat', 'time', ..., missing_dims='ignore')
+
     def get_img_from_collect(self, data, collect_cadence, analysis_month, analysis_year):
         """
         Get img of interest from collection. Currently supports monthly, yearly cadence.
@@ -78,14 +146,11 @@ class Utils:
         :return: GEE image
         """
 
-        months_dict = {'jan': '01', 'feb': '02', 'mar': '03', 'apr': '04', 'may': '05', 'june': '06',
-                       'july': '07', 'aug': '08', 'sept': '09', 'oct': '10', 'nov': '11', 'dec': '12'}
-
         if collect_cadence == 'yearly':
             img = data.first()
             return img
         if collect_cadence == 'monthly':
-            mon = months_dict[analysis_month]
+            mon = MONTHS[analysis_month]
             if analysis_month in ['jan', 'feb', 'mar', 'apr', 'may', 'june', 'july', 'aug']:
                 im = data.filterDate('{}-{}-01'.format(analysis_year, mon),
                                      '{}-0{}-01'.format(analysis_year, int(mon[1]) + 1))
@@ -107,22 +172,22 @@ class Utils:
                 img = im.first()
                 return img
 
-    def get_allowable_buffer_size(self, resolution):
+    def get_allowable_buffer_size(self, resolution, max_allowable_pixels=262144):
         """
         param resolution: dataset resolution
+        param max_allowable_pixels: GEE pixel limit, default sampleRectangle limit
         :return:
         Returns the maximum allowable buffer size for the given dataset resolution
         """
-        max_allowable_pixels = 262144
         max_allowable_radius = np.sqrt(max_allowable_pixels/math.pi)
         allowable_buffer_size = max_allowable_radius * float(resolution)
         return float(allowable_buffer_size)
 
-    def get_resampled_resolution_size(self, buffer_size):
+    def get_resampled_resolution_size(self, buffer_size, max_allowable_pixels=262144):
         """
         Calculate the resampled resolution size based on buffer_size
+        param max_allowable_pixels: GEE pixel limit, default sampleRectangle limit
         """
-        max_allowable_pixels = 262144
         max_allowable_radius = np.sqrt(max_allowable_pixels / math.pi)
         # Doubling for redundancy
         allowable_resolution = (float(buffer_size)/max_allowable_radius)*2
@@ -159,34 +224,215 @@ class Utils:
 
     def combine_data(self, results_list):
         """
-        Combine data into xarray format
-        :param results_list: list of xarray datasets to combine
+        Combine data into xarray format. Each point's features are placed into
+        preallocated lat, lon arrays by index lookup, so assembly scales linearly
+        with the number of points. Cells without a point are NaN
+        :param results_list: list of FeatureRecords or xarray datasets to combine
+        :return: xarray of results
+        """
+        if isinstance(results_list[0], FeatureRecord):
+            return self.combine_records(results_list)
+
+        if any('lat' not in result.coords or 'lon' not in result.coords for result in results_list):
+            # Results without lat, lon coordinates cannot be placed on the grid, stack them along new dims
+            return xr.merge([result.expand_dims(dim={'lat': 1, 'lon': 1}) for result in results_list])
+
+        lats = np.unique(np.array([result['lat'].values for result in results_list]))
+        lons = np.unique(np.array([result['lon'].values for result in results_list]))
+        lat_index = {lat: i for i, lat in enumerate(lats.tolist())}
+        lon_index = {lon: j for j, lon in enumerate(lons.tolist())}
+
+        # Variables are kept in order of first appearance
+        data_vars = {}
+        for result in results_list:
+            i = lat_index[result['lat'].values.item()]
+            j = lon_index[result['lon'].values.item()]
+            for var in result.data_vars:
+                values = result[var].values
+                if var not in data_vars:
+                    data = np.full((len(lats), len(lons)) + values.shape, np.nan)
+                    data_vars[var] = (['lat', 'lon'] + list(result[var].dims), data)
+                data_vars[var][1][i, j] = values
+
+        return xr.Dataset(data_vars=data_vars, coords={'lat': lats, 'lon': lons})
+
+    def combine_records(self, records):
+        """
+        Combine FeatureRecords of points into xarray on lat, lon grid,
+        cells without a point are NaN
+        :param records: list of FeatureRecords
         :return: xarray of results
         """
-        new_results = []
-        for i in range(len(results_list)):
-            new_results.append(results_list[i].expand_dims(dim={'lat': 1, 'lon': 1}))
+        return self.combine_features(*self.assemble_features([list(enumerate(records))], len(records)))
 
-        data_xr = new_results[0].merge(new_results[1])
-        for n in range(len(new_results)-2):
-            data_xr = data_xr.merge(new_results[n+2])
+    def assemble_features(self, chunks, n_points):
+        """
+        Assemble FeatureRecords of points into a feature matrix, reading one chunk
+        of records at a time, so memory is bounded by the output and not by the
+        records. Features are kept in order of first appearance
+        :param chunks: iterable of lists of (point index, FeatureRecord), i.e. from CheckpointStore.iter_chunks
+        :param n_points: number of points
+        :return: feature names, lats, lons, feature values (points x features, NaN if missing)
+        """
+        names = []
+        name_index = {}
+        lats = [None] * n_points
+        lons = [None] * n_points
+        values = np.full((n_points, 0), np.nan)
+        for chunk in chunks:
+            # Records of a run normally share one names tuple, group them so each group is placed at once
+            groups = {}
+            for index, record in chunk:
+                lats[index] = record.lat
+                lons[index] = record.lon
+                groups.setdefault(record.names, []).append((index, record.values))
+            for group_names, group in groups.items():
+                new_names = [name for name in group_names if name not in name_index]
+                for name in new_names:
+                    name_index[name] = len(names)
+                    names.append(name)
+                if len(new_names) > 0:
+                    values = np.hstack([values, np.full((n_points, len(new_names)), np.nan)])
+                rows = np.array([index for index, _ in group])
+                cols = np.array([name_index[name] for name in group_names])
+                values[rows[:, None], cols[None, :]] = np.stack([record_values for _, record_values in group])
+        return names, np.array(lats), np.array(lons), values
+
+    def combine_features(self, names, lats, lons, values):
+        """
+        Place feature matrix of points into xarray on lat, lon grid,
+        cells without a point are NaN
+        :param names: feature names
+        :param lats: latitude of each point
+        :param lons: longitude of each point
+        :param values: feature values, points x features
+        :return: xarray of results
+        """
+        lat_coords, lat_idx = np.unique(lats, return_inverse=True)
+        lon_coords, lon_idx = np.unique(lons, return_inverse=True)
 
-        return data_xr
+        data = np.full((len(names), len(lat_coords), len(lon_coords)), np.nan)
+        data[:, lat_idx, lon_idx] = values.T
 
-    def save_collection(self, results_data):
+        data_vars = {name: (['lat', 'lon'], data[i]) for i, name in enumerate(names)}
+        return xr.Dataset(data_vars=data_vars, coords={'lat': lat_coords, 'lon': lon_coords})
+
+    def get_time_steps(self):
         """
-        Save xarray of features from collection to netcdf
-        :param config_file: user specified config
-        :param results_data: xarray of calculated GEE features
+        Get time steps of run
+        :return: list of (year, month) of each time step, None if not a time series run
+        """
+        if self.config_data.get('query_end') is None:
+            return None
+        return get_time_steps(self.config_data['query_year'], self.config_data['query_month'],
+                              self.config_data['query_end'], self.config_data['dataset']['t_cadence'])
+
+    def get_buffer_sizes(self):
+        """
+        Get buffer sizes of run
+        :return: list of buffer sizes, None if not a multi-buffer run
+        """
+        return self.config_data.get('buffer_sizes')
+
+    def split_features(self, names, values, labels):
+        """
+        Split feature matrix of features calculated for several labels, the time steps of
+        time series runs or buffer sizes of multi-buffer runs, into the feature matrix of each label
+        :param names: feature names with label, see get_label_name
+        :param values: feature values, points x features
+        :param labels: list of labels
+        :return: feature names without label, list of feature values of each label
+        """
+        base_names = list(dict.fromkeys(name.rsplit(LABEL_SEPARATOR, 1)[0] for name in names))
+        column = {name: i for i, name in enumerate(names)}
+        # Features missing for a label index the trailing NaN column
+        values = np.hstack([values, np.full((len(values), 1), np.nan)])
+        label_values = []
+        for label in labels:
+            columns = [column.get(get_label_name(name, label), -1) for name in base_names]
+            label_values.append(values[:, columns])
+        return base_names, label_values
+
+    def get_labels(self):
+        """
+        Get labels of features of time series or multi-buffer run, and their coordinate
+        :return: dimension name, list of labels, coordinate value of each label
+        """
+        if self.get_buffer_sizes() is not None:
+            buffer_sizes = self.get_buffer_sizes()
+            return 'buffer', [get_buffer_label(size) for size in buffer_sizes], [float(size) for size in buffer_sizes]
+        cadence = self.config_data['dataset']['t_cadence']
+        time_steps = self.get_time_steps()
+        return 'time', [get_series_label(year, month, cadence) for year, month in time_steps], \
+            [self.get_query_date(year, month) for year, month in time_steps]
+
+    def combine_labels(self, names, lats, lons, values):
+        """
+        Place feature matrix of points of a time series or multi-buffer run into xarray on
+        lat, lon grid with a time dim of a step per query period, labelled by its first day
+        with CF time bounds so it can be expanded to a daily time axis with expand_time_data,
+        or a buffer dim of buffer sizes in metres
+        :param names: feature names with label, see get_label_name
+        :param lats: latitude of each point
+        :param lons: longitude of each point
+        :param values: feature values, points x features
+        :return: xarray of results with lon, lat, time or buffer dims
+        """
+        dim, labels, coords = self.get_labels()
+        base_names, label_values = self.split_features(names, values, labels)
+        lat_coords, lat_idx = np.unique(lats, return_inverse=True)
+        lon_coords, lon_idx = np.unique(lons, return_inverse=True)
+
+        data = np.full((len(base_names), len(labels), len(lat_coords), len(lon_coords)), np.nan)
+        for i, label_value in enumerate(label_values):
+            data[:, i, lat_idx, lon_idx] = label_value.T
+
+        data_vars = {name: ([dim, 'lat', 'lon'], data[i]) for i, name in enumerate(base_names)}
+        ds = xr.Dataset(data_vars=data_vars, coords={dim: coords, 'lat': lat_coords, 'lon': lon_coords})
+        if dim == 'time':
+            bounds = [self.get_time_bounds(year, month) for year, month in self.get_time_steps()]
+            ds = ds.assign_coords(time_bnds=(('time', 'bnds'), bounds))
+            ds['time'].attrs['bounds'] = 'time_bnds'
+        else:
+            ds['buffer'].attrs['units'] = 'm'
+        return ds.transpose('lon', 'lat', dim, ...)
+
+    def get_labelled_features(self, features):
+        """
+        Get feature matrix of a time series or multi-buffer run with a row per point and label
+        :param features: feature names, lats, lons, feature values from assemble_features
+        :return: feature names, lats, lons, feature values, dictionary of time or buffer column of each row
+        """
+        names, lats, lons, values = features
+        dim, labels, coords = self.get_labels()
+        base_names, label_values = self.split_features(names, values, labels)
+        column = np.repeat(np.array(coords), len(lats))
+        if dim == 'time':
+            column = column.astype('datetime64[ns]')
+        return (base_names, np.tile(lats, len(labels)), np.tile(lons, len(labels)), np.vstack(label_values)), \
+            {dim: column}
+
+    def get_save_name(self):
+        """
+        Get file name features are saved as, creating the save directory
+        if it does not already exist
+        :return: file name without extension
         """
         save_dir = self.config_data['save_dir']
         name = self.config_data['dataset']['name']
         year = self.config_data['query_year']
         month = self.config_data['query_month']
         buffer = self.config_data['buffer_size']
+        if self.get_buffer_sizes() is not None:
+            # Multi-buffer runs are named by all their buffer sizes
+            buffer = '-'.join(str(size) for size in self.get_buffer_sizes())
         cadence = self.config_data['dataset']['t_cadence']
         region = self.config_data['region']['extent']
         band = self.config_data['band']
+        if self.config_data.get('query_end') is not None:
+            # Time series runs are named by their first and last time step
+            end = self.config_data['query_end']
+            year = '{}_to_{}'.format(year, end[:7] if cadence == 'monthly' else end[:4])
 
         # Create save directory if it does not already exist
         if not os.path.exists(save_dir):
@@ -199,10 +445,19 @@ class Utils:
 
         if cadence == 'yearly':
             save_name = '{}_{}_{}_{}_buffersize_{}_{}'.format(name, band, year, region, buffer, add_time)
-            print(save_name)
         if cadence == 'monthly':
             save_name = '{}_{}_{}_{}_{}_buffersize_{}_{}'.format(name, band, month, year, region, buffer, add_time)
-            print(save_name)
+        return save_name
+
+    def save_collection(self, results_data):
+        """
+        Save xarray of features from collection to netcdf
+        :param config_file: user specified config
+        :param results_data: xarray of calculated GEE features
+        """
+        save_dir = self.config_data['save_dir']
+        save_name = self.get_save_name()
+        print(save_name)
 
         if type(results_data) is xr.core.dataset.Dataset:
             results_data.to_netcdf('{}/{}.nc'.format(save_dir, save_name))
@@ -210,6 +465,64 @@ class Utils:
         else:
             return False
 
+    def save_zarr(self, results_data, store=None, chunk_size=256):
+        """
+        Save xarray of features from collection to a chunked, Zstd compressed zarr store,
+        read lazily with dask by xr.open_zarr. Variables are chunked along lat, lon.
+        If a shared store is given, each region is saved as a group of the store and
+        later runs of the region (i.e. other years) are appended along time
+        :param results_data: xarray of calculated GEE features
+        :param store: path of shared zarr store, default one store per run in save_dir
+        :param chunk_size: chunk length along lat and lon
+        :return: path of zarr store
+        """
+        # zarr is only needed for zarr output
+        import zarr
+        from numcodecs import Blosc
+
+        compressor = Blosc(cname='zstd', clevel=5, shuffle=Blosc.BITSHUFFLE)
+
+        group = None
+        if store is None:
+            store = '{}/{}.zarr'.format(self.config_data['save_dir'], self.get_save_name())
+            mode = 'w'
+        else:
+            group = self.config_data['region']['extent']
+            mode = 'a'
+            if 'time' not in results_data.dims:
+                # Runs are appended along time, labelled by query date
+                results_data = results_data.expand_dims(dim={'time': [self.get_query_date()]})
+
+        appending = False
+        if group is not None and os.path.exists(store):
+            appending = group in zarr.open_group(store, mode='r')
+        if appending:
+            results_data.to_zarr(store, group=group, mode=mode, append_dim='time')
+            return store
+
+        encoding = {}
+        for var in results_data.data_vars:
+            dims = results_data[var].dims
+            chunks = tuple(min(chunk_size, results_data.sizes[dim]) if dim in ['lat', 'lon']
+                           else results_data.sizes[dim] for dim in dims)
+            encoding[var] = {'compressor': compressor, 'chunks': chunks}
+        results_data.to_zarr(store, group=group, mode=mode, encoding=encoding)
+        return store
+
+    def get_query_date(self, year=None, month=None):
+        """
+        Get first day of query period of run
+        :param year: query year, default query year of run
+        :param month: query month, default query month of run
+        :return: pandas Timestamp
+        """
+        if year is None:
+            year, month = self.config_data['query_year'], self.config_data['query_month']
+        month_number = 1
+        if self.config_data['dataset']['t_cadence'] == 'monthly':
+            month_number = int(MONTHS[month])
+        return pd.Timestamp(int(year), month_number, 1)
+
     def save_img(self, results_data):
         """
         Save individual images
@@ -225,48 +538,141 @@ class Utils:
             h5_dataset.attrs['lon'] = results_data['lon']
             h5_dataset.attrs['year'] = self.config_data['year']
 
+    def get_image_store(self, items):
+        """
+        Get HDF5 image store of band arrays of an images run, saved in save_dir
+        with the dataset, band, query date, region and buffer of the run as attributes
+        :param items: list of points from getRequests
+        :return: ImageStore
+        """
+        attrs = {'dataset': self.config_data['dataset']['name'],
+                 'collection': self.config_data['dataset']['collection'],
+                 'band': self.config_data['band'],
+                 'resolution': str(self.config_data['dataset']['resolution']),
+                 'query_year': int(self.config_data['query_year']),
+                 'query_month': self.config_data['query_month'],
+                 'region': self.config_data['region']['extent'],
+                 'buffer_size': str(self.config_data['buffer_size'])}
+        return ImageStore('{}/{}_images.h5'.format(self.config_data['save_dir'], self.get_save_name()), items, attrs)
+
+    def save_imgs(self, results_list):
+        """
+        Save band arrays of points of an images run to a single HDF5 image store
+        :param results_list: list of results of process_collection_for_img
+        :return: True if saved
+        """
+        items = [{'coordinates': [result['lon'], result['lat']]} for result in results_list]
+        image_store = self.get_image_store(items)
+        image_store.open()
+        for i, result in enumerate(results_list):
+            image_store.append(i, result)
+        image_store.close()
+        print('Saved to {}'.format(image_store.path))
+        return True
+
     def save_custom_df(self, results_data):
         """
         If custom lat, lon json list specified, save as
         a dataframe of lat, lon and variables respectively
         """
-        save_dir = self.config_data['save_dir']
-        name = self.config_data['dataset']['name']
-        year = self.config_data['query_year']
-        month = self.config_data['query_month']
-        buffer = self.config_data['buffer_size']
-        cadence = self.config_data['dataset']['t_cadence']
-        region = self.config_data['region']['extent']
-        band = self.config_data['band']
+        self.save_features_df(self.assemble_features([list(enumerate(results_data))], len(results_data)))
 
-        # Create save directory if it does not already exist
-        if not os.path.exists(save_dir):
-            os.makedirs(save_dir)
-
-        if 'add_time' in self.config_data:
-            add_time = 'with_time'
-        else:
-            add_time = 'no_time'
+    def save_features_df(self, features, columns=None):
+        """
+        Save feature matrix as a dataframe of lat, lon and variables respectively
+        :param features: feature names, lats, lons, feature values from assemble_features
+        :param columns: dictionary of name: value of each row of other columns saved after lon,
+        i.e. time of time series runs
+        """
+        save_dir = self.config_data['save_dir']
+        save_name = self.get_save_name()
+
+        names, lats, lons, values = features
+        df = pd.DataFrame(values, columns=names)
+        for name, column in reversed(list((columns or {}).items())):
+            df.insert(0, name, column)
+        df.insert(0, 'lon', lons.astype(float))
+        df.insert(0, 'lat', lats.astype(float))
+        df.to_csv('{}/{}.csv'.format(save_dir, save_name))
 
-        if cadence == 'yearly':
-            save_name = '{}_{}_{}_{}_buffersize_{}_{}'.format(name, band, year, region, buffer, add_time)
-        if cadence == 'monthly':
-            save_name = '{}_{}_{}_{}_{}_buffersize_{}_{}'.format(name, band, month, year, region, buffer, add_time)
+    def get_features_table(self, features, columns=None):
+        """
+        Get feature matrix as an arrow table of float64 lat, lon and feature
+        columns, taken from the matrix column by column without a dataframe
+        :param features: feature names, lats, lons, feature values from assemble_features
+        :param columns: dictionary of name: value of each row of other columns saved after lon,
+        i.e. time of time series runs
+        :return: pyarrow Table
+        """
+        # pyarrow is only needed for parquet and arrow output
+        import pyarrow as pa
 
-        # Get list of variables and make df column names
+        names, lats, lons, values = features
+        arrays = [pa.array(lats.astype(np.float64)), pa.array(lons.astype(np.float64))]
         column_names = ['lat', 'lon']
-        for i in results_data[0].data_vars:
-            column_names.append(i)
-
-        data = []
-        for result in results_data:
-            data_list = [float(result.lat.values), float(result.lon.values)]
-            for i in result.data_vars:
-                data_list.append(float(result[i].values))
-            data.append(data_list)
-
-        df = pd.DataFrame(data, columns=column_names)
-        df.to_csv('{}/{}.csv'.format(save_dir, save_name))
+        for name, column in (columns or {}).items():
+            if np.issubdtype(column.dtype, np.datetime64):
+                column = column.astype('datetime64[ms]')
+            arrays.append(pa.array(column))
+            column_names.append(name)
+        # Transposed once so each feature column is contiguous
+        arrays += [pa.array(column) for column in np.ascontiguousarray(values.T, dtype=np.float64)]
+        return pa.table(arrays, names=column_names + list(names))
+
+    def save_parquet(self, features, dataset_dir=None, row_group_size=65536, columns=None):
+        """
+        Save feature matrix as a Zstd compressed parquet file. If a dataset
+        directory is given, features are written to a parquet dataset shared
+        by runs, partitioned by region and year, i.e. <dataset_dir>/region=europe/year=2019/
+        :param features: feature names, lats, lons, feature values from assemble_features
+        :param dataset_dir: path of shared parquet dataset, default one file per run in save_dir
+        :param row_group_size: maximum rows per row group
+        :param columns: dictionary of name: value of each row of other columns saved after lon,
+        i.e. time of time series runs, which are partitioned by the year of each row
+        :return: path of parquet file or dataset
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = self.get_features_table(features, columns)
+        save_name = self.get_save_name()
+        if dataset_dir is None:
+            save_path = '{}/{}.parquet'.format(self.config_data['save_dir'], save_name)
+            pq.write_table(table, save_path, compression='zstd', row_group_size=row_group_size)
+            return save_path
+
+        n_points = table.num_rows
+        table = table.append_column('region', pa.array([self.config_data['region']['extent']] * n_points))
+        if columns is not None and 'time' in columns:
+            years = pd.DatetimeIndex(columns['time']).year.values
+        else:
+            years = np.full(n_points, int(self.config_data['query_year']))
+        table = table.append_column('year', pa.array(years, type=pa.int16()))
+        # Files are named by run, so rerunning a run replaces its file and other runs are kept
+        pq.write_to_dataset(table, dataset_dir, partition_cols=['region', 'year'],
+                            basename_template='{}-{{i}}.parquet'.format(save_name),
+                            existing_data_behavior='overwrite_or_ignore', compression='zstd',
+                            row_group_size=row_group_size)
+        return dataset_dir
+
+    def save_arrow(self, features, batch_size=65536, columns=None):
+        """
+        Save feature matrix as a Zstd compressed Arrow IPC file, read
+        memory-mapped with pyarrow.ipc.open_file or pandas.read_feather
+        :param features: feature names, lats, lons, feature values from assemble_features
+        :param batch_size: maximum rows per record batch
+        :param columns: dictionary of name: value of each row of other columns saved after lon,
+        i.e. time of time series runs
+        :return: path of arrow file
+        """
+        import pyarrow as pa
+
+        table = self.get_features_table(features, columns)
+        save_path = '{}/{}.arrow'.format(self.config_data['save_dir'], self.get_save_name())
+        options = pa.ipc.IpcWriteOptions(compression='zstd')
+        with pa.ipc.new_file(save_path, table.schema, options=options) as writer:
+            writer.write_table(table, max_chunksize=batch_size)
+        return save_path
 
     def check_in_arctic_or_antarctic(self, lat):
         """